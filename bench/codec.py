@@ -0,0 +1,78 @@
+"""
+Codec micro-benchmarks by message type: build_message and parse_message (text and
+bytes input) against the line-by-line codec they replaced, kept below for reference.
+Run from the repository root: python -m bench.codec
+"""
+import argparse
+import base64
+import os
+import timeit
+from lsnp.messages import build_message, parse_message
+
+_TOKEN = "alice@10.0.0.1|1999999999|file"
+MESSAGES = {
+    "PING": {"TYPE": "PING", "USER_ID": "alice@10.0.0.1"},
+    "ACK": {"TYPE": "ACK", "MESSAGE_ID": "f3a9c0d1e2b34567", "STATUS": "RECEIVED"},
+    "PROFILE": {"TYPE": "PROFILE", "USER_ID": "alice@10.0.0.1", "DISPLAY_NAME": "Alice",
+                "STATUS": "Exploring LSNP!", "PORT": "50999"},
+    "DM": {"TYPE": "DM", "FROM": "alice@10.0.0.1", "TO": "bob@10.0.0.2", "CONTENT": "hello there, how are you?",
+           "TIMESTAMP": "1700000000", "MESSAGE_ID": "f3a9c0d1e2b34567", "TOKEN": _TOKEN},
+    "TICTACTOE_MOVE": {"TYPE": "TICTACTOE_MOVE", "FROM": "alice@10.0.0.1", "TO": "bob@10.0.0.2", "GAMEID": "g12",
+                       "POSITION": "4", "SYMBOL": "X", "TURN": "3", "MESSAGE_ID": "f3a9c0d1e2b34567", "TOKEN": _TOKEN},
+    "FILE_CHUNK": {"TYPE": "FILE_CHUNK", "FROM": "alice@10.0.0.1", "TO": "bob@10.0.0.2", "FILEID": "ab12cd34",
+                   "CHUNK_INDEX": "17", "TOTAL_CHUNKS": "900", "CHUNK_SIZE": "1200",
+                   "DATA": base64.b64encode(os.urandom(1200)).decode("ascii"), "TOKEN": _TOKEN,
+                   "MESSAGE_ID": "f3a9c0d1e2b34567"},
+}
+
+# ---------- the codec before the single-pass rewrite ----------
+def _old_normalize_key(k: str) -> str:
+    k = k.strip().upper().replace(" ", "")
+    if k in ("MESSAGEID", "MESSAGE_ID"): return "MESSAGE_ID"
+    if k in ("GAMEID", "GAMED"):         return "GAMEID"
+    if k in ("USERID", "USER_ID"):       return "USER_ID"
+    if k in ("GROUPID", "GROUP_ID"):     return "GROUP_ID"
+    if k in ("AVATARDATA","AVATAR_DATA"):       return "AVATAR_DATA"
+    if k in ("AVATARENCODING","AVATAR_ENCODING"): return "AVATAR_ENCODING"
+    if k in ("AVATARTYPE","AVATAR_TYPE"):         return "AVATAR_TYPE"
+    return k
+
+def _old_parse(raw: str):
+    msg = {}
+    for line in raw.replace("\r\n", "\n").split("\n"):
+        if ":" in line:
+            k, v = line.split(":", 1)
+            msg[_old_normalize_key(k.strip().upper())] = v.strip()
+    return msg
+
+def _old_build(fields):
+    lines = []
+    if "TYPE" in fields:
+        lines.append(f"TYPE: {fields['TYPE']}")
+    for k, v in fields.items():
+        if k == "TYPE": continue
+        lines.append(f"{k}: {v}")
+    return "\n".join(lines) + "\n\n"
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Message codec micro-benchmarks (us per message)")
+    p.add_argument("--number", type=int, default=3000, help="calls per timing")
+    p.add_argument("--repeat", type=int, default=7, help="timings per figure (the best is shown)")
+    a = p.parse_args(argv)
+
+    def us(fn) -> float:
+        return min(timeit.repeat(fn, number=a.number, repeat=a.repeat)) / a.number * 1e6
+
+    print(f"{'type':<16}{'build':>8}{'parse str':>11}{'parse bytes':>13}"
+          f"{'old build':>11}{'old parse':>11}{'parse speedup':>15}")
+    for name, fields in MESSAGES.items():
+        text = build_message(fields)
+        data = text.encode("utf-8")
+        assert dict(parse_message(text)) == fields and dict(parse_message(data)) == fields
+        parse = us(lambda: parse_message(text))
+        old_parse = us(lambda: _old_parse(text))
+        print(f"{name:<16}{us(lambda: build_message(fields)):>8.2f}{parse:>11.2f}{us(lambda: parse_message(data)):>13.2f}"
+              f"{us(lambda: _old_build(fields)):>11.2f}{old_parse:>11.2f}{old_parse / parse:>14.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Receive-path allocations per datagram (tracemalloc): a FILE_CHUNK read with
+recvfrom(BUFFER_SIZE) and decoded to str, against the pooled recvfrom_into path with
+lazily decoded fields that Transport uses. Run from the repository root:
+python -m bench.rx_alloc
+"""
+import argparse
+import base64
+import os
+import socket
+import time
+import tracemalloc
+from lsnp.buffers import BufferPool
+from lsnp.constants import BUFFER_SIZE
+from lsnp.messages import build_message, field_payload, parse_message
+
+def _chunk(size: int) -> bytes:
+    return build_message({
+        "TYPE": "FILE_CHUNK", "FROM": "alice@127.0.0.1", "TO": "bob@127.0.0.1", "FILEID": "ab12cd34",
+        "CHUNK_INDEX": "5", "TOTAL_CHUNKS": "10", "CHUNK_SIZE": str(size),
+        "DATA": base64.b64encode(os.urandom(size)).decode("ascii"),
+        "TOKEN": "alice@127.0.0.1|1999999999|file", "MESSAGE_ID": "f3a9c0d1e2b34567",
+    }).encode("utf-8")
+
+def _reads(msg) -> bytes:
+    # what the handler reads of every FILE_CHUNK before the payload
+    msg.get("TYPE"); msg.get("FROM"); msg.get("TOKEN"); msg.get("FILEID")
+    return field_payload(msg, "DATA")
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Allocations per received datagram")
+    p.add_argument("--count", type=int, default=2000, help="datagrams traced per path")
+    p.add_argument("--size", type=int, default=1200, help="chunk payload bytes")
+    a = p.parse_args(argv)
+
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.bind(("127.0.0.1", 0))
+    tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    dest = rx.getsockname()
+    datagram = _chunk(a.size)
+    pool = BufferPool()
+
+    def copying():
+        data, _ = rx.recvfrom(BUFFER_SIZE)
+        return _reads(parse_message(data.decode("utf-8", errors="ignore")))
+
+    def pooled():
+        buf = pool.acquire()
+        try:
+            n, _ = rx.recvfrom_into(buf)
+            with memoryview(buf) as view:
+                return _reads(parse_message(view[:n]))
+        finally:
+            pool.release(buf)
+
+    print(f"{'path':<34}{'peak B/datagram':>16}{'datagrams/s':>14}")
+    for name, recv in (("recvfrom + str decode", copying), ("pooled recvfrom_into, lazy fields", pooled)):
+        for _ in range(50):  # warm up caches and the pool
+            tx.sendto(datagram, dest)
+            recv()
+        tracemalloc.start()
+        peak = 0
+        for _ in range(a.count):
+            tx.sendto(datagram, dest)
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            recv()
+            peak += tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.stop()
+        t0 = time.perf_counter()
+        n = a.count * 10
+        for _ in range(n):
+            tx.sendto(datagram, dest)
+            recv()
+        rate = n / (time.perf_counter() - t0)
+        print(f"{name:<34}{peak / a.count:>16,.0f}{rate:>14,.0f}")
+    rx.close()
+    tx.close()
+
+if __name__ == "__main__":
+    main()
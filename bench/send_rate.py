@@ -0,0 +1,76 @@
+"""
+Send-path datagrams/sec: Transport's long-lived sockets against the socket-per-datagram
+sends it replaced. Run from the repository root: python -m bench.send_rate
+"""
+import argparse
+import socket
+import time
+from lsnp.constants import MULTICAST_GRP, DISCOVERY_PORT
+from lsnp.logger import VerboseLogger
+from lsnp.messages import build_message
+from lsnp.transport import Transport
+
+def _one_shot_unicast(ip: str, port: int, data: bytes):
+    # what send_unicast did before: a fresh socket for every datagram
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    try:
+        s.sendto(data, (ip, port))
+    finally:
+        s.close()
+
+def _one_shot_multicast(data: bytes):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    try:
+        s.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        s.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        s.sendto(data, (MULTICAST_GRP, DISCOVERY_PORT))
+    finally:
+        s.close()
+
+def _rate(send, count: int, drain) -> float:
+    t0 = time.perf_counter()
+    for i in range(count):
+        send()
+        if i % 200 == 0:
+            drain()  # keep the receiver's buffer from filling (dropped datagrams are cheaper)
+    return count / (time.perf_counter() - t0)
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Datagrams/sec on the send path")
+    p.add_argument("--count", type=int, default=50000, help="unicast datagrams per run")
+    p.add_argument("--size", type=int, default=1600, help="DATA bytes in each datagram")
+    p.add_argument("--port", type=int, default=51234, help="unicast port of the sending Transport")
+    a = p.parse_args(argv)
+
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(("127.0.0.1", 0))
+    sink.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    sink.setblocking(False)
+    port = sink.getsockname()[1]
+
+    def drain():
+        try:
+            while True:
+                sink.recv(65535)
+        except BlockingIOError:
+            pass
+
+    msg = build_message({"TYPE": "FILE_CHUNK", "DATA": "A" * a.size})
+    data = msg.encode("utf-8")
+    tx = Transport(a.port, VerboseLogger(False))
+    try:
+        rows = [
+            ("unicast", _rate(lambda: _one_shot_unicast("127.0.0.1", port, data), a.count, drain),
+             _rate(lambda: tx.send_unicast("127.0.0.1", port, msg), a.count, drain)),
+            ("multicast", _rate(lambda: _one_shot_multicast(data), a.count // 5, drain),
+             _rate(lambda: tx.send_multicast(msg), a.count // 5, drain)),
+        ]
+    finally:
+        tx.stop()
+        sink.close()
+    print(f"{'mode':<12}{'per-datagram socket':>22}{'long-lived socket':>20}{'speedup':>10}")
+    for mode, before, after in rows:
+        print(f"{mode:<12}{before:>18,.0f} /s{after:>16,.0f} /s{after / before:>9.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Sender memory over many file transfers on the virtual network (lsnp.sim), windowed and
+legacy (one ACK per chunk), then one legacy send with more chunks than the ACK table
+holds. Run from the repository root: python -m bench.soak
+"""
+import argparse
+import contextlib
+import gc
+import os
+import tempfile
+import tracemalloc
+from lsnp.app import App, build_parser
+from lsnp.constants import ACK_MAX_PENDING
+from lsnp.file_transfer import CAP_FILE_ACK
+from lsnp.sim import VirtualClock, VirtualNetwork, VirtualTransport, _QuietLog
+
+def _pair(latency: float, loss: float = 0.0):
+    clock = VirtualClock()
+    net = VirtualNetwork(clock, latency=latency, loss=loss, seed=1)
+
+    def mk(name, ip):
+        args = build_parser().parse_args(["--name", name, "--ip", ip, "--workers", "0"])
+        return App(args, tx=VirtualTransport(net, ip, _QuietLog()), sched=clock)
+    a, b = mk("alice", "10.0.0.1"), mk("bob", "10.0.0.2")
+    clock.run(5)  # discovery
+    return clock, a, b
+
+def _accept_after(clock, b, delay: float):
+    on_offer = b.files.on_offer
+
+    def accepting(msg, ip):
+        on_offer(msg, ip)
+        fileid = msg.get("FILEID", "")
+        clock.call_later(delay, lambda: b.files.accept(fileid))
+    b.files.on_offer = accepting
+
+def _legacy(a):
+    # alice treats bob as a peer without FILE_ACK: every chunk is tracked on its own
+    supports = a.peers.supports
+    a.peers.supports = lambda uid, cap: cap != CAP_FILE_ACK and supports(uid, cap)
+
+def soak(transfers: int, size: int, legacy: bool):
+    clock, a, b = _pair(0.0005)
+    _accept_after(clock, b, 0.0)
+    if legacy:
+        _legacy(a)
+    with open("src.bin", "wb") as f:
+        f.write(os.urandom(size))
+    tracemalloc.start()
+    rows = []
+    for i in range(transfers):
+        a.commands["file_send"]("bob@10.0.0.2 src.bin")
+        clock.run(clock.time() + 2)
+        if (i + 1) % max(1, transfers // 5) == 0:
+            gc.collect()
+            rows.append((i + 1, tracemalloc.get_traced_memory()[0], len(a.ack_mgr.pending)))
+    tracemalloc.stop()
+    return rows
+
+def big_legacy(size: int, accept_delay: float, loss: float):
+    clock, a, b = _pair(0.001, loss)
+    _accept_after(clock, b, accept_delay)
+    _legacy(a)
+    data = os.urandom(size)
+    with open("big.bin", "wb") as f:
+        f.write(data)
+    failed = []
+    on_fail = a.files.on_fail
+    a.files.on_fail = lambda mid: (failed.append(mid), on_fail(mid))
+    a.commands["file_send"]("bob@10.0.0.2 big.bin")
+    peak = len(a.ack_mgr.pending)  # every chunk is in flight before the accept
+    path = os.path.join("inbox", "alice", "big.bin")
+    clock.run(clock.time() + 120, stop=lambda: os.path.exists(path))
+    ok = os.path.exists(path) and _read(path) == data
+    return ok, peak, len(failed)
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Sender memory over many file transfers")
+    p.add_argument("--transfers", type=int, default=1000, help="transfers per mode")
+    p.add_argument("--size", type=int, default=60000, help="bytes per transfer")
+    p.add_argument("--big", type=int, default=20_000_000, help="bytes of the single large legacy send")
+    p.add_argument("--accept-delay", type=float, default=0.2, help="seconds before the large send is accepted")
+    p.add_argument("--loss", type=float, default=0.01, help="datagram loss during the large send")
+    a = p.parse_args(argv)
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as quiet:
+        os.chdir(tmp)  # inbox/ is relative to the working directory
+        try:
+            with contextlib.redirect_stdout(quiet):
+                results = {mode: soak(a.transfers, a.size, mode == "legacy") for mode in ("windowed", "legacy")}
+                big = big_legacy(a.big, a.accept_delay, a.loss)
+        finally:
+            os.chdir(cwd)
+    print(f"{'mode':<10}{'transfers':>10}{'traced KiB':>12}{'pending':>9}")
+    for mode, rows in results.items():
+        for n, traced, pending in rows:
+            print(f"{mode:<10}{n:>10}{traced / 1024:>12,.0f}{pending:>9}")
+    ok, peak, failed = big
+    print(f"\nlegacy send of {a.big:,} bytes at {a.loss:.0%} loss (ACK table cap {ACK_MAX_PENDING}): "
+          f"{'OK' if ok else 'FAILED'}, {peak} tracked at once, {failed} chunks given up")
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,350 @@
+import heapq
+import itertools
+import random
 import threading
 import time
-from typing import Callable, Dict, Optional
-from .constants import ACK_TIMEOUT_SEC, ACK_MAX_RETRIES
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple, Union
+from .constants import ACK_TIMEOUT_SEC, ACK_MAX_RETRIES, ACK_GIVE_UP_SEC
+from .constants import ACK_RTO_MIN_SEC, ACK_RTO_MAX_SEC, ACK_BACKOFF_JITTER
+from .constants import ACK_DELAY_SEC, ACK_BATCH_MAX, ACK_MAX_PENDING
+
+# PROFILE capability: this peer accepts ACKs whose MESSAGE_ID is a comma list
+CAP_ACK_LIST = "ACKN"
+
+class RttEstimator:
+    """
+    SRTT / RTTVAR / RTO for one peer endpoint, as in RFC 6298:
+      first sample:  SRTT = R, RTTVAR = R/2
+      later:         RTTVAR = 3/4 RTTVAR + 1/4 |SRTT - R|,  SRTT = 7/8 SRTT + 1/8 R
+      RTO = SRTT + 4 RTTVAR, clamped to [ACK_RTO_MIN_SEC, ACK_RTO_MAX_SEC]
+    Until the first sample the RTO is ACK_TIMEOUT_SEC. A timeout doubles the RTO for
+    every later message to the peer until the next valid sample (RFC 6298 5.5-5.7).
+    """
+    __slots__ = ("srtt", "rttvar", "rto", "samples", "backoff")
+
+    def __init__(self):
+        self.srtt: Optional[float] = None
+        self.rttvar: Optional[float] = None
+        self.rto = ACK_TIMEOUT_SEC
+        self.samples = 0
+        self.backoff = 0  # doublings of rto still in force
+
+    @property
+    def current(self) -> float:
+        """The RTO with backoff applied."""
+        return min(ACK_RTO_MAX_SEC, self.rto * (1 << self.backoff))
+
+    def sample(self, r: float):
+        if self.srtt is None:
+            self.srtt, self.rttvar = r, r / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - r)
+            self.srtt = 0.875 * self.srtt + 0.125 * r
+        self.rto = min(ACK_RTO_MAX_SEC, max(ACK_RTO_MIN_SEC, self.srtt + 4 * self.rttvar))
+        self.backoff = 0
+        self.samples += 1
+
+class _Pending:
+    __slots__ = ("mid", "peer", "sent", "due", "retries", "cancelled", "resend", "level")
+
+    def __init__(self, mid: str, peer: Hashable, sent: float, due: float, resend, level: int = 0):
+        self.mid = mid
+        self.peer = peer
+        self.sent = sent
+        self.due = due
+        self.retries = 0
+        self.cancelled = False
+        self.resend = resend
+        self.level = level  # the peer's backoff when the message was tracked
 
 class AckManager:
     """
     Track outgoing messages that require ACK and trigger retries.
-    caller supplies a resend_fn(message_id) to perform the actual resend.
+    Each track() may carry its own resend callable, dropped with its entry on ACK, failure
+    or eviction; resend_fn(message_id) covers entries tracked without one. Timeouts adapt
+    per peer (RttEstimator); README.md, "ACKs and retries", has the rules.
     """
-    def __init__(self, resend_fn: Callable[[str], None], on_fail: Callable[[str], None], log):
-        self.pending: Dict[str, Dict] = {}
+    def __init__(self, resend_fn: Optional[Callable[[str], None]], on_fail: Callable[[str], None], log, start: bool = True, clock=None,
+                 max_pending: int = ACK_MAX_PENDING):
+        # at most max_pending evictable entries: tracking beyond that gives up on the oldest
+        # one (on_fail is called for it as for any other failure)
+        self.max_pending = max_pending
+        self.pending: Dict[str, _Pending] = {}
+        self._capped: Dict[str, _Pending] = {}  # the evictable entries, oldest first
         self.resend_fn = resend_fn
         self.on_fail = on_fail
         self.log = log
+        self.clock = clock or time
+        self.retries = 0   # total resends
+        self.failures = 0  # messages given up on
+        # deadlines: (due, seq, entry). Settling an entry only flags it cancelled; cancelled
+        # entries are skipped when they surface, and the heap is rebuilt once half is dead
+        self._heap: List = []
+        self._seq = itertools.count()
+        self._dead = 0     # cancelled entries still in the heap
+        # guards all state; resend callables and on_fail run outside it
+        self._cond = threading.Condition()
+        # start=True: one thread sleeps until exactly the next deadline. Otherwise a single
+        # timer is armed on `clock` (any time()/call_later scheduler: AsyncioEngine, VirtualClock)
+        self._threaded = start
+        self._rtt: Dict[Hashable, RttEstimator] = {}
+        self._rng = random.Random()
+        self._timer = None
+        self._timer_due = None
         self.running = True
-        threading.Thread(target=self._loop, daemon=True).start()
+        if start:
+            threading.Thread(target=self._loop, daemon=True).start()
+
+    def track(self, message_id: str, peer: Hashable = None, resend: Callable[[], None] = None,
+              evictable: bool = True):
+        evicted = []
+        with self._cond:
+            now = self.clock.time()
+            est = self._rtt.get(peer)
+            due = now + (est.current if est else ACK_TIMEOUT_SEC)
+            ent = _Pending(message_id, peer, now, due, resend, est.backoff if est else 0)
+            old = self.pending.pop(message_id, None)
+            if old is not None:
+                old.cancelled = True
+                self._dead += 1
+                self._capped.pop(message_id, None)
+            if evictable:
+                while len(self._capped) >= self.max_pending:
+                    oldest = self._capped.pop(next(iter(self._capped)))
+                    del self.pending[oldest.mid]
+                    oldest.cancelled = True
+                    self._dead += 1
+                    self.failures += 1
+                    evicted.append(oldest.mid)
+                self._capped[message_id] = ent
+            self.pending[message_id] = ent
+            heapq.heappush(self._heap, (due, next(self._seq), ent))
+            if self._heap[0][2] is ent:
+                self._wake(due)
+        for mid in evicted:
+            self.log.warn(f"ACK table full, giving up on MESSAGE_ID={mid}")
+            self.on_fail(mid)
+
+    def acked(self, message_ids: Union[str, Iterable[str]]):
+        """Settle one MESSAGE_ID, or a batch of them from a coalesced ACK (one lock round trip)."""
+        self._settle(message_ids, True)
+
+    def discard(self, message_ids: Union[str, Iterable[str]]):
+        """Stop tracking without an ACK (the exchange completed some other way); no RTT sample."""
+        self._settle(message_ids, False)
+
+    def _settle(self, message_ids, sample: bool):
+        if isinstance(message_ids, str):
+            message_ids = (message_ids,)
+        with self._cond:
+            now = self.clock.time()
+            for mid in message_ids:
+                ent = self.pending.pop(mid, None)
+                if ent is None:
+                    continue
+                self._capped.pop(mid, None)
+                ent.cancelled = True
+                self._dead += 1
+                if sample and ent.retries == 0 and ent.peer is not None:  # Karn: only unambiguous samples
+                    est = self._rtt.get(ent.peer)
+                    if est is None:
+                        est = self._rtt[ent.peer] = RttEstimator()
+                    est.sample(now - ent.sent)
+            if self._dead > 64 and self._dead * 2 > len(self._heap):
+                self._heap = [item for item in self._heap if not item[2].cancelled]
+                heapq.heapify(self._heap)
+                self._dead = 0
+
+    def sample(self, peer: Hashable, r: float):
+        """Feed an RTT measured outside the table (a chunk sent once and then acknowledged)."""
+        with self._cond:
+            est = self._rtt.get(peer)
+            if est is None:
+                est = self._rtt[peer] = RttEstimator()
+            est.sample(r)
 
-    def track(self, message_id: str):
-        self.pending[message_id] = {"retries": 0, "next_due": time.time() + ACK_TIMEOUT_SEC}
+    def rto_of(self, peer: Hashable) -> float:
+        with self._cond:
+            est = self._rtt.get(peer)
+            return est.current if est else ACK_TIMEOUT_SEC
 
-    def acked(self, message_id: str):
-        self.pending.pop(message_id, None)
+    def srtt_of(self, peer: Hashable) -> Optional[float]:
+        with self._cond:
+            est = self._rtt.get(peer)
+            return est.srtt if est else None
+
+    def peer_stats(self) -> Dict[Hashable, Dict[str, float]]:
+        """peer -> {srtt, rttvar, rto (backed off), samples} (seconds)."""
+        with self._cond:
+            return {peer: {"srtt": e.srtt, "rttvar": e.rttvar, "rto": e.current, "samples": e.samples}
+                    for peer, e in self._rtt.items()}
+
+    def _backoff(self, ent: _Pending) -> float:
+        # called with the lock held: each retry doubles the entry's wait, starting from the
+        # backoff its peer had when it was tracked, and the peer keeps the deepest backoff
+        # reached so new messages start there too
+        if ent.peer is None:
+            base = ACK_TIMEOUT_SEC * (2 ** ent.retries)
+        else:
+            est = self._rtt.get(ent.peer)
+            if est is None:
+                est = self._rtt[ent.peer] = RttEstimator()
+            doublings = min(ent.level + ent.retries, 16)
+            est.backoff = max(est.backoff, doublings)
+            base = est.rto * (1 << doublings)
+        wait = base * (1 + self._rng.uniform(-ACK_BACKOFF_JITTER, ACK_BACKOFF_JITTER))
+        return min(ACK_RTO_MAX_SEC, wait)
+
+    def next_due(self) -> Optional[float]:
+        with self._cond:
+            self._skip_dead()
+            return self._heap[0][0] if self._heap else None
+
+    def _skip_dead(self):
+        heap = self._heap
+        while heap and heap[0][2].cancelled:
+            heapq.heappop(heap)
+            self._dead -= 1
+
+    def _wake(self, due: float):
+        # called with the lock held when `due` became the earliest deadline
+        if self._threaded:
+            self._cond.notify()
+        elif self._timer_due is None or due < self._timer_due:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer_due = due
+            self._timer = self.clock.call_later(due - self.clock.time(), self._on_timer)
+
+    def _on_timer(self):
+        with self._cond:
+            self._timer = self._timer_due = None
+        self.poll()
 
     def _loop(self):
-        while self.running:
-            now = time.time()
-            for mid, st in list(self.pending.items()):
-                if now >= st["next_due"]:
-                    if st["retries"] >= ACK_MAX_RETRIES:
-                        self.log.warn(f"ACK failed after retries for MESSAGE_ID={mid}")
-                        self.pending.pop(mid, None)
-                        self.on_fail(mid)
+        while True:
+            with self._cond:
+                while self.running:
+                    self._skip_dead()
+                    if not self._heap:
+                        self._cond.wait()
                         continue
-                    st["retries"] += 1
-                    st["next_due"] = now + ACK_TIMEOUT_SEC
-                    self.log.info(f"Retry {st['retries']} for MESSAGE_ID={mid}")
-                    try:
-                        self.resend_fn(mid)
-                    except Exception as e:
-                        self.log.error(f"Resend error for {mid}: {e}")
-            time.sleep(0.1)
+                    wait = self._heap[0][0] - self.clock.time()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                if not self.running:
+                    return
+            self.poll()
+
+    def poll(self):
+        """Retry what is due, fail what is exhausted; returns once nothing is due."""
+        resend, failed = [], []
+        with self._cond:
+            now = self.clock.time()
+            heap = self._heap
+            while heap and heap[0][0] <= now:
+                _, _, ent = heapq.heappop(heap)
+                if ent.cancelled:
+                    self._dead -= 1
+                    continue
+                if ent.retries >= ACK_MAX_RETRIES:
+                    del self.pending[ent.mid]
+                    self._capped.pop(ent.mid, None)
+                    self.failures += 1
+                    failed.append(ent.mid)
+                    continue
+                ent.retries += 1
+                self.retries += 1
+                wait = self._backoff(ent)
+                if ent.retries == ACK_MAX_RETRIES:
+                    # the last resend waits out ACK_GIVE_UP_SEC from the first send, so a small
+                    # LAN RTO does not fail a message sooner than the fixed timeout did
+                    wait = max(wait, ent.sent + ACK_GIVE_UP_SEC - now)
+                ent.due = now + wait
+                heapq.heappush(heap, (ent.due, next(self._seq), ent))
+                resend.append((ent.mid, ent.retries, ent.resend))
+            if not self._threaded:
+                self._skip_dead()
+                if heap:
+                    self._wake(heap[0][0])
+        for mid, n, fn in resend:
+            self.log.info(f"Retry {n} for MESSAGE_ID={mid}")
+            try:
+                if fn is not None:
+                    fn()
+                elif self.resend_fn is not None:
+                    self.resend_fn(mid)
+            except Exception as e:
+                self.log.error(f"Resend error for {mid}: {e}")
+        for mid in failed:
+            self.log.warn(f"ACK failed after retries for MESSAGE_ID={mid}")
+            self.on_fail(mid)
 
     def stop(self):
-        self.running = False
+        with self._cond:
+            self.running = False
+            if self._timer is not None:
+                self._timer.cancel()
+            self._cond.notify()
+
+class DelayedAcks:
+    """
+    Receiver-side ACK coalescing, per destination endpoint.
+    add() holds a MESSAGE_ID for up to `delay` seconds (or until `batch` of them are
+    queued for the same endpoint), then flush() sends them in one ACK datagram:
+      - peers advertising CAP_ACK_LIST get MESSAGE_ID: id1,id2,...
+      - legacy peers get one ACK per id, as before (still batched in time)
+    urgent=True (interactive messages such as game moves) flushes at once, taking any
+    held ids along; delay <= 0 disables holding altogether.
+    send_fn(endpoint, uid, ids) builds and sends the datagram(s); `clock` is any
+    scheduler with time()/call_later.
+    """
+    def __init__(self, send_fn: Callable[[Tuple[str, int], str, List[str]], None], clock,
+                 delay: float = ACK_DELAY_SEC, batch: int = ACK_BATCH_MAX):
+        self.send_fn = send_fn
+        self.clock = clock
+        self.delay = delay
+        self.batch = batch
+        self._held: Dict[Tuple[str, int], Tuple[str, List[str], object]] = {}  # endpoint -> (uid, ids, timer)
+        self._lock = threading.Lock()
+        self.acks = 0       # MESSAGE_IDs acknowledged
+        self.flushes = 0    # one ACK datagram each for list-capable peers
+
+    def add(self, endpoint: Tuple[str, int], uid: str, mid: str, urgent: bool = False):
+        with self._lock:
+            self.acks += 1
+            held = self._held.get(endpoint)
+            if held is None:
+                held = (uid, [], None)
+            held[1].append(mid)
+            if urgent or self.delay <= 0 or len(held[1]) >= self.batch:
+                self._held.pop(endpoint, None)
+                if held[2] is not None:
+                    held[2].cancel()
+                flush = held
+            else:
+                if held[2] is None:
+                    held = (uid, held[1], self.clock.call_later(self.delay, lambda: self.flush(endpoint)))
+                self._held[endpoint] = held
+                return
+        self._send(endpoint, flush[0], flush[1])
+
+    def flush(self, endpoint: Tuple[str, int] = None):
+        """Send what is held for `endpoint` (all endpoints if None)."""
+        with self._lock:
+            if endpoint is None:
+                items = list(self._held.items())
+                self._held.clear()
+            else:
+                held = self._held.pop(endpoint, None)
+                items = [(endpoint, held)] if held else []
+            for _, held in items:
+                if held[2] is not None:
+                    held[2].cancel()
+        for ep, held in items:
+            self._send(ep, held[0], held[1])
+
+    def _send(self, endpoint, uid: str, ids: List[str]):
+        self.flushes += 1
+        self.send_fn(endpoint, uid, ids)
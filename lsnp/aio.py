@@ -0,0 +1,103 @@
+import asyncio
+import threading
+from typing import Callable, Tuple
+from .constants import TX_QUEUE_MAX_BYTES
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, engine, handler):
+        self.engine = engine
+        self.handler = handler
+
+    def datagram_received(self, data: bytes, addr: Tuple[str,int]):
+        try:
+            self.engine.tx.deliver(self.handler, data, addr)
+        except Exception as e:
+            self.engine.log.error(f"RX error: {e}")
+
+    def error_received(self, exc):
+        self.engine.log.error(f"RX error: {exc}")
+
+class _Call:
+    """Cancellable handle returned by call_later (safe to cancel from any thread)."""
+    def __init__(self, fn: Callable[[], None]):
+        self.fn = fn
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __call__(self):
+        if not self.cancelled:
+            self.fn()
+
+class AsyncioEngine:
+    """
+    Single event loop replacing the per-socket receive threads plus the AckManager and
+    Discovery sleep loops (--engine asyncio).
+      - uni_sock / disc_sock are attached with loop.create_datagram_endpoint(sock=...)
+      - App._on_packet runs on the loop thread
+      - unicast sends go through uni_sock's datagram transport (Transport.uni_send), which
+        buffers while the socket is full; past TX_QUEUE_MAX_BYTES a send is dropped
+      - AckManager arms loop timers for its retry deadlines, and App drives
+        Discovery.send_ping_and_profile() through call_later (see timers.every)
+    The loop lives in its own daemon thread so the blocking CLI input() keeps working.
+    """
+    def __init__(self, log):
+        self.tx = None
+        self.log = log
+        self.loop = asyncio.new_event_loop()
+        self._transports = []
+        self._uni = None
+        self._thread = None
+
+    def start(self, tx, handler: Callable[[bytes, Tuple[str,int]], None]):
+        self.tx = tx
+        ready = threading.Event()
+
+        async def _setup():
+            socks = [self.tx.uni_sock]
+            if self.tx.disc_sock is not self.tx.uni_sock:
+                socks.append(self.tx.disc_sock)
+            for sock in socks:
+                transport, _ = await self.loop.create_datagram_endpoint(
+                    lambda: _DatagramProtocol(self, handler), sock=sock)
+                self._transports.append(transport)
+            self._uni = self._transports[0]
+            self.tx.uni_send = self._sendto
+
+        def _run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(_setup())
+            ready.set()
+            self.loop.run_forever()
+
+        self.tx.running = True
+        self._thread = threading.Thread(target=_run, daemon=True)
+        self._thread.start()
+        ready.wait()
+
+    def _sendto(self, payload: bytes, addr: Tuple[str,int]):
+        if threading.get_ident() != self._thread.ident:
+            # asyncio transports are not thread-safe: hand the datagram to the loop
+            self.loop.call_soon_threadsafe(self._sendto, payload, addr)
+        elif self._uni.is_closing() or self._uni.get_write_buffer_size() > TX_QUEUE_MAX_BYTES:
+            self.tx.tx_dropped += 1
+        else:
+            self._uni.sendto(payload, addr)
+
+    # scheduler interface shared with other engines
+    def time(self) -> float:
+        return self.loop.time()
+
+    def call_later(self, delay: float, fn: Callable[[], None]) -> _Call:
+        call = _Call(fn)
+        self.loop.call_soon_threadsafe(self.loop.call_later, delay, call)
+        return call
+
+    def stop(self):
+        def _shutdown():
+            for t in self._transports:
+                t.close()
+            self.loop.stop()
+        self.tx.running = False
+        self.loop.call_soon_threadsafe(_shutdown)
@@ -2,30 +2,54 @@ import threading
 import argparse
 from typing import Tuple, Dict
 from .constants import DEFAULT_PORT, DEFAULT_DISPLAY_NAME, SUPPRESS_TYPES, ACK_TRACKED_TYPES, AUTO_ACK_IF_MESSAGE_ID
+from .constants import RX_WORKERS, RX_QUEUE_CAPACITY, OVERLOAD_POLICIES, DISCOVERY_INTERVAL_SEC
+from .constants import ACK_DELAY_SEC, ACK_URGENT_TYPES
 from .utils import get_local_ip, make_user_id, compute_broadcast, ip_from_user_id, now_ts
 from .transport import Transport
 from .logger import VerboseLogger
-from .messages import parse_message, build_message, new_message_id, needs_ack
+from .messages import parse_message, build_message, new_message_id, needs_ack, CAP_RAW_DATA
 from .tokens import make_token, validate_token, revoke_token
 from .peers import PeerDirectory
-from .ack import AckManager
+from .ack import AckManager, DelayedAcks, CAP_ACK_LIST
 from .discovery import Discovery
-from .file_transfer import FileTransfers
+from .file_transfer import FileTransfers, CAP_FILE_ACK, CAP_FILE_RESUME, CAP_FILE_NACK, CAP_FILE_FEC
+from .pmtu import PathMtu, CAP_PMTU
 from .groups import GroupState
 from .game import TicTacToe, render_board
 from .cli import register_cli
+from .aio import AsyncioEngine
+from .dispatch import Dispatcher
+from .dedup import SeenCache
+from .timers import TimerThread, every
+from .netem import NetEm
+from . import binwire
+from .binwire import CAP_BINARY
+from .templates import MessageTemplate, TemplateCache
 
 class App:
-    def __init__(self, args):
+    # tx / sched may be injected (e.g. sim.VirtualTransport + VirtualClock); by default
+    # real sockets and the scheduler matching --engine are created here
+    def __init__(self, args, tx=None, sched=None):
         self.verbose = args.verbose
         self.port = args.port
         self.loss_prob = args.loss
         self.ttl = args.ttl
         self.display_name = args.name or DEFAULT_DISPLAY_NAME
+        self.engine_name = args.engine
+        # optional wire features advertised in PROFILE (binary framing with --wire auto,
+        # raw chunk payloads in text messages unless --wire text)
+        self.binary_wire = args.wire == "auto"
+        self.raw_data = args.wire in ("auto", "raw")
+        self.caps = (((CAP_BINARY,) if self.binary_wire else ()) + ((CAP_RAW_DATA,) if self.raw_data else ())
+                     + (CAP_FILE_ACK, CAP_FILE_RESUME, CAP_FILE_NACK, CAP_FILE_FEC, CAP_ACK_LIST, CAP_PMTU))
+        threaded = self.engine_name == "threads" and sched is None
+        if args.overload == "block" and args.workers > 0 and not threaded:
+            # block waits on the receiving thread, which here is the event loop itself
+            raise ValueError("--overload block needs --engine threads")
 
         # self.local_ip = get_local_ip()
         #fix: determine IP / user_id
-        self.local_ip = get_local_ip()
+        self.local_ip = args.ip or get_local_ip()
         # if args.loopback or self.local_ip.startswith("127."):
         #     self.local_ip = "127.0.0.1"
 
@@ -38,9 +62,16 @@ class App:
         self.broadcast_ip = compute_broadcast(self.local_ip)
 
         self.log = VerboseLogger(self.verbose)
-        self.tx = Transport(self.port, self.log, loss_prob=self.loss_prob)
+        # scheduler for delayed work: a timer thread, or the event loop itself under asyncio
+        if sched is None:
+            sched = TimerThread(self.log) if threaded else AsyncioEngine(self.log)
+        self.sched = sched
+        self.netem = NetEm.from_args(args, self.log, self.sched)
+        self.tx = tx or Transport(self.port, self.log, netem=self.netem)
         self.peers = PeerDirectory()
         self.groups = GroupState()
+        # prebuilt headers for hot message types (PING/PROFILE, FILE_CHUNK, moves, group messages)
+        self.templates = TemplateCache()
 
         #fix: add local state (follows and likes)
         self.following = set()
@@ -49,39 +80,25 @@ class App:
         self._likes_by_post = {}      # post_ts -> set(user_ids) who like my post
 
 
-        # ACK manager; wire resend by message_id from our resend cache
-        self._resend_cache: Dict[str, Dict] = {}  # mid -> {ip, msg_dict, scope}
-        def resend(mid: str):
-            ent = self._resend_cache.get(mid)
-            # if not ent: return
-            # # ip, msg, scope = ent["ip"], ent["msg"], ent["scope"]
-            # # self.tx.send_unicast(ip, build_message(msg), drop_for=("game" if msg["TYPE"].startswith("TICTACTOE") else "file" if msg["TYPE"].startswith("FILE_") else ""))
-
-            # #fix: include port in resend cache            
-            # ip, port, msg, scope = ent["ip"], ent["port"], ent["msg"], ent["scope"]
-            # kind = "game" if msg["TYPE"].startswith("TICTACTOE") else "file" if msg["TYPE"].startswith("FILE_") else ""
-            # self.tx.send_unicast(ip, port, build_message(msg), drop_for=kind)
-
-            #fix: ack retries dont actually resend game messages/file messages
-            if ent:
-                ip, port, msg, scope = ent["ip"], ent["port"], ent["msg"], ent["scope"]
-                kind = "game" if msg["TYPE"].startswith("TICTACTOE") else "file" if msg["TYPE"].startswith("FILE_") else ""
-                self.tx.send_unicast(ip, port, build_message(msg), drop_for=kind)
-                return
-            cb = self.files._resenders.get(mid) or self.game._resenders.get(mid)
-            if cb:
-                try: cb()
-                except Exception as e: self.log.error(f"Resend error for {mid}: {e}")
-
-
-
+        # ACK manager; every tracked message carries its own resend callable
         def on_fail(mid: str):
-            # nothing special; already logged
-            pass
-
-        self.ack_mgr = AckManager(resend_fn=resend, on_fail=on_fail, log=self.log)
-        self.files = FileTransfers(self.user_id, self.tx, self.peers, self.ack_mgr, self.log)
-        self.game = TicTacToe(self.user_id, self.tx, self.peers, self.ack_mgr, self.log)
+            # already logged; a FILE_ACK transfer also drops its sender state
+            self.files.on_fail(mid)
+
+        self.ack_mgr = AckManager(resend_fn=None, on_fail=on_fail, log=self.log, start=threaded,
+                                  clock=(None if threaded else self.sched))
+        # (sender, MESSAGE_ID) already handled, for duplicate suppression
+        self.seen = SeenCache(clock=self.sched)
+        # outgoing ACKs are held briefly and coalesced per endpoint (--ack-delay)
+        self.delayed_acks = DelayedAcks(self._send_acks, self.sched, delay=args.ack_delay / 1000.0)
+        # probed path MTU per peer, for sizing file chunks
+        self.pmtu = PathMtu(self.user_id, self.tx, self.peers, self.log, clock=self.sched, port=self.port)
+        self.files = FileTransfers(self.user_id, self.tx, self.peers, self.ack_mgr, self.log,
+                                   encode=self.encode_for, templates=self.templates, sched=self.sched,
+                                   raw_data=self.raw_data_for, pmtu=self.pmtu, fec=args.fec == "auto",
+                                   send_acks=self._send_acks)
+        self.game = TicTacToe(self.user_id, self.tx, self.peers, self.ack_mgr, self.log,
+                              encode=self.encode_for, templates=self.templates)
 
         register_cli(self)  # installs self.commands
 
@@ -95,32 +112,79 @@ class App:
             include_multicast=True, 
 
             #fix: added loopback mode
-            loopback_mode=(self.local_ip == "127.0.0.1")
+            loopback_mode=(self.local_ip == "127.0.0.1"),
+            start=threaded,
+            caps=self.caps,
+            templates=self.templates
         )
 
 
-        # start receiver loop
-        self.tx.loop(self._on_packet)
+        # receive queue + handler workers (workers=0 runs handlers inline on the receive path)
+        self.dispatcher = None
+        handler = self._on_packet
+        if args.workers > 0:
+            self.dispatcher = Dispatcher(self._on_packet, self.log, workers=args.workers,
+                                         capacity=args.rx_queue, policy=args.overload)
+            handler = self.dispatcher.submit
+
+        # start receiver loop (threads: one recv thread per socket; asyncio: one event loop for everything)
+        if isinstance(self.sched, AsyncioEngine):
+            self.sched.start(self.tx, handler)
+        else:
+            self.tx.loop(handler)
+        # without the threads engine, discovery runs as a scheduler timer (the AckManager
+        # arms its own timer for the next retry deadline on the same scheduler)
+        if not threaded:
+            every(self.sched, DISCOVERY_INTERVAL_SEC, self.discovery.send_ping_and_profile, first=0, log=self.log)
+
+    # ---- wire format ----
+    def encode_for(self, to_uid: str, fields: Dict[str,str], template: MessageTemplate = None):
+        """
+        Binary framing for peers that advertised it (and if we did), else RFC text --
+        with a raw DATA payload for CAP_RAW_DATA peers (templated FILE_CHUNKs).
+        With a template, `fields` holds only the variable part of the message.
+        """
+        binary = self.binary_wire and self.peers.supports(to_uid, CAP_BINARY)
+        if template is not None:
+            return template.render(fields, binary, not binary and self.raw_text_for(to_uid))
+        return binwire.encode(fields) if binary else build_message(fields)
+
+    def raw_text_for(self, to_uid: str) -> bool:
+        return self.raw_data and self.peers.supports(to_uid, CAP_RAW_DATA)
+
+    def raw_data_for(self, to_uid: str) -> bool:
+        """True when FILE_CHUNK DATA reaches this peer unencoded (binary framing or CAP_RAW_DATA)."""
+        return (self.binary_wire and self.peers.supports(to_uid, CAP_BINARY)) or self.raw_text_for(to_uid)
 
     # ---- sending with ACK tracking ----
     def _send_with_ack(self, ip: str, port: int, msg_dict: Dict[str,str], scope: str = ""):
         if "MESSAGE_ID" not in msg_dict:
             msg_dict["MESSAGE_ID"] = new_message_id()
         mid = msg_dict["MESSAGE_ID"]
-        self._resend_cache[mid] = {"ip": ip, "port": port, "msg": dict(msg_dict), "scope": scope}
-        raw = build_message(msg_dict)
+        raw = self.encode_for(msg_dict.get("TO", ""), msg_dict)
         kind = "game" if scope=="game" else "file" if scope=="file" else ""
         self.tx.send_unicast(ip, port, raw, drop_for=kind)
-        self.ack_mgr.track(mid)
+        # retries resend the same datagram; it is freed with the AckManager entry
+        self.ack_mgr.track(mid, (ip, port), resend=lambda: self.tx.send_unicast(ip, port, raw, drop_for=kind))
+
+    def _send_acks(self, endpoint: Tuple[str,int], uid: str, mids):
+        # DelayedAcks flush: one datagram listing every id if the peer understands it
+        ip, port = endpoint
+        if len(mids) > 1 and self.peers.supports(uid, CAP_ACK_LIST):
+            mids = [",".join(mids)]
+        for mid in mids:
+            self.tx.send_unicast(ip, port, self.encode_for(uid, {"TYPE": "ACK", "MESSAGE_ID": mid, "STATUS": "RECEIVED"}))
 
     # ---- packet dispatcher ----
-    def _on_packet(self, raw: str, addr: Tuple[str,int]):
+    def _on_packet(self, raw, addr: Tuple[str,int]):
+        # raw is bytes / a memoryview into a receive buffer (see Transport.deliver)
         # ip = addr[0]
 
         #fix: include source port in address tuple
         ip, src_port = addr
 
-        msg = parse_message(raw)
+        # binary framing starts with a magic byte no text message can start with
+        msg = binwire.decode(raw) if binwire.is_binary(raw) else parse_message(raw)
         mtype = msg.get("TYPE","")
 
         # Security: match IP in FROM/USER_ID if present
@@ -140,8 +204,8 @@ class App:
                     return
 
         #fix: only ACK chunks after accept files in file_transfer command
+        should_ack = False
         if ((not msg.get("TO")) or msg.get("TO") == self.user_id) and msg.get("MESSAGE_ID"):
-            should_ack = False
             if mtype in {"TICTACTOE_INVITE", "TICTACTOE_MOVE", "DM", "FILE_OFFER"}:
                 should_ack = True
             elif mtype == "FILE_CHUNK":
@@ -156,24 +220,9 @@ class App:
                 ack_ip, ack_port = self.peers.endpoint_of(sender_uid)
                 if not ack_ip: ack_ip = ip
                 if not ack_port: ack_port = src_port
-                ack = build_message({"TYPE": "ACK","MESSAGE_ID": msg["MESSAGE_ID"],"STATUS":"RECEIVED"})
-                self.log.info(f"ACK: send MESSAGE_ID={msg['MESSAGE_ID']} to {ack_ip}:{ack_port} (for {mtype} from {sender_uid})")
-                self.tx.send_unicast(ack_ip, ack_port, ack)
-
-        # fix: only ACK if addressed to me, and send to sender's endpoint (ip, port)
-        to_uid = msg.get("TO", "")
-        addressed_to_me = (not to_uid) or (to_uid == self.user_id)
-        if addressed_to_me and msg.get("MESSAGE_ID") and mtype in {"TICTACTOE_INVITE","TICTACTOE_MOVE","FILE_CHUNK","FILE_OFFER","DM"}:
-            sender_uid = msg.get("FROM") or msg.get("USER_ID") or ""
-            ack_ip, ack_port = self.peers.endpoint_of(sender_uid)
-            if not ack_ip:
-                ack_ip = ip
-            if not ack_port:
-                # last resort: reply to the sender's source port we observed
-                ack_port = src_port
-            ack = build_message({"TYPE": "ACK","MESSAGE_ID": msg["MESSAGE_ID"],"STATUS":"RECEIVED"})
-            self.log.info(f"ACK: send MESSAGE_ID={msg['MESSAGE_ID']} to {ack_ip}:{ack_port} (for {mtype} from {sender_uid})")
-            self.tx.send_unicast(ack_ip, ack_port, ack)
+                self.log.info(f"ACK: queue MESSAGE_ID={msg['MESSAGE_ID']} to {ack_ip}:{ack_port} (for {mtype} from {sender_uid})")
+                self.delayed_acks.add((ack_ip, ack_port), sender_uid, msg["MESSAGE_ID"],
+                                      urgent=mtype in ACK_URGENT_TYPES)
 
         #fix: bad ack send due to missing port; remove 
         # # auto-ACK on tracked types
@@ -186,7 +235,15 @@ class App:
             mid = msg.get("MESSAGE_ID")
             if mid:
                 self.log.info(f"ACK: recv MESSAGE_ID={mid} from {ip}:{src_port}")
-                self.ack_mgr.acked(mid)
+                # a coalesced ACK lists several ids
+                self.ack_mgr.acked(mid.split(",") if "," in mid else mid)
+            return
+
+        # a retransmission (its ACK was lost; re-ACKed above) or the second copy of a
+        # broadcast+multicast send: skip token checks, decoding and printing again.
+        # Chunks we did not ACK (file not accepted yet) are not remembered, so their retry counts.
+        mid = msg.get("MESSAGE_ID")
+        if mid and self.seen.seen((sender_uid, mid), record=should_ack or mtype != "FILE_CHUNK"):
             return
 
 
@@ -227,15 +284,10 @@ class App:
 
         #fix: include source port in peer profile
         self.peers.upsert_from_profile(msg, ip, src_port)
+        self.pmtu.maybe_probe(msg.get("USER_ID", ""))
 
     def _on_PING(self, msg, ip, src_port=None):
-        prof = build_message({
-            "TYPE": "PROFILE",
-            "USER_ID": self.user_id,
-            "DISPLAY_NAME": self.display_name,
-            "STATUS": "Exploring LSNP!",
-            "PORT": str(self.tx.listen_port()),
-        })
+        prof = self.discovery.profile_datagram()  # cached; same PROFILE discovery sends
         self.tx.send_broadcast(self.broadcast_ip, prof)
         self.tx.send_multicast(prof)
 
@@ -332,7 +384,29 @@ class App:
     def _on_FILE_CHUNK(self, msg, ip):
         self.files.on_chunk(msg, ip)
 
-    def _on_FILE_RECEIVED(self, msg, ip): pass
+    def _on_FILE_RECEIVED(self, msg, ip):
+        self.files.on_received(msg, ip)
+
+    def _on_FILE_ACK(self, msg, ip):
+        if msg.get("TO") == self.user_id:
+            self.files.on_file_ack(msg, ip)
+
+    def _on_PMTU_PROBE(self, msg, ip):
+        if msg.get("TO") == self.user_id:
+            self.pmtu.on_probe(msg, ip)
+
+    def _on_PMTU_ACK(self, msg, ip):
+        if msg.get("TO") == self.user_id:
+            self.pmtu.on_ack(msg, ip)
+
+    def _on_FILE_NACK(self, msg, ip):
+        # a FILE_ACK that also names the chunks the receiver is missing
+        if msg.get("TO") == self.user_id:
+            self.files.on_file_ack(msg, ip)
+
+    def _on_FILE_RESUME(self, msg, ip):
+        if msg.get("TO") == self.user_id:
+            self.files.on_resume(msg, ip)
 
     def _on_REVOKE(self, msg, ip):
         tok = msg.get("TOKEN","")
@@ -427,6 +501,7 @@ class App:
                     ("ttt_invite <user> [X|O] [gameid]", "Invite to Tic-Tac-Toe"),
                     ("ttt_move <user> <gid> <pos> <turn> <symbol>", "Make a move"),
                     ("verbose <on/off>",           "Toggle verbose logs"),
+                    ("stats",                      "Show receive queue / emulator counters"),
                     ("help",                       "Show this help"),
                     ("exit / quit",                "Quit"),
                 ]
@@ -448,15 +523,42 @@ class App:
             else:
                 print(f"Unknown command: {cmd}")
 
-def main(argv=None):
+def build_parser() -> argparse.ArgumentParser:
     p = argparse.ArgumentParser(description="LSNP peer")
     p.add_argument("--port", type=int, default=DEFAULT_PORT)
     p.add_argument("--name", type=str, default=DEFAULT_DISPLAY_NAME)
+    p.add_argument("--ip", type=str, default="", help="override the detected local IP")
     p.add_argument("--ttl", type=int, default=3600, help="default token TTL seconds")
     p.add_argument("--loss", type=float, default=0.0, help="induced packet loss probability (0..1) for game/file")
+    # network emulation (applies to --impair scopes; deterministic with --seed)
+    p.add_argument("--seed", type=int, default=None, help="RNG seed for reproducible impairments")
+    p.add_argument("--impair", type=str, default="game,file", help="scopes to impair: comma list of game,file or 'all'")
+    p.add_argument("--rx-loss", type=float, default=0.0, help="inbound loss probability (0..1)")
+    p.add_argument("--burst", type=str, default="", help="outbound Gilbert-Elliott loss 'p,r[,bad_loss]'")
+    p.add_argument("--rx-burst", type=str, default="", help="inbound Gilbert-Elliott loss 'p,r[,bad_loss]'")
+    p.add_argument("--delay", type=float, default=0.0, help="outbound latency (ms)")
+    p.add_argument("--jitter", type=float, default=0.0, help="outbound latency jitter +/- (ms)")
+    p.add_argument("--reorder", type=float, default=0.0, help="probability a datagram is held back and reordered")
+    p.add_argument("--dup", type=float, default=0.0, help="probability a datagram is duplicated")
+    p.add_argument("--rate", type=float, default=0.0, help="outbound bandwidth cap (kbit/s, 0 = unlimited)")
     p.add_argument("--verbose", action="store_true")
     p.add_argument("--loopback", action="store_true", help="force single-machine loopback testing (user_id uses 127.0.0.1)")
-    args = p.parse_args(argv)
+    p.add_argument("--engine", choices=["threads", "asyncio"], default="threads", help="receive/timer engine")
+    p.add_argument("--workers", type=int, default=RX_WORKERS, help="handler worker threads (0 = handle inline on receive)")
+    p.add_argument("--rx-queue", type=int, default=RX_QUEUE_CAPACITY, help="receive queue capacity (datagrams)")
+    p.add_argument("--overload", choices=OVERLOAD_POLICIES, default="drop_oldest", help="policy when the receive queue is full (block: threads engine only)")
+    p.add_argument("--ack-delay", type=float, default=ACK_DELAY_SEC * 1000, help="ms to hold ACKs for coalescing (0 = ack at once; game moves never wait)")
+    p.add_argument("--wire", choices=["auto", "raw", "text"], default="auto",
+                   help="auto: binary framing with peers that advertise it; raw: text with raw chunk payloads; text: RFC only")
+    p.add_argument("--fec", choices=["auto", "off"], default="auto",
+                   help="auto: add XOR parity to file sends when chunks are being lost (peers that advertise it)")
+    return p
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.overload == "block" and args.engine == "asyncio" and args.workers > 0:
+        parser.error("--overload block needs --engine threads (it would stall the event loop)")
     app = App(args)
     app.run()
 
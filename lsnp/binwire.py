@@ -0,0 +1,155 @@
+import binascii
+from typing import Dict, Tuple, Union
+from .messages import KNOWN_KEYS, WireMessage, build_message, _key_of
+
+# Compact binary framing, used only with peers that advertise CAP_BINARY in PROFILE.
+#
+#   MAGIC VERSION { header [key] length value }*
+#
+#   header = varint(field_id << 1 | blob); field_id is 1 + index in KNOWN_KEYS,
+#            0 means the key follows as varint(len) + utf-8 text
+#   value  = varint(len) + bytes; blob values are raw binary (DATA, AVATAR_DATA),
+#            everything else is the utf-8 text the RFC format would carry
+#
+# MAGIC is not valid as the first byte of a text message, so one byte tells the two apart.
+MAGIC = 0xB7
+VERSION = 1
+CAP_BINARY = "BIN1"
+BLOB_FIELDS = frozenset({"DATA", "AVATAR_DATA"})
+
+_IDS: Dict[str, int] = {k: i + 1 for i, k in enumerate(KNOWN_KEYS)}
+_KEY_BY_ID = (None,) + KNOWN_KEYS
+_HEAD = bytes((MAGIC, VERSION))
+
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+# precomputed field headers, and lengths below 128 (one byte)
+_TEXT_HDR = {k: _varint(i << 1) for k, i in _IDS.items()}
+_BLOB_HDR = {k: _varint(i << 1 | 1) for k, i in _IDS.items()}
+_SMALL = [bytes((n,)) for n in range(0x80)]
+
+def is_binary(raw) -> bool:
+    return len(raw) > 0 and raw[0] == MAGIC
+
+def _get_varint(buf, pos: int) -> Tuple[int, int]:
+    n = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+def encode(fields: Dict[str, Union[str, bytes]]) -> bytes:
+    """Binary counterpart of build_message. Blob fields may be given as bytes or base64 text."""
+    return bytes(encode_into(bytearray(_HEAD), fields))
+
+def encode_into(out: bytearray, fields: Dict[str, Union[str, bytes]]) -> bytearray:
+    """Append the framed fields to out (used by templates to extend a cached header)."""
+    for k, v in fields.items():
+        if v.__class__ is bytes:
+            data, hdr = v, _BLOB_HDR.get(k)
+        elif k in BLOB_FIELDS:
+            try:
+                data, hdr = binascii.a2b_base64(v), _BLOB_HDR[k]
+            except binascii.Error:
+                data, hdr = v.encode("utf-8"), _TEXT_HDR[k]
+        else:
+            data, hdr = (v if v.__class__ is str else str(v)).encode("utf-8"), _TEXT_HDR.get(k)
+        if hdr is None:  # key outside KNOWN_KEYS: id 0 plus the key text
+            kb = k.encode("utf-8")
+            hdr = (b"\x01" if v.__class__ is bytes else b"\x00") + _varint(len(kb)) + kb
+        n = len(data)
+        out += hdr
+        out += _SMALL[n] if n < 0x80 else _varint(n)
+        out += data
+    return out
+
+def _check(buf):
+    if len(buf) < 2 or buf[0] != MAGIC:
+        raise ValueError("not a binary LSNP message")
+    if buf[1] != VERSION:
+        raise ValueError(f"unsupported binary LSNP version {buf[1]}")
+
+def decode(raw: Union[bytes, bytearray, memoryview]) -> WireMessage:
+    """Parse a binary datagram into the same WireMessage the text parser returns."""
+    buf = bytes(raw)
+    _check(buf)
+    values = {}
+    blobs = set()
+    keys = _KEY_BY_ID
+    nkeys = len(keys)
+    pos, end = 2, len(buf)
+    try:
+        while pos < end:
+            head = buf[pos]
+            pos += 1
+            if head & 0x80:
+                head, pos = _get_varint(buf, pos - 1)
+            fid = head >> 1
+            if fid == 0:
+                n, pos = _get_varint(buf, pos)
+                key = _key_of(str(buf[pos:pos + n], "utf-8", "ignore"))
+                pos += n
+            else:
+                key = keys[fid] if fid < nkeys else None  # None: field id from a newer peer
+            n = buf[pos]
+            pos += 1
+            if n & 0x80:
+                n, pos = _get_varint(buf, pos - 1)
+            e = pos + n
+            if e > end:
+                raise IndexError
+            if key is not None:
+                values[key] = buf[pos:e]
+                if head & 1:
+                    blobs.add(key)
+            pos = e
+    except IndexError:
+        raise ValueError("truncated binary LSNP message")
+    return WireMessage(values, blobs)
+
+_TYPE_ID, _FILEID_ID, _GAMEID_ID = _IDS["TYPE"], _IDS["FILEID"], _IDS["GAMEID"]
+
+def peek(raw) -> Tuple[str, bytes]:
+    """Binary counterpart of dispatch.peek_route: (TYPE, FILEID/GAMEID) without copying."""
+    mtype, key = "", b""
+    try:
+        _check(raw)
+        pos, end = 2, len(raw)
+        while pos < end and not (mtype and key):
+            head, pos = _get_varint(raw, pos)
+            fid = head >> 1
+            if fid == 0:
+                n, pos = _get_varint(raw, pos)
+                pos += n
+            n, pos = _get_varint(raw, pos)
+            if fid == _TYPE_ID:
+                mtype = str(raw[pos:pos + n], "ascii", "ignore").upper()
+            elif (fid == _FILEID_ID or fid == _GAMEID_ID) and not key:
+                key = bytes(raw[pos:pos + n])
+            pos += n
+    except (ValueError, IndexError):
+        pass
+    return mtype, key
+
+def as_text(data: Union[str, bytes]) -> str:
+    """Readable form of an outgoing datagram for the verbose log."""
+    if isinstance(data, str):
+        return data.strip()
+    if is_binary(data):
+        return f"[binary {len(data)} bytes]\n" + build_message(dict(decode(data))).strip()
+    head, _, payload = data.partition(b"\n\n")
+    if payload:
+        return str(head, "utf-8", "ignore").strip() + f"\n[raw DATA {len(payload)} bytes]"
+    return str(data, "utf-8", "ignore").strip()
+
+def wire_bytes(data: Union[str, bytes]) -> bytes:
+    return data.encode("utf-8") if isinstance(data, str) else data
@@ -0,0 +1,26 @@
+import threading
+from typing import List
+from .constants import BUFFER_SIZE, RX_POOL_SIZE
+
+class BufferPool:
+    """
+    Preallocated receive buffers for recvfrom_into.
+    A buffer is borrowed for exactly one datagram and handed back once the handler
+    returns, so steady-state receiving allocates no new 64 KiB buffers.
+    """
+    def __init__(self, size: int = BUFFER_SIZE, count: int = RX_POOL_SIZE):
+        self.size = size
+        self.count = count
+        self._free: List[bytearray] = [bytearray(size) for _ in range(count)]
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bytearray:
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+        return bytearray(self.size)
+
+    def release(self, buf: bytearray):
+        with self._lock:
+            if len(self._free) < self.count:
+                self._free.append(buf)
@@ -5,6 +5,7 @@ from .messages import build_message, default_post_fields, new_message_id
 from .tokens import make_token, validate_token, revoke_token
 from .utils import now_ts
 from .constants import DEFAULT_TTL_SEC
+from .templates import MessageTemplate
 
 def register_cli(app):  # app exposes: tx, peers, files, game, groups, log, user_id, display_name, ttl, loss_prob
     def _send_broadcast(msg_fields: Dict[str,str]):
@@ -258,14 +259,20 @@ def register_cli(app):  # app exposes: tx, peers, files, game, groups, log, user
             print("Usage: group_msg <group_id> <message>")
             return
         group_id, content = parts[0], parts[1]
-        ts = now_ts()
+        # header + token are reused for every message to this group; fan-out only re-frames
+        # CONTENT/TIMESTAMP per member (text or binary, whichever each member understands)
+        def build():
+            issued = now_ts()
+            return MessageTemplate({
+                "TYPE": "GROUP_MESSAGE",
+                "FROM": app.user_id,
+                "GROUP_ID": group_id,
+                "TOKEN": make_token(app.user_id, issued+app.ttl, "group")
+            }, expires=issued + app.ttl // 2)
+        tmpl = app.templates.get(("GROUP_MESSAGE", group_id, app.ttl), build)
         msg = {
-            "TYPE": "GROUP_MESSAGE",
-            "FROM": app.user_id,
-            "GROUP_ID": group_id,
             "CONTENT": content,
-            "TIMESTAMP": str(ts),
-            "TOKEN": make_token(app.user_id, ts+app.ttl, "group")
+            "TIMESTAMP": str(now_ts()),
         }
 
         #fix: warn if the group has no known members
@@ -283,7 +290,7 @@ def register_cli(app):  # app exposes: tx, peers, files, game, groups, log, user
             if not ip or not port:
                 print(f"Don't know where to send group creation to {m}. Try 'peers' and wait for PROFILEs.")
                 continue
-            app.tx.send_unicast(ip, port, build_message(msg))
+            app.tx.send_unicast(ip, port, app.encode_for(m, msg, tmpl))
             
         print("\n👥 GROUP • MESSAGE")
         print("────────────────────────────────────────────────")
@@ -312,22 +319,16 @@ def register_cli(app):  # app exposes: tx, peers, files, game, groups, log, user
         if not os.path.isfile(path):
             print(f"File not found: {path}")
             return
-        data = open(path, "rb").read()
-        filesize = len(data)
         fileid = new_message_id()[:8]
-        fname = os.path.basename(path)
-        app.files.send_offer(to, fileid, fname, filesize, "application/octet-stream", "File via LSNP", ttl=app.ttl)
-        # chunking
         # chunk_size = 1024 * 8
 
         #fix: use a smaller chunk size to avoid fragmentation issues
             # ~1200B payload keeps UDP datagrams well under typical MTU 1500 after headers
-        chunk_size = 1200
+        # (1200 as base64; peers taking raw DATA get as many raw bytes in the same datagram)
+        chunk_size = app.files.chunk_size_for(to, os.path.getsize(path))
 
-        chunks = [data[i:i+chunk_size] for i in range(0, len(data), chunk_size)]
-        total = len(chunks)
-        for i, ch in enumerate(chunks):
-            app.files.send_chunk(to, fileid, i, total, ch, chunk_size, ttl=app.ttl)
+        # chunks are read from the file as they go out (and again for retransmission)
+        app.files.send_file(to, path, fileid, chunk_size, "application/octet-stream", "File via LSNP", ttl=app.ttl)
 
     def cmd_accept(args: str):
         fileid = args.strip()
@@ -349,6 +350,7 @@ def register_cli(app):  # app exposes: tx, peers, files, game, groups, log, user
             print("Usage: revoke <token>")
             return
         revoke_token(token)
+        app.templates.clear()  # cached headers may carry the revoked token
         print("Token revoked.")
 
     def cmd_ttt_invite(args: str):
@@ -376,6 +378,46 @@ def register_cli(app):  # app exposes: tx, peers, files, game, groups, log, user
         app.log.set_verbose(v)
         print(f"Verbose set to {v}")
 
+    def cmd_stats(args: str):
+        def section(title, st):
+            print(f"\n{title}")
+            for k, v in st.items():
+                print(f"  {k:<16}{v}")
+
+        if app.dispatcher:
+            section("Receive Queue", app.dispatcher.stats())
+        else:
+            print("Receive queue disabled (--workers 0).")
+        if app.netem:
+            section("Network Emulator", app.netem.stats())
+        section("Send", {"dropped": app.tx.tx_dropped})
+        section("Duplicate Suppression", {"hits": app.seen.hits, "misses": app.seen.misses, "size": len(app.seen)})
+        section("Message Templates", {"hits": app.templates.hits, "builds": app.templates.builds})
+        section("Path MTU", {"probes_sent": app.pmtu.probes,
+                             **{uid: app.pmtu.get(uid) or "-" for uid in app.peers.list()}})
+        section("ACK", {"pending": len(app.ack_mgr.pending), "retries": app.ack_mgr.retries,
+                        "failures": app.ack_mgr.failures, "acks_sent": app.delayed_acks.acks,
+                        "ack_flushes": app.delayed_acks.flushes})
+        ms = lambda v: "-" if v is None else f"{v * 1000:.1f}ms"
+        for (ip, port), st in sorted(app.ack_mgr.peer_stats().items()):
+            print(f"  {f'{ip}:{port}':<22}srtt {ms(st['srtt'])}  rttvar {ms(st['rttvar'])}  "
+                  f"rto {ms(st['rto'])}  samples {st['samples']}")
+        section("File Transfers", {"sending": len(app.files._out), "receiving": len(app.files.rx),
+                                   "retransmits": app.files.retransmits, "tail_probes": app.files.probes,
+                                   "file_acks_sent": app.files.file_acks_sent,
+                                   "file_nacks_sent": app.files.file_nacks_sent,
+                                   "rx_buffered": app.files.rx_buffered,
+                                   "rx_early": app.files.rx_early,
+                                   "parity_sent": app.files.parity_sent,
+                                   "fec_recovered": app.files.fec_recovered,
+                                   "crc_errors": app.files.crc_errors,
+                                   "dedup_skips": app.files.dedup_skips,
+                                   "last_goodput": app.files.last_goodput or "-"})
+        for fileid, st in list(app.files._out.items()):
+            print(f"  {fileid:<22}cwnd {st['cwnd']:.1f}  ssthresh {st['ssthresh']:.1f}  "
+                  f"in flight {len(st['unacked'])}  sent {st['next']}/{st['total']}  "
+                  f"loss {app.files._loss_rate(st):.1%}")
+
     app.commands = {
         "peers": cmd_peers,
         "post": cmd_post,
@@ -393,4 +435,5 @@ def register_cli(app):  # app exposes: tx, peers, files, game, groups, log, user
         "ttt_invite": cmd_ttt_invite,
         "ttt_move": cmd_ttt_move,
         "verbose": cmd_verbose,
+        "stats": cmd_stats,
     }
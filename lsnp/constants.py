@@ -4,10 +4,55 @@ APP_NAME = "LSNP"
 DEFAULT_PORT = 50999
 MULTICAST_GRP = "224.0.0.251"   # lightweight mDNS-style discovery
 BUFFER_SIZE = 65535             # allow big base64 chunks
+RX_POOL_SIZE = 4                # pooled receive buffers (one in use per receive thread)
 DISCOVERY_INTERVAL_SEC = 300
 DEFAULT_TTL_SEC = 3600
-ACK_TIMEOUT_SEC = 2.0
+ACK_TIMEOUT_SEC = 2.0           # RTO for a peer with no RTT sample yet
 ACK_MAX_RETRIES = 3
+ACK_GIVE_UP_SEC = ACK_TIMEOUT_SEC * (ACK_MAX_RETRIES + 1)  # never fail sooner than this
+ACK_RTO_MIN_SEC = 0.1           # adaptive RTO bounds (per peer, from measured RTT)
+ACK_RTO_MAX_SEC = 10.0
+ACK_BACKOFF_JITTER = 0.1        # retry waits are scaled by 1 +/- this
+ACK_MAX_PENDING = 8192          # tracked messages (and their resenders) kept at most
+ACK_DELAY_SEC = 0.005           # receiver holds ACKs this long to coalesce them (--ack-delay)
+ACK_BATCH_MAX = 16              # ...or until this many are held for one endpoint
+ACK_URGENT_TYPES = {"TICTACTOE_INVITE", "TICTACTOE_MOVE"}  # acked at once, never held
+
+FILE_CHUNK_SIZE = 1200          # chunk bytes for base64 DATA (raw DATA: the same field size, 4/3 of this)
+FILE_CHUNK_MAX = 16384          # chunk bytes at most, whatever the path MTU
+
+# Path MTU probing (UDP payload sizes; the route's own MTU is probed as well)
+PMTU_PROBE_SIZES = (1232, 1372, 1452, 1472, 4052, 8972, 16356, 32740, 65507)
+PMTU_SAFE = 1232                # largest probe without a don't-fragment bit (fits any path)
+PMTU_TTL_SEC = 600              # a confirmed size is trusted this long
+PMTU_RETRY_SEC = 30             # at most one probe round per peer in this time
+
+# FILE_ACK (cumulative + selective chunk acknowledgement)
+FILE_ACK_EVERY = 8              # receiver acks at least every N in-order chunks
+FILE_ACK_DELAY_SEC = 0.005      # ...or this long after an unacknowledged one
+FILE_SACK_MAX_RANGES = 16       # ranges carried in one SACK field
+FILE_RETX_BURST = 32            # chunks the sender retransmits per FILE_ACK / timeout
+FILE_MAX_SOURCES = 32           # outgoing files kept open for retransmission
+FILE_MAP_WINDOW = 8 * 1024 * 1024  # mapped bytes kept resident behind the send position
+FILE_WRITE_COALESCE = 64 * 1024    # receiver joins consecutive chunks into writes of up to this
+FILE_RX_BUFFER_BUDGET = 4 * 1024 * 1024  # ...holding at most this much across all inbound transfers
+FILE_JOURNAL_EVERY = 1024 * 1024  # receive journal rewritten after this many bytes written
+FILE_RESUME_MAX_RANGES = 64       # MISSING ranges in one FILE_RESUME (the last runs to the end)
+FILE_NACK_MAX = 6                 # ...doubling the wait each time, then reports the transfer stalled
+FILE_FEC_MIN_LOSS = 0.01          # sender adds XOR parity chunks once the loss it sees reaches this
+FILE_FEC_MAX_GROUP = 32           # ...one parity per at most this many data chunks
+FILE_FEC_PRIOR = 64               # chunks' worth of weight the last transfer's loss rate starts with
+FILE_FEC_KEEP = 64                # parity chunks a receiver holds per transfer until they can repair
+FILE_HASH_BLOCK = 1024 * 1024     # bytes read at a time when hashing a file
+FILE_HASH_CACHE = 256             # file digests remembered (by path, size and mtime)
+FILE_HASH_INDEX = ".hashes"       # inbox sidecar: digest, size, mtime and path of each received file
+FILE_PREACCEPT_MAX = 8 * 1024 * 1024      # chunk bytes held per offer that is not accepted yet
+FILE_PREACCEPT_BUDGET = 32 * 1024 * 1024  # ...and across all such offers
+FILE_PREACCEPT_TTL_SEC = 60               # held chunks are dropped when accept takes longer
+FILE_CWND_INIT = 8              # windowed sender: chunks in flight at start
+FILE_CWND_MIN = 2               # ...after a timeout
+FILE_CWND_MAX = 256             # ...at most
+FILE_DUP_THRESH = 3             # later chunks acked before a hole counts as lost
 
 #fix: port for discovery (multicast/broadcast)
 DISCOVERY_PORT = 50999  #fix: port for discovery (multicast/broadcast)
@@ -15,8 +60,20 @@ DISCOVERY_PORT = 50999  #fix: port for discovery (multicast/broadcast)
 # Loss simulation (applies to game & file only)
 DEFAULT_LOSS_PROB = 0.0  # 0..1
 
+# Receive queue / handler worker pool
+RX_WORKERS = 2
+RX_QUEUE_CAPACITY = 1024
+OVERLOAD_POLICIES = ("drop_oldest", "drop_bulk", "block")
+BULK_TYPES = {"FILE_CHUNK"}  # shed first under drop_bulk
+TX_QUEUE_MAX_BYTES = 4 * 1024 * 1024  # unicast bytes the asyncio engine buffers while the socket is full
+
+# Receiver duplicate suppression: (sender, MESSAGE_ID) remembered this long / this many
+SEEN_TTL_SEC = 120              # > sender retry horizon (ACK_GIVE_UP_SEC plus backoff)
+SEEN_MAX = 8192
+
 # Non-verbose behavior: these are suppressed unless verbose
-SUPPRESS_TYPES = {"PING", "ACK", "FILE_RECEIVED", "REVOKE"}
+SUPPRESS_TYPES = {"PING", "ACK", "FILE_ACK", "FILE_NACK", "FILE_RESUME", "FILE_RECEIVED", "REVOKE",
+                  "PMTU_PROBE", "PMTU_ACK"}
 
 # Which types expect ACKs and retries
 ACK_TRACKED_TYPES = {
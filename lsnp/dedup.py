@@ -0,0 +1,50 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Tuple
+from .constants import SEEN_TTL_SEC, SEEN_MAX
+
+class SeenCache:
+    """
+    Recently handled (sender, MESSAGE_ID) pairs, so a retransmission or the second copy of
+    a broadcast+multicast send is recognised before any handler runs.
+    Entries sit in first-seen order: expiry pops from the front, and the oldest entry
+    goes first when `limit` is reached. `ttl` must outlast the sender's retry horizon.
+    hits / misses count duplicates suppressed and first copies let through.
+    """
+    def __init__(self, ttl: float = SEEN_TTL_SEC, limit: int = SEEN_MAX, clock=None):
+        self.ttl = ttl
+        self.limit = limit
+        self.clock = clock or time
+        self._seen: "OrderedDict[Hashable, float]" = OrderedDict()
+        self._lock = threading.Lock()  # handler workers share one cache
+        self.hits = 0
+        self.misses = 0
+
+    def seen(self, key: Tuple[str, str], record: bool = True) -> bool:
+        """True if key was seen within ttl; otherwise remember it (unless record=False)."""
+        with self._lock:
+            now = self.clock.time()
+            seen = self._seen
+            cutoff = now - self.ttl
+            while seen:
+                k, t = next(iter(seen.items()))
+                if t > cutoff:
+                    break
+                del seen[k]
+            if key in seen:
+                self.hits += 1
+                return True
+            self.misses += 1
+            if record:
+                seen[key] = now
+                if len(seen) > self.limit:
+                    seen.popitem(last=False)
+            return False
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def clear(self):
+        with self._lock:
+            self._seen.clear()
@@ -1,41 +1,60 @@
 import threading
 import time
-from .messages import build_message
+from .templates import MessageTemplate, TemplateCache
 from .constants import DISCOVERY_INTERVAL_SEC
 from .utils import now_ts
 
 class Discovery:
-    def __init__(self, user_id: str, display_name: str, tx, bcast_ip: str, log, include_multicast=True, loopback_mode=False):
+    # start=False leaves the periodic send to the caller (asyncio engine drives it from its loop)
+    def __init__(self, user_id: str, display_name: str, tx, bcast_ip: str, log, include_multicast=True, loopback_mode=False, start=True, caps=(), templates=None):
         self.user_id = user_id
         self.display_name = display_name
         self.tx = tx
         self.bcast_ip = bcast_ip
         self.log = log
         self.include_multicast = include_multicast
+        self.caps = ",".join(caps)  # advertised in PROFILE
+        self.templates = templates or TemplateCache()
 
         #fix: include loopback parameter
         self.loopback_mode = loopback_mode
 
         self.running = True
-        threading.Thread(target=self._loop, daemon=True).start()
+        if start:
+            threading.Thread(target=self._loop, daemon=True).start()
 
     def _loop(self):
         while self.running:
             self.send_ping_and_profile()
             time.sleep(DISCOVERY_INTERVAL_SEC)
 
-    def send_ping_and_profile(self):
-        ping = build_message({
+    # PING and PROFILE never change between sends; they are encoded once and only rebuilt
+    # when an input (display name, port, caps) changes, since those are part of the key
+    def ping_datagram(self) -> bytes:
+        return self.templates.get(("PING", self.user_id), lambda: MessageTemplate({
             "TYPE": "PING",
             "USER_ID": self.user_id
-        })
-        prof = build_message({
-            "TYPE": "PROFILE",
-            "USER_ID": self.user_id,
-            "DISPLAY_NAME": self.display_name,
-            "STATUS": "Exploring LSNP!",
-            "PORT": str(self.tx.listen_port()),   #fix: add port to profile message
-        })
+        })).text({})
+
+    def profile_datagram(self) -> bytes:
+        port = self.tx.listen_port()
+        key = ("PROFILE", self.user_id, self.display_name, port, self.caps)
+        def build():
+            fields = {
+                "TYPE": "PROFILE",
+                "USER_ID": self.user_id,
+                "DISPLAY_NAME": self.display_name,
+                "STATUS": "Exploring LSNP!",
+                "PORT": str(port),   #fix: add port to profile message
+            }
+            if self.caps:
+                fields["CAPS"] = self.caps
+            return MessageTemplate(fields)
+        return self.templates.get(key, build).text({})
+
+    def send_ping_and_profile(self):
+        ping = self.ping_datagram()
+        prof = self.profile_datagram()
 
         self.tx.send_broadcast(self.bcast_ip, ping)
         self.tx.send_broadcast(self.bcast_ip, prof)
@@ -0,0 +1,138 @@
+import re
+import threading
+import itertools
+from collections import deque
+from typing import Callable, Dict, Optional, Tuple
+from .binwire import is_binary, peek
+from .constants import BULK_TYPES, RX_QUEUE_CAPACITY, RX_WORKERS, OVERLOAD_POLICIES
+
+# cheap header peek so routing does not need a full parse on the receive thread
+_PEEK = re.compile(rb"^[ \t]*(TYPE|FILE_?ID|GAME_?ID)[ \t]*:[ \t]*([^\s]*)", re.M | re.I)
+
+def peek_route(raw: bytes) -> Tuple[str, bytes]:
+    """Return (TYPE, ordering key) where the key is the FILEID or GAMEID if present."""
+    if is_binary(raw):
+        return peek(raw)
+    mtype, key = "", b""
+    for k, v in _PEEK.findall(raw):
+        if k.upper() == b"TYPE":
+            mtype = mtype or v.decode("ascii", "ignore").upper()
+        elif not key:
+            key = v
+    return mtype, key
+
+class Dispatcher:
+    """
+    Bounded receive queue between recvfrom and App._on_packet, drained by a worker pool.
+      - packets with the same FILEID/GAMEID (else same source address) go to the same
+        worker, so per-key order is preserved
+      - capacity is shared by all workers; when full the overload policy applies:
+          drop_oldest: evict the oldest queued packet
+          drop_bulk:   drop bulk types (FILE_CHUNK) first, then the oldest
+          block:       hold the receive thread until there is room (kernel buffer absorbs);
+                       threads engine only, App rejects it under asyncio
+    stats() returns queue depth, high-water mark and drop counters for sizing.
+    """
+    def __init__(self, handler: Callable[[bytes, Tuple[str,int]], None], log,
+                 workers: int = RX_WORKERS, capacity: int = RX_QUEUE_CAPACITY, policy: str = "drop_oldest"):
+        if policy not in OVERLOAD_POLICIES:
+            raise ValueError(f"unknown overload policy: {policy}")
+        self.handler = handler
+        self.log = log
+        self.capacity = max(1, capacity)
+        self.policy = policy
+        self._queues = [deque() for _ in range(max(1, workers))]
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self.depth = 0
+        self.max_depth = 0
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped: Dict[str, int] = {"oldest": 0, "bulk": 0}
+        self.blocked = 0
+        self.running = True
+        for q in self._queues:
+            threading.Thread(target=self._worker, args=(q,), daemon=True).start()
+
+    def submit(self, raw, addr: Tuple[str,int], done: Optional[Callable[[], None]] = None):
+        # the receive buffer goes back to the pool when we return, so keep an exact-size copy
+        if not isinstance(raw, bytes):
+            raw = raw.encode("utf-8") if isinstance(raw, str) else bytes(raw)
+        mtype, key = peek_route(raw)
+        q = self._queues[hash(key or addr) % len(self._queues)]
+        item = (next(self._seq), mtype in BULK_TYPES, raw, addr, done)
+        with self._cond:
+            if self.depth >= self.capacity:
+                if self.policy == "block":
+                    self.blocked += 1
+                    while self.depth >= self.capacity and self.running:
+                        self._cond.wait()
+                elif self.policy == "drop_bulk" and item[1]:
+                    self._drop(item, "bulk")
+                    return
+                else:
+                    self._evict(bulk_first=(self.policy == "drop_bulk"))
+            q.append(item)
+            self.depth += 1
+            self.enqueued += 1
+            if self.depth > self.max_depth:
+                self.max_depth = self.depth
+            self._cond.notify_all()
+
+    def _evict(self, bulk_first: bool):
+        # caller holds the lock
+        if bulk_first:
+            for q in self._queues:
+                for it in q:
+                    if it[1]:
+                        q.remove(it)
+                        self.depth -= 1
+                        self._drop(it, "bulk")
+                        return
+        q = min((q for q in self._queues if q), key=lambda q: q[0][0])
+        it = q.popleft()
+        self.depth -= 1
+        self._drop(it, "oldest")
+
+    def _drop(self, item, why: str):
+        self.dropped[why] += 1
+        self.log.drop(f"RX queue full ({self.policy}): dropped {'bulk' if item[1] else 'packet'} from {item[3][0]}:{item[3][1]}")
+        if item[4]:
+            item[4]()
+
+    def _worker(self, q: deque):
+        while True:
+            with self._cond:
+                while not q and self.running:
+                    self._cond.wait()
+                if not self.running:
+                    return
+                _, _, raw, addr, done = q.popleft()
+                self.depth -= 1
+                self.processed += 1
+                self._cond.notify_all()
+            try:
+                self.handler(raw, addr)
+            except Exception as e:
+                self.log.error(f"Handler error: {e}")
+            finally:
+                if done:
+                    done()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                "depth": self.depth,
+                "max_depth": self.max_depth,
+                "capacity": self.capacity,
+                "enqueued": self.enqueued,
+                "processed": self.processed,
+                "dropped_oldest": self.dropped["oldest"],
+                "dropped_bulk": self.dropped["bulk"],
+                "blocked": self.blocked,
+            }
+
+    def stop(self):
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
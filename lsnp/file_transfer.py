@@ -1,45 +1,739 @@
 import base64
+import hashlib
+import mmap
 import os
-from typing import Dict
-from .messages import build_message, new_message_id
+import re
+import threading
+import zlib
+from collections import OrderedDict, deque
+from typing import Dict, Iterator, List, Optional, Tuple
+from .constants import FILE_ACK_EVERY, FILE_SACK_MAX_RANGES, FILE_RETX_BURST, FILE_DUP_THRESH, FILE_MAX_SOURCES
+from .constants import FILE_WRITE_COALESCE, FILE_RX_BUFFER_BUDGET, FILE_JOURNAL_EVERY, FILE_RESUME_MAX_RANGES
+from .constants import FILE_NACK_MAX, FILE_CHUNK_SIZE, FILE_CHUNK_MAX
+from .constants import FILE_FEC_MIN_LOSS, FILE_FEC_MAX_GROUP, FILE_FEC_PRIOR, FILE_FEC_KEEP
+from .constants import FILE_HASH_BLOCK, FILE_HASH_CACHE, FILE_HASH_INDEX, FILE_PREACCEPT_MAX, FILE_PREACCEPT_BUDGET, FILE_PREACCEPT_TTL_SEC
+from .constants import FILE_MAP_WINDOW, FILE_CWND_INIT, FILE_CWND_MIN, FILE_CWND_MAX, FILE_ACK_DELAY_SEC
+from .messages import new_message_id, field_payload, build_message, parse_message
 from .tokens import make_token, validate_token
 from .utils import now_ts
+from .templates import MessageTemplate, TemplateCache, encode_text
+
+# PROFILE capability: this peer acknowledges chunks with FILE_ACK (cumulative + SACK)
+CAP_FILE_ACK = "FILE_ACK"
+# PROFILE capability: this peer sends only the ranges a FILE_RESUME asks for
+CAP_FILE_RESUME = "RESUME"
+# PROFILE capability: this peer retransmits the MISSING ranges of a FILE_NACK at once
+CAP_FILE_NACK = "NACK"
+# PROFILE capability: this peer repairs chunks from parity FILE_CHUNKs (FEC field, no CHUNK_INDEX)
+CAP_FILE_FEC = "FEC"
+
+def join_ranges(ranges: List[Tuple[int, int]]) -> str:
+    return ",".join(f"{a}-{b}" if b > a else str(a) for a, b in ranges)
+
+# bitmap bytes with a chunk held / with one missing: long runs are skipped in C
+_ANY_BIT = re.compile(rb"[^\x00]")
+_NOT_FULL = re.compile(rb"[^\xff]")
+
+def _chunk_fields(index: int, data: bytes) -> Dict:
+    # variable FILE_CHUNK fields; CRC (CRC32 of the payload, hex) lets the receiver drop
+    # a chunk damaged on the way instead of writing it
+    return {"CHUNK_INDEX": str(index), "DATA": data, "CRC": f"{zlib.crc32(data):08x}"}
+
+def parse_ranges(spec: str) -> List[Tuple[int, int]]:
+    out = []
+    for part in spec.split(","):
+        a, _, b = part.strip().partition("-")
+        try:
+            out.append((int(a), int(b or a)))
+        except ValueError:
+            continue
+    return out
+
+class ChunkSource:
+    """
+    Read-only view of a file being sent, chunk by chunk.
+    The file is memory-mapped, so a chunk is a slice of the page cache taken when it is
+    transmitted (and again for a retransmission); nothing is read ahead or kept.
+    Mapped pages count toward RSS once touched, so pages more than FILE_MAP_WINDOW bytes
+    behind the furthest chunk read are dropped from the mapping (MADV_DONTNEED; a late
+    retransmission just faults them back in) and sending needs the same memory for any
+    file size. Empty files are not mappable and simply have no data.
+    """
+    def __init__(self, path: str, chunk_size: int):
+        self.chunk_size = chunk_size
+        self._f = open(path, "rb")
+        self.size = os.fstat(self._f.fileno()).st_size
+        self._map = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+        self._released = 0  # mapping offset below which pages were dropped
+        self._can_release = self._map is not None and hasattr(mmap, "MADV_DONTNEED")
+        if self._can_release:
+            self._map.madvise(mmap.MADV_SEQUENTIAL)  # first pass reads front to back
+
+    def __len__(self) -> int:
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunk(self, index: int) -> Optional[bytes]:
+        """Chunk `index` (b"" for an empty file), or None once closed."""
+        try:
+            if self._map is None:
+                return None if self._f.closed else b""
+            off = index * self.chunk_size
+            data = self._map[off:off + self.chunk_size]
+            if self._can_release and off - self._released >= 2 * FILE_MAP_WINDOW:
+                self._release(off - FILE_MAP_WINDOW)
+            return data
+        except ValueError:  # closed by another thread meanwhile
+            return None
+
+    def _release(self, upto: int):
+        upto -= upto % mmap.PAGESIZE
+        start = self._released
+        if upto > start:
+            self._released = upto
+            self._map.madvise(mmap.MADV_DONTNEED, start, upto - start)
+
+    def chunks(self) -> Iterator[bytes]:
+        for i in range(len(self)):
+            data = self.chunk(i)
+            if data is None:
+                return
+            yield data
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._f.close()
+
+class ChunkSink:
+    """
+    Receiving side of a transfer: chunks go straight into a preallocated temporary file
+    next to the destination (pwrite at index * chunk_size) and a bitmap records which
+    indices arrived, with a running count for the completion test. Consecutive chunks
+    are gathered into one write of up to FILE_WRITE_COALESCE bytes; `buffered` is what
+    is held in memory right now. finish() flushes and renames the file into place, so a
+    partial file never appears under its final name.
+    With `meta` (FROM, FILENAME, HASH of the offer) the sink also keeps a journal beside
+    the temporary file: the offer's identity, the geometry and the bitmap of chunks
+    already written, rewritten after every FILE_JOURNAL_EVERY bytes. A later offer of the
+    same file finds it with find_partial() and continues from it (resume()).
+    With `sha256` (hex digest from the offer) finish() refuses a file that does not match.
+    Writes that continue the hashed prefix are hashed on the way to disk; whatever arrived
+    out of order is read back once at the end.
+    """
+    def __init__(self, path: str, fileid: str, total: int, chunk_size: int, size: int = 0,
+                 meta: Optional[Dict[str, str]] = None, bits: Optional[bytearray] = None, sha256: str = ""):
+        self.path = path
+        self.tag = "".join(c for c in fileid if c.isalnum())  # FILEID comes off the wire
+        base = os.path.join(os.path.dirname(path), f".{self.tag}")
+        self.tmp = base + ".part"
+        self.journal = base + ".journal" if meta is not None else None
+        self.meta = meta
+        self.total = total
+        self.chunk_size = chunk_size
+        self.size = size
+        self.bits = bits if bits is not None else bytearray((total + 7) // 8)
+        held = int.from_bytes(self.bits, "little")
+        self.received = bin(held).count("1")
+        self.high = held.bit_length() - 1       # highest index received
+        # file length implied by the chunks so far
+        self.end = min(size, (self.high + 1) * chunk_size) if self.high >= 0 else 0
+        self._buf = bytearray()
+        self._buf_off = 0
+        self._unjournaled = 0
+        self.sha256 = sha256
+        self._sha = hashlib.sha256() if sha256 else None
+        self._hashed = 0  # file bytes fed to _sha so far
+        self.digest = ""  # hex SHA-256 of the finished file, when checked
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        self._fd = os.open(self.tmp, flags if bits is not None else flags | os.O_TRUNC, 0o644)
+        size = min(size, total * chunk_size) if size > 0 else total * chunk_size
+        if hasattr(os, "posix_fallocate") and size:
+            try:
+                os.posix_fallocate(self._fd, 0, size)
+            except OSError:  # e.g. filesystem without fallocate
+                os.ftruncate(self._fd, size)
+        else:
+            os.ftruncate(self._fd, size)
+        if self.journal:
+            self._save_journal()
+
+    @classmethod
+    def resume(cls, path: str, record: Dict[str, str], total: int, chunk_size: int,
+               meta: Dict[str, str], sha256: str = "") -> "ChunkSink":
+        """Reopen the partial file of a journal record (from find_partial) for a new offer."""
+        size = int(record["FILESIZE"])
+        bits = bytearray(base64.b64decode(record.get("BITMAP", "")))
+        old_size = int(record["CHUNK_SIZE"])
+        if old_size != chunk_size:
+            bits = _rebase(bits, old_size, chunk_size, total, size)
+        return cls(path, record["FILEID"], total, chunk_size, size, meta, bits, sha256)
+
+    def has(self, index: int) -> bool:
+        return bool(self.bits[index >> 3] & (1 << (index & 7)))
+
+    @property
+    def complete(self) -> bool:
+        return self.received == self.total
+
+    @property
+    def buffered(self) -> int:
+        return len(self._buf)
+
+    def add(self, index: int, data: bytes) -> bool:
+        """Store one chunk; False if it was a duplicate."""
+        byte, bit = index >> 3, 1 << (index & 7)
+        if self.bits[byte] & bit:
+            return False
+        off = index * self.chunk_size
+        buf = self._buf
+        if not buf or off != self._buf_off + len(buf) or len(buf) + len(data) > FILE_WRITE_COALESCE:
+            self.flush()
+            self._buf_off = off
+        self._buf += data
+        # marked after the flush above, so a journal written there lists only chunks on disk
+        self.bits[byte] |= bit
+        self.received += 1
+        self.high = max(self.high, index)
+        self.end = max(self.end, off + len(data))
+        return True
+
+    def length(self, index: int) -> Optional[int]:
+        """Bytes in chunk `index`; None for the last one when the file size is unknown."""
+        if index < self.total - 1:
+            return self.chunk_size
+        return self.size - index * self.chunk_size if self.size > 0 else None
+
+    def read(self, index: int) -> bytes:
+        """A chunk already added, from the write buffer or the temporary file."""
+        off, n = index * self.chunk_size, self.length(index) or self.chunk_size
+        rel = off - self._buf_off
+        if self._buf and 0 <= rel < len(self._buf):
+            return bytes(self._buf[rel:rel + n])
+        return _pread(self._fd, n, off)
+
+    def held(self, start: int, limit: int = FILE_SACK_MAX_RANGES) -> List[Tuple[int, int]]:
+        """Index ranges received from `start` on, lowest first, at most `limit` of them."""
+        out = []
+        bits, end = self.bits, self.high + 1
+        i = max(start, 0)
+        while i < end and len(out) < limit:
+            if not self.has(i):
+                i += 1
+                if not i & 7:
+                    m = _ANY_BIT.search(bits, i >> 3)
+                    i = m.start() << 3 if m else end
+                continue
+            first = i
+            while i < end and self.has(i):
+                i += 1
+                if not i & 7:
+                    m = _NOT_FULL.search(bits, i >> 3)
+                    i = m.start() << 3 if m else end
+            out.append((first, min(i, end) - 1))
+        return out
+
+    def missing(self, limit: int = FILE_RESUME_MAX_RANGES) -> List[Tuple[int, int]]:
+        """Index ranges not received yet; past `limit` ranges the last one runs to the end."""
+        out = []
+        bits, total = self.bits, self.total
+        i = 0
+        while i < total:
+            if not i & 7 and bits[i >> 3] == 0xFF:
+                i += 8
+                continue
+            if self.has(i):
+                i += 1
+                continue
+            start = i
+            while i < total and not self.has(i):
+                i += 8 if not i & 7 and not bits[i >> 3] else 1
+            out.append((start, min(i, total) - 1))
+            if len(out) >= limit:
+                out[-1] = (start, total - 1)
+                break
+        return out
+
+    def flush(self):
+        if self._buf:
+            if self._sha is not None and self._buf_off == self._hashed:
+                self._sha.update(self._buf)
+                self._hashed += len(self._buf)
+            _pwrite(self._fd, memoryview(self._buf), self._buf_off)
+            self._unjournaled += len(self._buf)
+            self._buf = bytearray()
+            if self.journal and self._unjournaled >= max(FILE_JOURNAL_EVERY, 256 * len(self.bits)):
+                self._save_journal()
+
+    def _save_journal(self):
+        record = dict(self.meta, FILEID=self.tag, FILESIZE=str(self.size), TOTAL_CHUNKS=str(self.total),
+                      CHUNK_SIZE=str(self.chunk_size), BITMAP=base64.b64encode(self.bits).decode("ascii"))
+        tmp = self.journal + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(build_message(record))
+        os.replace(tmp, self.journal)  # a crash leaves the previous journal, never half of one
+        self._unjournaled = 0
+
+    def finish(self) -> str:
+        """Move the file into place; ValueError (file discarded) when it fails its SHA-256."""
+        self.flush()
+        os.ftruncate(self._fd, self.end)  # the last chunk is usually short
+        if self._sha is not None:
+            while self._hashed < self.end:
+                block = _pread(self._fd, min(FILE_HASH_BLOCK, self.end - self._hashed), self._hashed)
+                if not block:
+                    break
+                self._sha.update(block)
+                self._hashed += len(block)
+            self.digest = self._sha.hexdigest()
+            if self.digest != self.sha256.lower():
+                self.abort()
+                raise ValueError(f"SHA-256 {self.digest[:16]}... does not match the offer")
+        os.close(self._fd)
+        os.replace(self.tmp, self.path)
+        self._drop_journal()
+        return self.path
+
+    def abort(self):
+        self._buf = bytearray()
+        try:
+            os.close(self._fd)
+            os.remove(self.tmp)
+        except OSError:
+            pass
+        self._drop_journal()
+
+    def _drop_journal(self):
+        if self.journal:
+            try:
+                os.remove(self.journal)
+            except OSError:
+                pass
+
+def file_sha256(path: str) -> str:
+    """Hex SHA-256 of a file, read FILE_HASH_BLOCK bytes at a time."""
+    h = hashlib.sha256()
+    buf = bytearray(FILE_HASH_BLOCK)
+    view = memoryview(buf)
+    with open(path, "rb") as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+    return h.hexdigest()
+
+class FileHashes:
+    """
+    SHA-256 of files by path, recomputed only when a file's size or mtime changes (the
+    last FILE_HASH_CACHE are kept). Received files are also indexed by digest in a sidecar
+    (FILE_HASH_INDEX) at the top of their inbox, read once per inbox, so find() knows files
+    from earlier runs without walking or hashing the inbox.
+    """
+    def __init__(self, limit: int = FILE_HASH_CACHE):
+        self.limit = limit
+        self._known: "OrderedDict[str, Tuple[int, int, str]]" = OrderedDict()  # path -> (size, mtime_ns, sha256)
+        self._index: Dict[str, Dict[str, Tuple[str, int, int]]] = {}  # inbox -> sha256 -> (relpath, size, mtime_ns)
+        self._lock = threading.Lock()
+
+    def sha256(self, path: str) -> str:
+        st = os.stat(path)
+        with self._lock:
+            known = self._known.get(path)
+        if known and known[:2] == (st.st_size, st.st_mtime_ns):
+            return known[2]
+        digest = file_sha256(path)
+        self._put(path, (st.st_size, st.st_mtime_ns, digest))
+        return digest
+
+    def add(self, path: str, digest: str, root: str):
+        """Record a digest computed elsewhere (e.g. while the file was received) under inbox root."""
+        st = os.stat(path)
+        self._put(path, (st.st_size, st.st_mtime_ns, digest))
+        rel = os.path.relpath(path, root)
+        entry = (rel, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            self._inbox(root)[digest] = entry
+            if "\n" not in rel:
+                try:
+                    with open(os.path.join(root, FILE_HASH_INDEX), "a", encoding="utf-8") as f:
+                        f.write(f"{digest} {entry[1]} {entry[2]} {rel}\n")
+                except OSError:
+                    pass  # still found in this run
+
+    def _put(self, path: str, entry: Tuple[int, int, str]):
+        with self._lock:
+            self._known[path] = entry
+            self._known.move_to_end(path)
+            while len(self._known) > self.limit:
+                self._known.popitem(last=False)
+
+    def _inbox(self, root: str) -> Dict[str, Tuple[str, int, int]]:
+        # called with self._lock held; the first call per inbox reads (and compacts) its sidecar
+        key = os.path.abspath(root)
+        index = self._index.get(key)
+        if index is not None:
+            return index
+        index = self._index[key] = {}
+        sidecar = os.path.join(root, FILE_HASH_INDEX)
+        lines = 0
+        try:
+            with open(sidecar, encoding="utf-8") as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        digest, size, mtime, rel = line.rstrip("\n").split(" ", 3)
+                        entry = (rel, int(size), int(mtime))
+                    except ValueError:
+                        continue
+                    if not os.path.isabs(rel) and rel.split(os.sep)[0] != os.pardir:
+                        index[digest] = entry  # later lines replace earlier ones
+        except OSError:
+            return index
+        if lines > 2 * len(index) + 64:
+            tmp = sidecar + ".tmp"
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.writelines(f"{d} {size} {mtime} {rel}\n" for d, (rel, size, mtime) in index.items())
+                os.replace(tmp, sidecar)
+            except OSError:
+                pass
+        return index
+
+    def find(self, root: str, digest: str, size: int) -> Optional[str]:
+        """A received file under root with this digest and size, unchanged since; else None."""
+        with self._lock:
+            entry = self._inbox(root).get(digest.lower())
+        if not entry or entry[1] != size:
+            return None
+        path = os.path.join(root, entry[0])
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return path if (st.st_size, st.st_mtime_ns) == entry[1:] else None
+
+def find_partial(base_dir: str, meta: Dict[str, str], size: int) -> Optional[Dict[str, str]]:
+    """Journal record in base_dir left by an earlier offer of the same file, if any."""
+    try:
+        names = [n for n in os.listdir(base_dir) if n.startswith(".") and n.endswith(".journal")]
+    except OSError:
+        return None
+    for name in names:
+        try:
+            with open(os.path.join(base_dir, name), encoding="utf-8") as f:
+                record = dict(parse_message(f.read()))
+            if (all(record.get(k, "") == v for k, v in meta.items())
+                    and int(record.get("FILESIZE", "-1")) == size and int(record.get("CHUNK_SIZE", "0")) > 0
+                    and os.path.exists(os.path.join(base_dir, f".{record['FILEID']}.part"))):
+                return record
+        except (OSError, ValueError, KeyError):
+            continue
+    return None
+
+def _rebase(bits: bytearray, old_size: int, chunk_size: int, total: int, size: int) -> bytearray:
+    # bitmap for a new chunk size: a chunk counts as held when every old chunk under it is
+    out = bytearray((total + 7) // 8)
+    for j in range(total):
+        lo = j * chunk_size // old_size
+        hi = (min(size, (j + 1) * chunk_size) - 1) // old_size
+        if all(k >> 3 < len(bits) and bits[k >> 3] & (1 << (k & 7)) for k in range(lo, hi + 1)):
+            out[j >> 3] |= 1 << (j & 7)
+    return out
+
+def _pread(fd: int, n: int, offset: int) -> bytes:
+    if hasattr(os, "pread"):
+        return os.pread(fd, n, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, n)
+
+def _pwrite(fd: int, data, offset: int):
+    if hasattr(os, "pwrite"):
+        while data:
+            n = os.pwrite(fd, data, offset)
+            data, offset = data[n:], offset + n
+    else:
+        os.lseek(fd, offset, os.SEEK_SET)
+        os.write(fd, data)
 
 class FileTransfers:
-    def __init__(self, user_id: str, tx, peers, ack_mgr, log, loss_scope="file"):
+    """
+    FILE_OFFER / FILE_CHUNK both ways. Legacy peers ACK every chunk on its own; peers with
+    CAP_FILE_ACK get a windowed sender and answer with FILE_ACK (and FILE_NACK, FILE_RESUME
+    and parity chunks when their caps allow). README.md, "LSNP file transfer", describes
+    the exchange.
+    """
+    def __init__(self, user_id: str, tx, peers, ack_mgr, log, loss_scope="file", encode=None, templates=None, sched=None,
+                 raw_data=None, pmtu=None, fec=False, send_acks=None):
         self.user_id = user_id
         self.tx = tx
         self.peers = peers
         self.ack_mgr = ack_mgr
         self.log = log
         self.loss_scope = loss_scope
-        # fileid -> { offer:{...}, accepted:bool, chunks:dict(index->bytes), total:int, filename:str, sender:str }
+        # encode(to_user, fields, template=None) -> str | bytes; picks the wire format the peer understands
+        self.encode = encode or encode_text
+        self.templates = templates or TemplateCache()
+        # raw_data(to_user) -> bool: DATA goes to that peer unencoded (binary or CAP_RAW_DATA)
+        self.raw_data = raw_data or (lambda to_user: False)
+        self.pmtu = pmtu  # PathMtu, or None: chunks are always FILE_CHUNK_SIZE-based
+        self.fec = fec  # send parity chunks to CAP_FILE_FEC peers when there is loss
+        # send_acks(endpoint, uid, mids): ACK chunks held before accept once they are committed
+        self.send_acks = send_acks
+        self._loss: Dict[str, float] = {}  # peer -> loss rate seen by the last transfer to it
+        # time()/call_later scheduler for the receiver's delayed FILE_ACK (None: batch only)
+        self.sched = sched
+        # fileid -> { offer:{...}, accepted:bool, sink:ChunkSink|None, total:int, filename:str, sender:str }
         self.rx: Dict[str, Dict] = {}
-        # resend book-keeping: mid -> (callable that re-sends the message)
-        self._resenders: Dict[str, callable] = {}
+        self.rx_buffered = 0  # bytes held in ChunkSink write buffers, all inbound transfers
+        self.rx_early = 0  # chunk bytes held for offers not accepted yet
+        # files being sent: fileid -> ChunkSource. Retransmissions re-read a chunk from the
+        # mapping, so pending entries never hold payload copies.
+        self._sources: "OrderedDict[str, ChunkSource]" = OrderedDict()
+        # per-chunk MESSAGE_IDs of transfers to legacy peers, settled together by FILE_RECEIVED
+        self._chunk_mids: Dict[str, List[str]] = {}
+        # FILE_ACK transfers we are sending: fileid -> {to, ip, port, total, cum, unacked:{idx: [data, sent_at, seq, sends]}, ...}
+        # (data is None when the chunk can be re-read from _sources)
+        self._out: Dict[str, Dict] = {}
+        # recently completed receives, to re-acknowledge late duplicates: fileid -> (sender, total)
+        self._done: "OrderedDict[str, Tuple[str, int]]" = OrderedDict()
+        self._lock = threading.Lock()  # _out is touched by the CLI, handler and ACK timer threads
+        self.retransmits = 0
+        self.probes = 0
+        self.file_acks_sent = 0
+        self.file_nacks_sent = 0
+        self.parity_sent = 0
+        self.fec_recovered = 0
+        self.crc_errors = 0
+        self.dedup_skips = 0
+        # SHA-256 of files we send (for FILE_OFFER HASH) and of the inbox (to skip offers of files we hold)
+        self.hashes = FileHashes()
+        self.last_goodput: Optional[Dict] = None  # {fileid, bytes, seconds, kib_per_sec} of the last windowed send
 
-    def _send_and_track(self, ip, port, msg_dict, scope="file"):
+    def _send_and_track(self, ip, port, msg_dict, scope="file", template=None, resend=None, evictable=True):
         # ensure MESSAGE_ID
         if "MESSAGE_ID" not in msg_dict:
             msg_dict["MESSAGE_ID"] = new_message_id()
         mid = msg_dict["MESSAGE_ID"]
-        raw = build_message(msg_dict)
-
-        def do_resend():
-            # rebuild to include any fields the caller may mutate
-            self.tx.send_unicast(ip, port, build_message(msg_dict), drop_for=scope)
-
-        # store a resender so AckManager (via App fallback) can re-send us
-        self._resenders[mid] = do_resend
+        to_user = msg_dict.get("TO") or (template.static.get("TO", "") if template else "")
+        raw = self.encode(to_user, msg_dict, template)
 
         # self.tx.send_unicast(ip, raw, drop_for=scope)
         # fix: include port in send_unicast
         self.tx.send_unicast(ip, port, raw, drop_for=scope)
 
-        self.ack_mgr.track(mid)
+        # the resender lives on the AckManager entry and goes away with it
+        self.ack_mgr.track(mid, (ip, port), resend=resend or (lambda: self.tx.send_unicast(ip, port, raw, drop_for=scope)),
+                           evictable=evictable)
+
+    # ---------- chunk sources ----------
+    def open_source(self, fileid: str, path: str, chunk_size: int) -> ChunkSource:
+        src = ChunkSource(path, chunk_size)
+        with self._lock:
+            self._sources[fileid] = src
+            while len(self._sources) > FILE_MAX_SOURCES:
+                old = next(iter(self._sources))
+                self._out.pop(old, None)  # e.g. an offer that was never accepted
+                self._close_source(old)
+        return src
+
+    def _close_source(self, fileid: str) -> List[str]:
+        # called with self._lock held; returns chunk MESSAGE_IDs the caller should discard
+        src = self._sources.pop(fileid, None)
+        if src:
+            src.close()
+        return self._chunk_mids.pop(fileid, [])
+
+    def read_chunk(self, fileid: str, index: int) -> Optional[bytes]:
+        """Chunk `index` of a file opened with open_source (None once the transfer is closed)."""
+        src = self._sources.get(fileid)
+        return src.chunk(index) if src is not None else None
+
+    def chunk_size_for(self, to_user: str, size: int = 0) -> int:
+        """
+        Chunk bytes for a transfer of `size` bytes (0: unknown) to to_user: what fills the
+        peer's probed path MTU after the largest header the transfer can send, else
+        FILE_CHUNK_SIZE as base64 (or what the same DATA field carries raw).
+        """
+        raw = self.raw_data(to_user)
+        pmtu = self.pmtu.get(to_user) if self.pmtu else None
+        if not pmtu:
+            return FILE_CHUNK_SIZE * 4 // 3 if raw else FILE_CHUNK_SIZE
+        room = pmtu - self._chunk_header_len(to_user, size)
+        # binary framing: DATA's length prefix grows to 3 bytes; text: 4 base64 chars per 3 bytes
+        room = room - 2 if raw else room // 4 * 3
+        return max(256, min(room, FILE_CHUNK_MAX))
+
+    def _chunk_header_len(self, to_user: str, size: int) -> int:
+        # FILE_CHUNK bytes besides the payload, rendered for to_user as the largest chunk of
+        # the transfer: the last index, a parity chunk's FEC range, and a MESSAGE_ID when
+        # the peer ACKs chunk by chunk
+        last = str(-(-size // 256) if size else 10 ** 10)  # chunks are at least 256 bytes
+        tmpl = MessageTemplate({
+            "TYPE": "FILE_CHUNK", "FROM": self.user_id, "TO": to_user, "FILEID": "0" * 8,
+            "TOTAL_CHUNKS": last, "CHUNK_SIZE": str(FILE_CHUNK_MAX),
+            "TOKEN": make_token(self.user_id, now_ts(), "file"),
+        })
+        crc = "0" * 8
+        data = {"CHUNK_INDEX": last, "DATA": b"", "CRC": crc}
+        if not self.peers.supports(to_user, CAP_FILE_ACK):
+            data["MESSAGE_ID"] = "f" * 16
+        parity = {"FEC": f"{last}-{last}/9", "DATA": b"", "CRC": crc}
+        return max(len(self.encode(to_user, fields, tmpl)) for fields in (data, parity))
+
+    def send_file(self, to_user: str, path: str, fileid: str, chunk_size: int, filetype: str, description: str, ttl=3600):
+        src = self.open_source(fileid, path, chunk_size)
+        total = len(src)
+        windowed = self.peers.supports(to_user, CAP_FILE_ACK)
+        if windowed:
+            ip, port = self.peers.endpoint_of(to_user)
+            with self._lock:
+                st = self._new_out(to_user, ip, port, fileid, total, chunk_size, ttl)
+                st.update(accepted=False, next=0, size=src.size)
+        self.send_offer(to_user, fileid, os.path.basename(path), src.size, filetype, description, ttl=ttl,
+                        total=total, chunk_size=chunk_size, sha256=self.hashes.sha256(path))
+        if windowed:
+            return  # chunks flow once the receiver's accept FILE_ACK arrives
+        # legacy peer: no accept signal, chunks go out at once and are ACKed one by one
+        for i, data in enumerate(src.chunks()):
+            self.send_chunk(to_user, fileid, i, total, data, chunk_size, ttl=ttl)
+
+    def _new_out(self, to_user, ip, port, fileid, total, chunk_size, ttl) -> Dict:
+        # called with self._lock held
+        st = self._out[fileid] = {
+            "to": to_user, "ip": ip, "port": port, "total": total,
+            "chunk_size": chunk_size, "ttl": ttl, "key": f"FILE:{fileid}",
+            "cum": -1, "unacked": {}, "accepted": True, "next": total,
+            "cwnd": float(FILE_CWND_INIT), "ssthresh": float(FILE_CWND_MAX),
+            "seq": 0, "acked_seq": 0, "recover": 0, "probe": None,
+            "started": self.ack_mgr.clock.time(), "size": 0,
+            # parity: the group being XORed (None between groups); sent/lost/recovered: loss rate
+            "parity": self.fec and self.peers.supports(to_user, CAP_FILE_FEC), "fec": None,
+            "sent": 0, "lost": 0, "recovered": 0,
+        }
+        return st
+
+    def _fill(self, st: Dict, now: float) -> List[int]:
+        # called with self._lock held: claim the next chunks the window allows
+        out = []
+        unacked = st["unacked"]
+        want = st.get("want")  # FILE_RESUME: only these ranges
+        while st["next"] < st["total"] and len(unacked) < int(st["cwnd"]):
+            i = st["next"]
+            if want is not None:
+                while want and i > want[0][1]:
+                    want.popleft()
+                if not want:
+                    st["next"] = st["total"]
+                    break
+                i = max(i, want[0][0])
+            st["next"] = i + 1
+            unacked[i] = ent = [None, 0.0, 0, 0]
+            self._stamp(st, ent, now)
+            out.append(i)
+        return out
+
+    @staticmethod
+    def _stamp(st: Dict, ent: List, now: float):
+        # record a (re)transmission: when, its place in the transfer's send order, how many
+        st["seq"] += 1
+        ent[1], ent[2] = now, st["seq"]
+        ent[3] += 1
+
+    def _send_new(self, st: Dict, indices: List[int]):
+        fileid = st["key"][5:]
+        tmpl = self._chunk_template(st["to"], fileid, st["total"], st["chunk_size"], st["ttl"])
+        for i in indices:
+            data = self.read_chunk(fileid, i)
+            if data is None:
+                return
+            raw = self.encode(st["to"], _chunk_fields(i, data), tmpl)
+            self.tx.send_unicast(st["ip"], st["port"], raw, drop_for=self.loss_scope)
+            with self._lock:
+                st["sent"] += 1
+            if st["parity"]:
+                self._send_parity(st, tmpl, self._fec_add(st, i, data))
+        if st["fec"] is not None and st["next"] >= st["total"]:
+            self._send_parity(st, tmpl, self._fec_close(st))  # nothing follows: protect the tail now
+        if indices and st["key"] not in self.ack_mgr.pending:
+            self._track_transfer(st)
+        self._arm_probe(st)
+
+    # parity groups are only touched from _send_new, which runs in the FILE_ACK handler
+    # (packets of one FILEID are handled in order, see Dispatcher)
+    def _fec_add(self, st: Dict, index: int, data: bytes) -> List[Tuple[str, bytes]]:
+        g = st["fec"]
+        out = []
+        if g is not None and index != g["last"] + 1:
+            out = self._fec_close(st)  # a jump (FILE_RESUME ranges): close the group short
+            g = None
+        if g is None:
+            shape = self._fec_shape(st)
+            if shape is None:
+                return out
+            n, k = shape
+            g = st["fec"] = {"first": index, "last": index - 1, "n": n, "k": k, "acc": [0] * k, "len": [0] * k}
+        j = (index - g["first"]) % g["k"]
+        g["acc"][j] ^= int.from_bytes(data, "little")
+        g["len"][j] = max(g["len"][j], len(data))
+        g["last"] = index
+        if index - g["first"] + 1 >= g["n"]:
+            out += self._fec_close(st)
+        return out
+
+    @staticmethod
+    def _fec_close(st: Dict) -> List[Tuple[str, bytes]]:
+        # (FEC spec, parity) for each interleaved set of the group
+        g, st["fec"] = st["fec"], None
+        a, b, k = g["first"], g["last"], g["k"]
+        return [(f"{a + j}-{b - (b - a - j) % k}/{k}", g["acc"][j].to_bytes(g["len"][j], "little"))
+                for j in range(min(k, b - a + 1))]
+
+    def _fec_shape(self, st: Dict) -> Optional[Tuple[int, int]]:
+        # (data chunks, parity chunks) per group for the loss seen so far; None: no parity
+        with self._lock:
+            p = self._loss_rate(st)
+        if p < FILE_FEC_MIN_LOSS:
+            return None
+        k = 1 if p < 0.05 else 2 if p < 0.12 else 3  # interleaving: K losses in one group can all be repaired
+        return max(2 * k, min(FILE_FEC_MAX_GROUP, int(k / (2 * p)))), k
+
+    def _loss_rate(self, st: Dict) -> float:
+        prior = self._loss.get(st["to"], 0.0)
+        return (prior * FILE_FEC_PRIOR + st["lost"] + st["recovered"]) / (FILE_FEC_PRIOR + st["sent"])
+
+    def _send_parity(self, st: Dict, tmpl: MessageTemplate, parity: List[Tuple[str, bytes]]):
+        for spec, data in parity:
+            self.parity_sent += 1
+            raw = self.encode(st["to"], {"FEC": spec, "DATA": data, "CRC": f"{zlib.crc32(data):08x}"}, tmpl)
+            self.tx.send_unicast(st["ip"], st["port"], raw, drop_for=self.loss_scope)
+
+    def _arm_probe(self, st: Dict):
+        if self.sched is None or not st.get("size"):
+            return
+        # never sooner than the peer's RTO: 2 x SRTT alone fires on ordinary delay variation
+        peer = (st["ip"], st["port"])
+        pto = max(2 * (self.ack_mgr.srtt_of(peer) or 0.0), self.ack_mgr.rto_of(peer))
+        fileid = st["key"][5:]
+        with self._lock:
+            if st["probe"] is not None:
+                st["probe"].cancel()
+            st["probe"] = self.sched.call_later(pto, lambda: self._on_probe(fileid)) if st["unacked"] else None
+
+    def _on_probe(self, fileid: str):
+        now = self.ack_mgr.clock.time()
+        with self._lock:
+            st = self._out.get(fileid)
+            if not st or not st["unacked"] or st["probe"] is None:
+                return
+            st["probe"] = None
+            i, ent = max(st["unacked"].items(), key=lambda kv: kv[1][2])
+            self._stamp(st, ent, now)
+            self.probes += 1
+        self._retransmit(st, [i])
 
     # ---------- sender side ----------
-    def send_offer(self, to_user: str, fileid: str, filename: str, filesize: int, filetype: str, description: str, ttl=3600):
+    def send_offer(self, to_user: str, fileid: str, filename: str, filesize: int, filetype: str, description: str, ttl=3600,
+                   total: Optional[int] = None, chunk_size: Optional[int] = None, sha256: str = ""):
         # ip = self.peers.address_of(to_user)
         # fix: use endpoint_of to get both ip and port
         ip, port = self.peers.endpoint_of(to_user)
@@ -57,27 +751,274 @@ class FileTransfers:
             "TIMESTAMP": str(now_ts()),
             "TOKEN": tok,
         }
+        if total is not None:
+            # chunk geometry up front, so a receiver holding part of the file can resume it
+            msg["TOTAL_CHUNKS"], msg["CHUNK_SIZE"] = str(total), str(chunk_size)
+        if sha256:
+            msg["HASH"] = sha256  # hex SHA-256 of the whole file
         self._send_and_track(ip, port, msg, scope=self.loss_scope)
 
+    def _chunk_template(self, to_user: str, fileid: str, total: int, chunk_size: int, ttl: int) -> MessageTemplate:
+        # the header (and its token) is the same for every chunk of a transfer
+        def build():
+            issued = now_ts()
+            return MessageTemplate({
+                "TYPE": "FILE_CHUNK",
+                "FROM": self.user_id,
+                "TO": to_user,
+                "FILEID": fileid,
+                "TOTAL_CHUNKS": str(total),
+                "CHUNK_SIZE": str(chunk_size),
+                "TOKEN": make_token(self.user_id, issued + ttl, "file"),
+            }, expires=issued + ttl // 2)
+        return self.templates.get(("FILE_CHUNK", fileid, to_user, total, chunk_size, ttl), build)
+
     def send_chunk(self, to_user: str, fileid: str, index: int, total: int, chunk_bytes: bytes, chunk_size: int, ttl=3600):
         # ip = self.peers.address_of(to_user)
         # fix: use endpoint_of to get both ip and port
         ip, port = self.peers.endpoint_of(to_user)
+        tmpl = self._chunk_template(to_user, fileid, total, chunk_size, ttl)
+        msg = _chunk_fields(index, chunk_bytes)  # DATA: raw in binary framing, base64 in text
+        if not self.peers.supports(to_user, CAP_FILE_ACK):
+            resend = None
+            if fileid in self._sources:
+                # re-read the chunk on retry instead of holding its bytes
+                resend = lambda: self._retransmit_one(to_user, ip, port, fileid, index, total, chunk_size, ttl)
+                msg["MESSAGE_ID"] = new_message_id()
+                with self._lock:
+                    self._chunk_mids.setdefault(fileid, []).append(msg["MESSAGE_ID"])
+            # a chunk that is re-read on retry holds no payload, and open sources bound how
+            # many there are: they stay out of the ACK table's count, so a file larger than
+            # ACK_MAX_PENDING chunks does not evict (and fail) its own first chunks
+            self._send_and_track(ip, port, msg, scope=self.loss_scope, template=tmpl, resend=resend,
+                                 evictable=resend is None)
+            return
 
-        tok = make_token(self.user_id, now_ts() + ttl, "file")
-        b64 = base64.b64encode(chunk_bytes).decode("ascii")
-        msg = {
-            "TYPE": "FILE_CHUNK",
-            "FROM": self.user_id,
-            "TO": to_user,
-            "FILEID": fileid,
-            "CHUNK_INDEX": str(index),
-            "TOTAL_CHUNKS": str(total),
-            "CHUNK_SIZE": str(chunk_size),
-            "DATA": b64,
-            "TOKEN": tok
-        }
-        self._send_and_track(ip, port, msg, scope=self.loss_scope)
+        now = self.ack_mgr.clock.time()
+        with self._lock:
+            st = self._out.get(fileid)
+            if st is None:
+                st = self._new_out(to_user, ip, port, fileid, total, chunk_size, ttl)
+            # data, last sent, send sequence number, sends
+            ent = st["unacked"][index] = [None if fileid in self._sources else chunk_bytes, 0.0, 0, 0]
+            self._stamp(st, ent, now)
+            arm = st["key"] not in self.ack_mgr.pending
+        self.tx.send_unicast(ip, port, self.encode(to_user, msg, tmpl), drop_for=self.loss_scope)
+        if arm:
+            self._track_transfer(st)
+
+    def _track_transfer(self, st: Dict):
+        fileid = st["key"][5:]
+        self.ack_mgr.track(st["key"], (st["ip"], st["port"]), resend=lambda: self._on_timeout(fileid))
+
+    def _retransmit_one(self, to_user, ip, port, fileid, index, total, chunk_size, ttl):
+        data = self.read_chunk(fileid, index)
+        if data is None:
+            return
+        tmpl = self._chunk_template(to_user, fileid, total, chunk_size, ttl)
+        raw = self.encode(to_user, _chunk_fields(index, data), tmpl)
+        self.tx.send_unicast(ip, port, raw, drop_for=self.loss_scope)
+
+    def _retransmit(self, st: Dict, indices: List[int]):
+        fileid = st["key"][5:]
+        tmpl = self._chunk_template(st["to"], fileid, st["total"], st["chunk_size"], st["ttl"])
+        for i in indices:
+            with self._lock:
+                ent = st["unacked"].get(i)
+                data = ent and ent[0]
+            if ent is not None and data is None:
+                data = self.read_chunk(fileid, i)
+            if data is None:
+                continue
+            with self._lock:
+                self.retransmits += 1
+                st["sent"] += 1
+            raw = self.encode(st["to"], _chunk_fields(i, data), tmpl)
+            self.tx.send_unicast(st["ip"], st["port"], raw, drop_for=self.loss_scope)
+
+    def _stale(self, st: Dict, now: float, limit: int, skip=()) -> List[int]:
+        # chunks outstanding for longer than the peer's RTO; lowest index first
+        rto = self.ack_mgr.rto_of((st["ip"], st["port"]))
+        out = []
+        for i in sorted(st["unacked"]):
+            if len(out) >= limit:
+                break
+            ent = st["unacked"][i]
+            if i not in skip and now - ent[1] >= rto:
+                self._stamp(st, ent, now)
+                out.append(i)
+        return out
+
+    def _on_timeout(self, fileid: str):
+        # AckManager retry for the whole transfer: resend the oldest hole (and anything else stale)
+        now = self.ack_mgr.clock.time()
+        with self._lock:
+            st = self._out.get(fileid)
+            if not st or not st["unacked"]:
+                return
+            lowest = min(st["unacked"])
+            self._stamp(st, st["unacked"][lowest], now)
+            todo = [lowest] + self._stale(st, now, FILE_RETX_BURST - 1, skip=(lowest,))
+            st["lost"] += len(todo)
+            # no feedback for a whole RTO: restart from a small window
+            st["ssthresh"] = max(st["cwnd"] / 2, float(FILE_CWND_MIN))
+            st["cwnd"] = float(FILE_CWND_MIN)
+            st["recover"] = st["seq"]
+        self._retransmit(st, todo)
+
+    def on_file_ack(self, msg: Dict[str, str], addr_ip: str):
+        fileid = msg.get("FILEID", "")
+        try:
+            cum = int(msg.get("CUM_INDEX", "-1"))
+        except ValueError:
+            return
+        sack = parse_ranges(msg.get("SACK", ""))
+        nack = parse_ranges(msg.get("MISSING", ""))  # FILE_NACK
+        try:
+            recovered = int(msg.get("RECOVERED", "0"))
+        except ValueError:
+            recovered = 0
+        now = self.ack_mgr.clock.time()
+        with self._lock:
+            st = self._out.get(fileid)
+            if not st or msg.get("FROM") != st["to"]:
+                return
+            if not st["accepted"]:
+                # the receiver accepted the offer (FILE_ACK with CUM_INDEX -1): start sending
+                st["accepted"] = True
+                st["started"] = now
+            unacked = st["unacked"]
+            before = len(unacked)
+            acked_seq = st["acked_seq"]
+            newest = None
+            for i in list(unacked):
+                if i <= cum or any(a <= i <= b for a, b in sack):
+                    ent = unacked.pop(i)
+                    if ent[2] > acked_seq:
+                        acked_seq = ent[2]
+                        newest = ent
+            st["acked_seq"] = acked_seq
+            # the newest chunk this FILE_ACK covers times the round trip, if it went only once
+            # (Karn); the gap between FILE_ACKs is not an RTT
+            rtt = now - newest[1] if newest is not None and newest[3] == 1 else None
+            newly = before - len(unacked)
+            progressed = newly > 0 or cum > st["cum"]
+            st["cum"] = max(st["cum"], cum)
+            st["recovered"] = max(st["recovered"], recovered)
+            done = st["cum"] >= st["total"] - 1
+            if newly and acked_seq > st["recover"]:
+                # additive increase (slow start below ssthresh); none while repairing a loss
+                cwnd = st["cwnd"]
+                cwnd += newly if cwnd < st["ssthresh"] else newly / cwnd
+                st["cwnd"] = min(cwnd, float(FILE_CWND_MAX))
+            todo = []
+            fresh = []
+            if not done:
+                # a chunk is lost (not reordered) once FILE_DUP_THRESH chunks sent after it
+                # were acknowledged -- or all of them, when fewer are in flight (small window).
+                # Send order is compared, not indices, so a lost retransmission is caught too.
+                # A FILE_NACK names lost chunks outright: those go again if something sent
+                # after them arrived, or (idle NACK) their last copy is an SRTT old.
+                in_flight = st["seq"] - acked_seq  # sends after the newest acknowledged one
+                lost_seq = 0
+                srtt = (self.ack_mgr.srtt_of((st["ip"], st["port"])) or 0.0) if nack else 0.0
+                for i in sorted(unacked):
+                    if len(todo) >= FILE_RETX_BURST:
+                        break
+                    ent = unacked[i]
+                    after = acked_seq - ent[2]
+                    if ((after > 0 and after >= min(FILE_DUP_THRESH, after + in_flight))
+                            or (nack and (after > 0 or now - ent[1] >= srtt) and any(a <= i <= b for a, b in nack))):
+                        lost_seq = max(lost_seq, ent[2])
+                        self._stamp(st, ent, now)
+                        todo.append(i)
+                if lost_seq > st["recover"]:
+                    # multiplicative decrease, once per window of data
+                    st["ssthresh"] = max(st["cwnd"] / 2, float(FILE_CWND_MIN))
+                    st["cwnd"] = st["ssthresh"]
+                    st["recover"] = st["seq"]
+                todo += self._stale(st, now, FILE_RETX_BURST - len(todo), skip=todo)
+                st["lost"] += len(todo)
+                fresh = self._fill(st, now)
+            else:
+                del self._out[fileid]
+                self._loss[st["to"]] = self._loss_rate(st)  # where the next transfer starts
+                self._close_source(fileid)
+                if st["probe"] is not None:
+                    st["probe"].cancel()
+                if st["size"]:
+                    self._report_goodput(fileid, st, now)
+            outstanding = bool(unacked)
+        if rtt is not None:
+            self.ack_mgr.sample((st["ip"], st["port"]), rtt)
+        if done or progressed:
+            self.ack_mgr.discard(st["key"])  # progress restarts the transfer's timer
+            if not done and outstanding:
+                self._track_transfer(st)
+        elif nack and outstanding:
+            self._track_transfer(st)  # the receiver is alive and asking: no timeout yet
+        if todo:
+            self._retransmit(st, todo)
+        if fresh:
+            self._send_new(st, fresh)
+        elif progressed and not done:
+            self._arm_probe(st)
+
+    def on_resume(self, msg: Dict[str, str], addr_ip: str):
+        # the receiver accepted and already holds part of the file: send only what it lacks
+        fileid = msg.get("FILEID", "")
+        now = self.ack_mgr.clock.time()
+        with self._lock:
+            st = self._out.get(fileid)
+            if not st or msg.get("FROM") != st["to"] or st["accepted"]:
+                return
+            want = sorted((max(a, 0), min(b, st["total"] - 1)) for a, b in parse_ranges(msg.get("MISSING", "")))
+            want = deque((a, b) for a, b in want if a <= b)
+            if not want:
+                return
+            count = sum(b - a + 1 for a, b in want)
+            st.update(accepted=True, started=now, want=want, next=want[0][0])
+            st["size"] = min(st["size"], count * st["chunk_size"])
+            fresh = self._fill(st, now)
+        print(f"Resuming file {fileid} to {st['to']}: {count} of {st['total']} chunks to send")
+        self._send_new(st, fresh)
+
+    def _report_goodput(self, fileid: str, st: Dict, now: float):
+        secs = max(now - st["started"], 1e-6)
+        rate = st["size"] / secs / 1024
+        self.last_goodput = {"fileid": fileid, "bytes": st["size"], "seconds": round(secs, 3),
+                             "kib_per_sec": round(rate, 1)}
+        print(f"File {fileid} sent to {st['to']}: {st['size']} bytes in {secs:.2f}s ({rate:.0f} KiB/s)")
+
+    def on_received(self, msg: Dict[str, str], addr_ip: str):
+        # the receiver has the whole file (or ignored the offer): release the source, and
+        # settle a FILE_ACK transfer whose last FILE_ACK was lost
+        fileid = msg.get("FILEID", "")
+        with self._lock:
+            st = self._out.get(fileid)
+            if st and msg.get("FROM") != st["to"]:
+                return
+            self._out.pop(fileid, None)
+            mids = self._close_source(fileid)
+        if st:
+            self.ack_mgr.discard(st["key"])
+        if mids:
+            # chunks whose ACKs were lost: the file arrived, stop retrying them
+            self.ack_mgr.discard(mids)
+        if (st or mids) and msg.get("STATUS") == "ALREADY_HAVE":
+            print(f"File {fileid}: {msg.get('FROM', '')} already has it, nothing sent.")
+        elif (st or mids) and msg.get("STATUS") == "IGNORED":
+            print(f"File {fileid}: {msg.get('FROM', '')} ignored it.")
+
+    def on_fail(self, mid: str):
+        if mid.startswith("FILE:"):
+            with self._lock:
+                st = self._out.pop(mid[5:], None)
+                self._close_source(mid[5:])
+            if st:
+                print(f"File {mid[5:]} to {st['to']} failed: no FILE_ACK progress.")
+                if self.pmtu:
+                    self.pmtu.forget(st["to"])  # in case the chunks no longer fit the path
 
     # ---------- receiver side ----------
     def on_offer(self, msg: Dict[str, str], addr_ip: str):
@@ -85,25 +1026,186 @@ class FileTransfers:
         token_ok = validate_token(msg.get("TOKEN",""), "file", sender)
         if not token_ok: return
         fileid = msg.get("FILEID","")
+        digest = msg.get("HASH", "")
+        if digest:
+            try:
+                have = self.hashes.find("inbox", digest, int(msg.get("FILESIZE", "-1")))
+            except ValueError:
+                have = None
+            if have:
+                # the same bytes are here already (from anyone, under any name): skip the transfer
+                self.dedup_skips += 1
+                print(f'User {sender.split("@")[0]} offered {msg.get("FILENAME", "")}, already received as {have}; skipped.')
+                self._send_received(sender, fileid, "ALREADY_HAVE")
+                return
         self.rx[fileid] = {
-            "offer": msg,
+            "offer": dict(msg),  # decode every field once; the offer is read again on accept
             "accepted": False,
-            "chunks": {},
+            "sink": None,
             "total": None,
             "filename": msg.get("FILENAME","received.bin"),
             "sender": sender
         }
         # Non-verbose print
         print(f'User {sender.split("@")[0]} is sending you a file, do you accept? Use: accept {fileid}')
+        if self.peers.supports(sender, CAP_FILE_RESUME):
+            try:
+                size = int(msg.get("FILESIZE", "0"))
+                geometry = int(msg.get("TOTAL_CHUNKS", "0")), int(msg.get("CHUNK_SIZE", "0"))
+            except ValueError:
+                return
+            busy = {rx["sink"].tag for rx in list(self.rx.values()) if rx["sink"] is not None}
+            record = find_partial(os.path.dirname(self._inbox_path(self.rx[fileid])), self._journal_meta(msg), size)
+            if size > 0 and min(geometry) > 0 and record and record["FILEID"] not in busy:
+                self.rx[fileid].update(resume=record, total=geometry[0], chunk_size=geometry[1])
+                print(f"  (part of {record.get('FILENAME', '')} was already received; accepting resumes it)")
+
+    @staticmethod
+    def _inbox_path(st: Dict) -> str:
+        #fix: save files under per-sender directories
+        # NEW: save under inbox/<sender_name>/<filename>
+        sender_name = (st.get("sender","").split("@")[0] or "unknown")
+        base_dir = os.path.join("inbox", sender_name)
+        os.makedirs(base_dir, exist_ok=True)
+        return os.path.join(base_dir, os.path.basename(st["filename"]))
+
+    @staticmethod
+    def _journal_meta(offer: Dict[str, str]) -> Dict[str, str]:
+        # what identifies "the same file" for a resume
+        return {"FROM": offer.get("FROM", ""), "FILENAME": offer.get("FILENAME", ""), "HASH": offer.get("HASH", "")}
 
     def accept(self, fileid: str):
         if fileid in self.rx:
-            self.rx[fileid]["accepted"] = True
+            st = self.rx[fileid]
+            with self._lock:
+                st["accepted"] = True
+                early = self._drop_early(st)
             print(f"Accepted file {fileid}")
+            sender = st["sender"]
+            record = st.pop("resume", None)
+            if record is not None:
+                try:
+                    sink = ChunkSink.resume(self._inbox_path(st), record, st["total"], st["chunk_size"],
+                                            self._journal_meta(st["offer"]), st["offer"].get("HASH", ""))
+                except (OSError, ValueError, KeyError) as e:
+                    self.log.warn(f"FILE: cannot resume {fileid} from {record.get('FILEID')}: {e}")
+                else:
+                    self._resume(fileid, st, sink, early)
+                    return
+            if self.peers.supports(sender, CAP_FILE_ACK):
+                # tell a windowed sender to start; repeated (AckManager) until a chunk shows up
+                key = st["accept_key"] = f"ACCEPT:{fileid}"
+                resend = lambda: self._send_file_ack(sender, fileid, -1, [])
+                resend()
+                self.ack_mgr.track(key, self.peers.endpoint_of(sender), resend=resend)
+            if early:
+                self._commit_early(fileid, st, early)
+
+    def _hold(self, fileid: str, st: Dict, mid: Optional[str], idx: int, tot: int, size: int, chunk: bytes):
+        # a chunk of an offer not accepted yet: keep it for accept(), within the budgets
+        with self._lock:
+            early = st.setdefault("early", {})
+            held = st.get("early_bytes", 0)
+            if idx in early:
+                early[idx] = early[idx][:3] + (mid, True)  # the sender's retry: safe to ACK on accept
+                return
+            if held + len(chunk) > FILE_PREACCEPT_MAX or self.rx_early + len(chunk) > FILE_PREACCEPT_BUDGET:
+                return  # not kept: unACKed, so the sender sends it again
+            early[idx] = (tot, size, chunk, mid, False)
+            st["early_bytes"] = held + len(chunk)
+            self.rx_early += len(chunk)
+            if self.sched is not None and st.get("early_timer") is None:
+                st["early_timer"] = self.sched.call_later(FILE_PREACCEPT_TTL_SEC, lambda: self._expire_early(fileid))
+
+    def _drop_early(self, st: Dict) -> Dict[int, Tuple]:
+        # called with self._lock held: release the chunks held before accept, and return them
+        timer = st.pop("early_timer", None)
+        if timer is not None:
+            timer.cancel()
+        self.rx_early -= st.pop("early_bytes", 0)
+        return st.pop("early", {})
+
+    def _expire_early(self, fileid: str):
+        with self._lock:
+            st = self.rx.get(fileid)
+            if not st or st.get("accepted") or st.get("early_timer") is None:
+                return
+            st["early_timer"] = None
+            dropped = len(self._drop_early(st))
+        self.log.info(f"FILE: {fileid} not accepted within {FILE_PREACCEPT_TTL_SEC}s; dropped {dropped} early chunks")
+
+    def _commit_early(self, fileid: str, st: Dict, early: Dict[int, Tuple]):
+        sender = st["sender"]
+        for idx in sorted(early):
+            if self.rx.get(fileid) is not st:
+                break  # complete (or ignored) already
+            tot, size, chunk, mid, _ = early[idx]
+            self._take(fileid, st, sender, mid is None, None, idx, tot, size, chunk)
+        print(f"  kept {len(early)} chunks that arrived before the accept")
+        self._ack_early(sender, early)
+
+    def _ack_early(self, sender: str, early: Dict[int, Tuple]):
+        # ACK only chunks the sender already resent (Karn: no RTT sample). An ACK for a first
+        # copy would time our accept decision as path RTT and stretch the sender's RTO; those
+        # are ACKed as duplicates when their first retry arrives.
+        mids = [e[3] for e in early.values() if e[3] and e[4]]
+        if mids and self.send_acks is not None:
+            self.send_acks(self.peers.endpoint_of(sender), sender, mids)
+
+    def _resume(self, fileid: str, st: Dict, sink: ChunkSink, early: Dict[int, Tuple]):
+        sender = st["sender"]
+        if early:
+            # chunks held before the accept go into the partial copy before MISSING is built
+            with self._lock:
+                held = sink.buffered
+                for idx, (tot, _, chunk, _, _) in early.items():
+                    if tot == sink.total and 0 <= idx < sink.total and len(chunk) <= sink.chunk_size:
+                        sink.add(idx, chunk)
+                self.rx_buffered += sink.buffered - held
+            print(f"  kept {len(early)} chunks that arrived before the accept")
+            self._ack_early(sender, early)
+        missing = sink.missing()
+        with self._lock:
+            st["sink"] = sink
+            st["cum"] = missing[0][0] - 1 if missing else sink.total - 1
+            if not missing:  # everything was on disk already
+                del self.rx[fileid]
+                self._remember_done(fileid, sender, sink.total)
+        print(f"Resuming file {fileid}: {sink.received} of {sink.total} chunks already received")
+        if not missing:
+            self._complete(fileid, sender, sink)
+            return
+        # repeated (AckManager) until a chunk shows up, like the accept FILE_ACK
+        key = st["accept_key"] = f"ACCEPT:{fileid}"
+        resend = lambda: self._send_resume(sender, fileid, missing)
+        resend()
+        self.ack_mgr.track(key, self.peers.endpoint_of(sender), resend=resend)
+
+    def _send_resume(self, sender: str, fileid: str, missing: List[Tuple[int, int]]):
+        fields = {
+            "TYPE": "FILE_RESUME",
+            "FROM": self.user_id,
+            "TO": sender,
+            "FILEID": fileid,
+            "MISSING": join_ranges(missing),
+        }
+        ip, port = self.peers.endpoint_of(sender)
+        self.tx.send_unicast(ip, port, self.encode(sender, fields), drop_for=self.loss_scope)
 
     def ignore(self, fileid: str):
         if fileid in self.rx:
-            del self.rx[fileid]
+            st = self.rx.pop(fileid)
+            with self._lock:
+                self._drop_early(st)
+            if "accept_key" in st:
+                self.ack_mgr.discard(st["accept_key"])
+            if st["sink"] is not None:
+                with self._lock:
+                    self.rx_buffered -= st["sink"].buffered
+                    if st.get("idle_timer") is not None:
+                        st.pop("idle_timer").cancel()
+                st["sink"].abort()
+            self._send_received(st["sender"], fileid, "IGNORED")  # the sender can let go of the file
             print(f"Ignored file {fileid}")
 
     def on_chunk(self, msg: Dict[str, str], addr_ip: str):
@@ -111,46 +1213,258 @@ class FileTransfers:
         if not validate_token(msg.get("TOKEN",""), "file", sender):
             return
         fileid = msg.get("FILEID","")
+        # chunks without MESSAGE_ID come from a sender that wants FILE_ACKs instead
+        cumulative = "MESSAGE_ID" not in msg
         st = self.rx.get(fileid)
         if not st or not st.get("accepted"):
-            # ignore silently per spec
-            return
-        idx = int(msg.get("CHUNK_INDEX","0"))
-        tot = int(msg.get("TOTAL_CHUNKS","1"))
-        data_b64 = msg.get("DATA","")
+            done = self._done.get(fileid)
+            if cumulative and done and done[0] == sender and "FEC" not in msg:
+                # our final FILE_ACK was lost; repeat it
+                self._send_file_ack(sender, fileid, done[1] - 1, [])
+            if not st or st["sender"] != sender or "FEC" in msg:
+                return  # ignore silently per spec
         try:
-            chunk = base64.b64decode(data_b64.encode("ascii"))
+            idx = int(msg.get("CHUNK_INDEX","0"))
+            tot = int(msg.get("TOTAL_CHUNKS","1"))
+            size = int(msg.get("CHUNK_SIZE","0"))
+            # raw bytes (binary framing) or base64 decoded without an intermediate str
+            chunk = field_payload(msg, "DATA")
+            crc = msg.get("CRC")
+            if crc is not None and int(crc, 16) != zlib.crc32(chunk):
+                self.crc_errors += 1  # damaged on the way: as good as lost
+                return
         except Exception:
             return
-        st["chunks"][idx] = chunk
-        st["total"] = tot
+        if not st.get("accepted"):
+            self._hold(fileid, st, msg.get("MESSAGE_ID"), idx, tot, size, chunk)
+            return
+        self._take(fileid, st, sender, cumulative, msg.get("FEC") if cumulative else None, idx, tot, size, chunk)
 
-        #fix: save files under per-sender directories
-        if len(st["chunks"]) == tot:
-            out = b"".join(st["chunks"][i] for i in range(tot))
-            fname = os.path.basename(st["filename"])
+    def _take(self, fileid: str, st: Dict, sender: str, cumulative: bool, parity: Optional[str],
+              idx: int, tot: int, size: int, chunk: bytes):
+        # one chunk (or parity chunk) of an accepted receive, into its ChunkSink
+        sink = st["sink"]
+        if sink is None:
+            try:
+                filesize = int(st["offer"].get("FILESIZE", "0"))
+            except ValueError:
+                filesize = 0
+            size = size or -(-filesize // max(tot, 1))
+            if tot < 1 or size < 1:
+                return
+            meta = self._journal_meta(st["offer"]) if self.peers.supports(sender, CAP_FILE_RESUME) else None
+            with self._lock:  # accept() may be committing early chunks from the CLI thread
+                sink = st["sink"]
+                if sink is None:
+                    sink = st["sink"] = ChunkSink(self._inbox_path(st), fileid, tot, size, filesize, meta,
+                                                  sha256=st["offer"].get("HASH", ""))
+                    st["total"] = tot
+        if not (0 <= idx < sink.total) or len(chunk) > sink.chunk_size or tot != sink.total:
+            return
+        if "accept_key" in st:
+            # the sender heard our accept; the first chunk doubles as its RTT sample
+            self.ack_mgr.acked(st.pop("accept_key"))
+        ack = hole = None
+        with self._lock:  # shared with the delayed FILE_ACK and idle timers
+            if parity is not None:
+                got = self._fec_parity(st, sink, parity, chunk)
+                if got is None:
+                    return
+                idx, chunk = got  # repaired: carry on as if it had arrived
+            opens_hole = idx > st.get("cum", -1) + 1 and not sink.has(idx - 1)
+            held = sink.buffered
+            dup = not sink.add(idx, chunk)
+            if not dup and st.get("fec"):
+                self._fec_repair(st, sink, idx)
+            self.rx_buffered += sink.buffered - held
+            if self.rx_buffered > FILE_RX_BUFFER_BUDGET:
+                # over the global budget: write this transfer's pending run out now
+                self.rx_buffered -= sink.buffered
+                sink.flush()
 
-            # NEW: save under inbox/<sender_name>/<filename>
-            sender_name = (st.get("sender","").split("@")[0] or "unknown")
-            base_dir = os.path.join("inbox", sender_name)
-            os.makedirs(base_dir, exist_ok=True)
-            path = os.path.join(base_dir, fname)
+            if cumulative:
+                cum = st.get("cum", -1)
+                filled = idx == cum + 1 and idx + 1 < tot and sink.has(idx + 1)
+                while cum + 1 < tot and sink.has(cum + 1):
+                    cum += 1
+                st["cum"] = cum
+                st["unacked"] = st.get("unacked", 0) + 1
+                # the sender learns about holes (and repairs) right away; plain progress is
+                # batched, and a timer acks a partial batch (a window smaller than the batch)
+                if (dup or opens_hole or filled or sink.received == 1 or sink.complete
+                        or st["unacked"] >= FILE_ACK_EVERY):
+                    ack = self._take_file_ack(st)
+                elif self.sched is not None and st.get("ack_timer") is None:
+                    st["ack_timer"] = self.sched.call_later(FILE_ACK_DELAY_SEC, lambda: self._flush_file_ack(fileid))
+                if self.sched is not None and self.peers.supports(sender, CAP_FILE_NACK):
+                    st["last_rx"], st["nacks"] = self.sched.time(), 0
+                    if opens_hole and not dup:
+                        j = idx - 1
+                        while j > cum and not sink.has(j):
+                            j -= 1
+                        hole = [(j + 1, idx - 1)]
+                    if st.get("idle_timer") is None and not sink.complete:
+                        self._arm_idle(fileid, st, self._idle_after(sender))
+            complete = sink.complete and not dup
+            if complete:
+                self.rx_buffered -= sink.buffered
+                del self.rx[fileid]
+                if st.get("idle_timer") is not None:
+                    st.pop("idle_timer").cancel()
+                self._remember_done(fileid, sender, tot)
+        if ack:
+            self._send_file_ack(sender, fileid, *ack, missing=hole)
+        if complete:
+            self._complete(fileid, sender, sink)
 
-            with open(path, "wb") as f:
-                f.write(out)
+    # ---------- parity (CAP_FILE_FEC), all called with self._lock held ----------
+    def _fec_parity(self, st: Dict, sink: ChunkSink, spec: str, data: bytes) -> Optional[Tuple[int, bytes]]:
+        # a parity chunk repairs the one chunk of its set still missing, or waits for that
+        try:
+            span, _, k = spec.partition("/")
+            a, _, b = span.partition("-")
+            key = a, b, k = int(a), int(b or a), int(k or 1)
+        except ValueError:
+            return None
+        if not (0 <= a <= b < sink.total and k > 0 and (b - a) % k == 0 and (b - a) // k < FILE_FEC_MAX_GROUP):
+            return None
+        held = st.setdefault("fec", OrderedDict())
+        held[key] = data
+        got = self._fec_try(st, sink, key)
+        while len(held) > FILE_FEC_KEEP:
+            held.popitem(last=False)
+        return got
 
-            print(f'📥 File saved to {path}')
+    def _fec_try(self, st: Dict, sink: ChunkSink, key: Tuple[int, int, int]) -> Optional[Tuple[int, bytes]]:
+        a, b, k = key
+        lost = [i for i in range(a, b + 1, k) if not sink.has(i)]
+        if len(lost) > 1:
+            return None
+        data = st["fec"].pop(key)
+        n = sink.length(lost[0]) if lost else None
+        if n is None:  # nothing to repair (or a last chunk of unknown length)
+            return None
+        acc = int.from_bytes(data, "little")
+        for j in range(a, b + 1, k):
+            if j != lost[0]:
+                acc ^= int.from_bytes(sink.read(j), "little")
+        st["recovered"] = st.get("recovered", 0) + 1
+        self.fec_recovered += 1
+        return lost[0], acc.to_bytes(max(len(data), n), "little")[:n]
 
-            # notify FILE_RECEIVED (unchanged)
-            ip, port = self.peers.endpoint_of(sender)
-            ack_msg = build_message({
-                "TYPE": "FILE_RECEIVED",
-                "FROM": self.user_id,
-                "TO": sender,
-                "FILEID": fileid,
-                "STATUS": "COMPLETE",
-                "TIMESTAMP": str(now_ts())
-            })
-            self.tx.send_unicast(ip, port, ack_msg, drop_for=self.loss_scope)
-            del self.rx[fileid]
+    def _fec_repair(self, st: Dict, sink: ChunkSink, index: int):
+        # chunk `index` just arrived: sets holding it may be down to one missing chunk
+        todo = [index]
+        while todo:
+            i = todo.pop()
+            for key in [key for key in st["fec"] if key[0] <= i <= key[1] and (i - key[0]) % key[2] == 0]:
+                got = key in st["fec"] and self._fec_try(st, sink, key)
+                if got and sink.add(*got):
+                    todo.append(got[0])
+
+    def _remember_done(self, fileid: str, sender: str, total: int):
+        # called with self._lock held
+        self._done[fileid] = (sender, total)
+        while len(self._done) > 64:
+            self._done.popitem(last=False)
 
+    def _complete(self, fileid: str, sender: str, sink: ChunkSink):
+        try:
+            path = sink.finish()
+        except ValueError as e:
+            print(f"File {fileid} from {sender.split('@')[0]} discarded: {e}")
+            return
+        if sink.digest:
+            self.hashes.add(path, sink.digest, "inbox")  # found by the next offer of the same file
+        print(f'📥 File saved to {path}')
+        self._send_received(sender, fileid, "COMPLETE")
+
+    def _send_received(self, sender: str, fileid: str, status: str):
+        # notify FILE_RECEIVED (unchanged); STATUS ALREADY_HAVE or IGNORED answers an offer instead
+        ip, port = self.peers.endpoint_of(sender)
+        ack_msg = self.encode(sender, {
+            "TYPE": "FILE_RECEIVED",
+            "FROM": self.user_id,
+            "TO": sender,
+            "FILEID": fileid,
+            "STATUS": status,
+            "TIMESTAMP": str(now_ts())
+        })
+        self.tx.send_unicast(ip, port, ack_msg, drop_for=self.loss_scope)
+
+    def _idle_after(self, sender: str) -> float:
+        peer = self.peers.endpoint_of(sender)
+        # the RTT is sampled when the sender answers our accept. Never sooner than the RTO
+        # (ACK_TIMEOUT_SEC without a sample): an earlier NACK races chunks that are only late
+        return max(2 * (self.ack_mgr.srtt_of(peer) or 0.0), self.ack_mgr.rto_of(peer))
+
+    def _arm_idle(self, fileid: str, st: Dict, delay: float):
+        # called with self._lock held
+        st["idle_timer"] = self.sched.call_later(delay, lambda: self._on_idle(fileid))
+
+    def _on_idle(self, fileid: str):
+        # one timer per receive: re-armed lazily from the last chunk's arrival time
+        now = self.sched.time()
+        with self._lock:
+            st = self.rx.get(fileid)
+            if not st or st.get("idle_timer") is None:
+                return
+            sender = st["sender"]
+            wait = st["last_rx"] + self._idle_after(sender) * (1 << st["nacks"]) - now
+            if wait > 0:
+                self._arm_idle(fileid, st, wait)
+                return
+            if st["nacks"] >= FILE_NACK_MAX:
+                st["idle_timer"] = None
+                stalled = True
+            else:
+                # nothing for a while: ask for every chunk still missing
+                st["nacks"] += 1
+                st["last_rx"] = now
+                self._arm_idle(fileid, st, self._idle_after(sender) * (1 << st["nacks"]))
+                ack, missing = self._take_file_ack(st), st["sink"].missing()
+                stalled = False
+        if stalled:
+            print(f"File {fileid} from {sender.split('@')[0]} stalled: no chunks after {FILE_NACK_MAX} requests.")
+            return
+        self._send_file_ack(sender, fileid, *ack, missing=missing)
+
+    def _take_file_ack(self, st: Dict) -> Tuple[int, List[Tuple[int, int]], int]:
+        # called with self._lock held: (CUM_INDEX, the first FILE_SACK_MAX_RANGES ranges held
+        # above it, chunks repaired from parity), resets the batch
+        st["unacked"] = 0
+        timer = st.pop("ack_timer", None)
+        if timer is not None:
+            timer.cancel()
+        cum, sink = st["cum"], st["sink"]
+        return cum, sink.held(cum + 1), st.get("recovered", 0)
+
+    def _flush_file_ack(self, fileid: str):
+        with self._lock:
+            st = self.rx.get(fileid)
+            if not st or st.get("ack_timer") is None:
+                return
+            st["ack_timer"] = None
+            ack = self._take_file_ack(st) if st["unacked"] else None
+        if ack:
+            self._send_file_ack(st["sender"], fileid, *ack)
+
+    def _send_file_ack(self, sender: str, fileid: str, cum: int, above: List[Tuple[int, int]], recovered: int = 0,
+                       missing: Optional[List[Tuple[int, int]]] = None):
+        fields = {
+            "TYPE": "FILE_NACK" if missing else "FILE_ACK",
+            "FROM": self.user_id,
+            "TO": sender,
+            "FILEID": fileid,
+            "CUM_INDEX": str(cum),
+        }
+        if above:
+            fields["SACK"] = join_ranges(above)
+        if missing:
+            fields["MISSING"] = join_ranges(missing)
+            self.file_nacks_sent += 1
+        if recovered:
+            fields["RECOVERED"] = str(recovered)
+        ip, port = self.peers.endpoint_of(sender)
+        self.file_acks_sent += 1
+        self.tx.send_unicast(ip, port, self.encode(sender, fields), drop_for=self.loss_scope)
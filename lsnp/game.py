@@ -1,7 +1,8 @@
 from typing import Dict, Tuple
-from .messages import build_message, new_message_id
+from .messages import new_message_id
 from .tokens import make_token, validate_token
 from .utils import now_ts
+from .templates import MessageTemplate, TemplateCache, encode_text
 
 WIN_LINES = [
     (0,1,2),(3,4,5),(6,7,8),
@@ -20,32 +21,32 @@ class TicTacToe:
     Stateless wire, stateful local: we maintain game per GAMEID.
     Duplicate detection: (GAMEID, TURN).
     """
-    def __init__(self, user_id: str, tx, peers, ack_mgr, log, loss_scope="game"):
+    def __init__(self, user_id: str, tx, peers, ack_mgr, log, loss_scope="game", encode=None, templates=None):
         self.user_id = user_id
         self.tx = tx
         self.peers = peers
         self.ack_mgr = ack_mgr
         self.log = log
         self.loss_scope = loss_scope
+        # encode(to_user, fields, template=None) -> str | bytes; picks the wire format the peer understands
+        self.encode = encode or encode_text
+        self.templates = templates or TemplateCache()
         # GAMEID -> {board:str(9), next_turn:int, my_symbol:str, opp_symbol:str, last_turn_seen:int, opponent:str}
         self.games: Dict[str, Dict] = {}
-        # resend builders
-        self._resenders: Dict[str, callable] = {}
 
-    def _send_and_track(self, ip, port, msg_dict):
+    def _send_and_track(self, ip, port, msg_dict, template=None):
         if "MESSAGE_ID" not in msg_dict:
             msg_dict["MESSAGE_ID"] = new_message_id()
         mid = msg_dict["MESSAGE_ID"]
-        raw = build_message(msg_dict)
-
-        # remember how to resend this exact message
-        self._resenders[mid] = lambda: self.tx.send_unicast(ip, port, build_message(msg_dict), drop_for=self.loss_scope)
+        to_user = msg_dict.get("TO") or (template.static.get("TO", "") if template else "")
+        raw = self.encode(to_user, msg_dict, template)
 
         # self.tx.send_unicast(ip, raw, drop_for=self.loss_scope)
         # fix: include port in send_unicast
         self.tx.send_unicast(ip, port, raw, drop_for=self.loss_scope)
 
-        self.ack_mgr.track(mid)
+        # the AckManager entry keeps how to resend this exact message (dropped on ACK/failure)
+        self.ack_mgr.track(mid, (ip, port), resend=lambda: self.tx.send_unicast(ip, port, raw, drop_for=self.loss_scope))
 
     def invite(self, to_user: str, gameid: str, symbol: str, ttl=3600):
         # ip = self.peers.address_of(to_user)
@@ -81,18 +82,23 @@ class TicTacToe:
         # fix: use endpoint_of to get both ip and port
         ip, port = self.peers.endpoint_of(to_user)
 
-        tok = make_token(self.user_id, now_ts() + ttl, "game")
+        # one header per game and opponent; only POSITION/TURN change between moves
+        def build():
+            issued = now_ts()
+            return MessageTemplate({
+                "TYPE": "TICTACTOE_MOVE",
+                "FROM": self.user_id,
+                "TO": to_user,
+                "GAMEID": gameid,
+                "SYMBOL": symbol,
+                "TOKEN": make_token(self.user_id, issued + ttl, "game"),
+            }, expires=issued + ttl // 2)
+        tmpl = self.templates.get(("TICTACTOE_MOVE", gameid, to_user, symbol, ttl), build)
         msg = {
-            "TYPE": "TICTACTOE_MOVE",
-            "FROM": self.user_id,
-            "TO": to_user,
-            "GAMEID": gameid,
             "POSITION": str(position),
-            "SYMBOL": symbol,
             "TURN": str(turn),
-            "TOKEN": tok
         }
-        self._send_and_track(ip, port, msg)
+        self._send_and_track(ip, port, msg, template=tmpl)
 
         #fix: update & also show the board locally for the mover
         st = self.games.setdefault(gameid, {
@@ -185,4 +191,4 @@ class TicTacToe:
             "WINNING_LINE": line,
             "TIMESTAMP": str(now_ts())
         }
-        self.tx.send_unicast(ip, port, build_message(msg), drop_for=self.loss_scope)
\ No newline at end of file
+        self.tx.send_unicast(ip, port, self.encode(to_user, msg), drop_for=self.loss_scope)
\ No newline at end of file
@@ -1,25 +1,162 @@
+import binascii
+import re
+import sys
 import random
-from typing import Dict, Tuple
-from .utils import now_ts, normalize_key
+from collections.abc import Mapping
+from typing import Dict, Tuple, Union
+from .utils import now_ts, normalize_key, KEY_ALIASES
 from .constants import DEFAULT_TTL_SEC
 
-def parse_message(raw: str) -> Dict[str, str]:
-    msg = {}
-    for line in raw.replace("\r\n", "\n").split("\n"):
-        if ":" in line:
-            k, v = line.split(":", 1)
-            msg[normalize_key(k.strip().upper())] = v.strip()
-    return msg
+# Keys used by LSNP messages. Parsing maps the raw key text straight to one interned
+# canonical str with a dict lookup; only unseen spellings go through normalize_key.
+# The binary framing (binwire) numbers fields by position here: append new keys only.
+KNOWN_KEYS = (
+    "TYPE", "FROM", "TO", "USER_ID", "MESSAGE_ID", "TOKEN", "TIMESTAMP", "TTL", "STATUS",
+    "CONTENT", "DISPLAY_NAME", "PORT", "AVATAR_TYPE", "AVATAR_ENCODING", "AVATAR_DATA",
+    "POST_TIMESTAMP", "ACTION", "SCOPE",
+    "FILEID", "FILENAME", "FILESIZE", "FILETYPE", "DESCRIPTION",
+    "CHUNK_INDEX", "TOTAL_CHUNKS", "CHUNK_SIZE", "DATA",
+    "GAMEID", "POSITION", "SYMBOL", "TURN", "RESULT", "WINNING_LINE",
+    "GROUP_ID", "GROUP_NAME", "MEMBERS", "ADD", "REMOVE",
+    "CAPS", "CUM_INDEX", "SACK", "MISSING", "SIZE", "PAD", "FEC", "RECOVERED", "HASH", "CRC",
+)
+_MAX_KEY_CACHE = 512
+
+def _seed_keys() -> Dict[str, str]:
+    table = {}
+    for k in KNOWN_KEYS:
+        k = sys.intern(k)
+        for spelling in (k, k.lower(), k.title()):
+            table[spelling] = k
+    for alias, k in KEY_ALIASES.items():
+        table[alias] = sys.intern(k)
+    return table
+
+_KEYS: Dict[str, str] = _seed_keys()                                      # raw key text -> key
+_KEYS_B: Dict[bytes, str] = {k.encode(): v for k, v in _KEYS.items()}   # same, for bytes input
+
+def _key_of(raw_key: str) -> str:
+    key = sys.intern(normalize_key(raw_key))
+    if len(_KEYS) < _MAX_KEY_CACHE:
+        _KEYS[raw_key] = key
+    return key
+
+def _key_of_bytes(raw_key: bytes) -> str:
+    key = _key_of(raw_key.decode("utf-8", "ignore"))
+    if len(_KEYS_B) < _MAX_KEY_CACHE:
+        _KEYS_B[raw_key] = key
+    return key
+
+class WireMessage(Mapping):
+    """
+    Read-only message parsed straight from received bytes.
+    Values stay undecoded until first read; payload(key) returns the field as binary
+    (e.g. DATA) so bulk payloads never take a str round trip.
+    The header is copied out of the receive buffer once and a text DATA field is decoded
+    straight from it, so a WireMessage stays valid after the handler returns and the
+    buffer goes back to the pool.
+    Fields in `blobs` arrived as raw bytes (binary framing); reading them as str gives
+    base64 text, exactly as the text format would have carried them.
+    """
+    __slots__ = ("_raw", "_cache", "_blobs")
+
+    def __init__(self, raw: Dict[str, bytes], blobs=frozenset()):
+        self._raw = raw
+        self._cache: Dict[str, str] = {}
+        self._blobs = blobs
+
+    def __getitem__(self, key: str) -> str:
+        v = self._cache.get(key)
+        if v is None:
+            if key in self._blobs:
+                v = binascii.b2a_base64(self._raw[key], newline=False).decode("ascii")
+            else:
+                v = str(self._raw[key], "utf-8", "ignore")
+            self._cache[key] = v
+        return v
+
+    def get(self, key: str, default=None):
+        if key in self._raw:
+            return self[key]
+        return default
+
+    def payload(self, key: str) -> bytes:
+        v = self._raw[key]
+        return v if key in self._blobs else binascii.a2b_base64(v)
+
+    def __contains__(self, key) -> bool:
+        return key in self._raw
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self) -> int:
+        return len(self._raw)
+
+# PROFILE capability: FILE_CHUNK may carry DATA as raw bytes after the blank line that
+# ends the text header (its length is the rest of the datagram, at most CHUNK_SIZE)
+CAP_RAW_DATA = "RAWDATA"
+_RAW_BLOBS = frozenset({"DATA"})
+_BLANK = re.compile(rb"\n\n")
+_DATA_LINE = re.compile(rb"\nDATA:[ \t]*([^\n]*)")  # never the first line (TYPE is)
+
+def parse_message(raw: Union[str, bytes, bytearray, memoryview]) -> Mapping:
+    # one C-level split, then partition per line; keys resolve through the interned tables
+    if isinstance(raw, str):
+        msg = {}
+        keys = _KEYS
+        for line in raw.split("\n"):
+            k, sep, v = line.partition(":")
+            if sep:
+                msg[keys.get(k) or _key_of(k)] = v.strip()
+        return msg
+    values = {}
+    keys = _KEYS_B
+    data = _DATA_LINE.search(raw)
+    if data is not None and _BLANK.search(raw, 0, data.start()) is None:
+        # base64 DATA is most of a chunk: decode it straight from the buffer, copy only the rest
+        view = memoryview(raw)
+        blank = _BLANK.search(raw, data.end())
+        end = blank.start() if blank else len(view)
+        try:
+            payload = binascii.a2b_base64(view[data.start(1):data.end(1)])
+        except binascii.Error:
+            payload = None  # left in as text, so payload() raises when it is read
+        if payload is not None:
+            for line in b"".join((view[:data.start()], view[data.end():end])).split(b"\n"):
+                k, sep, v = line.partition(b":")
+                if sep:
+                    values[keys.get(k) or _key_of_bytes(k)] = v.strip()
+            values["DATA"] = payload
+            return WireMessage(values, _RAW_BLOBS)
+    head, _, body = bytes(raw).partition(b"\n\n")
+    for line in head.split(b"\n"):
+        k, sep, v = line.partition(b":")
+        if sep:
+            values[keys.get(k) or _key_of_bytes(k)] = v.strip()
+    if body and "DATA" not in values and values.get("TYPE") == b"FILE_CHUNK":
+        values["DATA"] = body  # CAP_RAW_DATA payload
+        return WireMessage(values, _RAW_BLOBS)
+    return WireMessage(values)
+
+def field_payload(msg: Mapping, key: str) -> bytes:
+    """Binary value of a base64 field such as DATA (raises binascii.Error if malformed)."""
+    if isinstance(msg, WireMessage):
+        return msg.payload(key) if key in msg else b""
+    return binascii.a2b_base64(msg.get(key, ""))
 
 def build_message(fields: Dict[str, str]) -> str:
-    # order TYPE first for readability
-    lines = []
-    if "TYPE" in fields:
-        lines.append(f"TYPE: {fields['TYPE']}")
-    for k, v in fields.items():
-        if k == "TYPE": continue
-        lines.append(f"{k}: {v}")
-    return "\n".join(lines) + "\n\n"
+    # order TYPE first for readability; one join builds the whole datagram.
+    # bytes values (raw payloads such as DATA) are carried base64-encoded.
+    t = fields.get("TYPE")
+    parts = [f"TYPE: {t}"] if t is not None else []
+    parts += [f"{k}: {v}" if v.__class__ is not bytes else f"{k}: {_b64(v)}"
+              for k, v in fields.items() if k != "TYPE"]
+    parts.append("\n")
+    return "\n".join(parts)
+
+def _b64(data: bytes) -> str:
+    return binascii.b2a_base64(data, newline=False).decode("ascii")
 
 def new_message_id() -> str:
     return f"{random.getrandbits(64):x}"
@@ -0,0 +1,149 @@
+import random
+import threading
+from typing import Callable, Dict, Optional, Set, Tuple
+
+def scope_of(mtype: str) -> str:
+    """Impairment scope of a message type (matches the drop_for kinds used when sending)."""
+    if mtype.startswith("TICTACTOE"):
+        return "game"
+    if mtype.startswith("FILE_"):
+        return "file"
+    return ""
+
+class _Direction:
+    """
+    Loss model for one direction: Bernoulli loss, optionally Gilbert-Elliott bursts.
+    GE: p = P(good->bad), r = P(bad->good), bad_loss = loss probability while bad.
+    """
+    def __init__(self, rng: random.Random, loss: float = 0.0, burst: Optional[Tuple[float,float,float]] = None):
+        self.rng = rng
+        self.loss = max(0.0, min(1.0, loss))
+        self.burst = burst
+        self.bad = False
+        self.passed = 0
+        self.dropped = 0
+
+    def active(self) -> bool:
+        return self.loss > 0 or self.burst is not None
+
+    def lose(self) -> bool:
+        p = self.loss
+        if self.burst:
+            gb, bg, bad_loss = self.burst
+            self.bad = (self.rng.random() >= bg) if self.bad else (self.rng.random() < gb)
+            if self.bad:
+                p = bad_loss
+        if p > 0 and self.rng.random() < p:
+            self.dropped += 1
+            return True
+        self.passed += 1
+        return False
+
+class NetEm:
+    """
+    Deterministic network emulator under Transport (replaces the old loss_prob coin flip).
+      - per-direction loss (tx / rx), optional Gilbert-Elliott burst loss on each
+      - egress latency + uniform jitter, reordering (held back reorder_ms), duplication
+      - egress bandwidth cap (serialization delay, packets queue behind each other)
+    All randomness comes from one seeded RNG, so the same seed and traffic give the same
+    drop pattern. Only scopes in `scopes` are impaired (default: game & file, as before);
+    "all" impairs every datagram including ACKs and discovery.
+    Delayed sends run on the app scheduler (TimerThread / AsyncioEngine).
+    """
+    def __init__(self, log, sched=None, seed: Optional[int] = None,
+                 loss: float = 0.0, rx_loss: float = 0.0,
+                 burst: Optional[Tuple[float,float,float]] = None, rx_burst: Optional[Tuple[float,float,float]] = None,
+                 delay_ms: float = 0.0, jitter_ms: float = 0.0,
+                 reorder: float = 0.0, reorder_ms: float = 10.0, duplicate: float = 0.0,
+                 rate_kbps: float = 0.0, scopes: Set[str] = frozenset({"game", "file"})):
+        self.log = log
+        self.sched = sched
+        self.rng = random.Random(seed)
+        self.tx = _Direction(self.rng, loss, burst)
+        self.rx = _Direction(self.rng, rx_loss, rx_burst)
+        self.delay = max(0.0, delay_ms) / 1000.0
+        self.jitter = max(0.0, jitter_ms) / 1000.0
+        self.reorder = reorder
+        self.reorder_hold = max(0.0, reorder_ms) / 1000.0
+        self.duplicate = duplicate
+        self.rate = rate_kbps * 1000.0 / 8.0  # bytes/sec, 0 = unlimited
+        self.scopes = set(scopes)
+        self._link_free_at = 0.0
+        self._lock = threading.Lock()  # send paths run on several threads
+        self.reordered = 0
+        self.duplicated = 0
+
+    def applies(self, scope: str) -> bool:
+        return "all" in self.scopes or (scope != "" and scope in self.scopes)
+
+    def rx_active(self) -> bool:
+        return self.rx.active()
+
+    def egress(self, scope: str, nbytes: int, send: Callable[[], None], what: str = ""):
+        """Send (possibly late, twice or never) through the emulated link."""
+        if not self.applies(scope):
+            send()
+            return
+        with self._lock:
+            if self.tx.lose():
+                self.log.drop(f"Simulated drop ({what}) for '{scope or 'all'}'")
+                return
+            copies = 1
+            if self.duplicate > 0 and self.rng.random() < self.duplicate:
+                copies = 2
+                self.duplicated += 1
+            delays = [self._egress_delay(nbytes) for _ in range(copies)]
+        for delay in delays:
+            if delay <= 0 or self.sched is None:
+                send()
+            else:
+                self.sched.call_later(delay, send)
+
+    def ingress(self, scope: str, what: str = "") -> bool:
+        """True if an inbound datagram should be delivered."""
+        if not self.applies(scope):
+            return True
+        with self._lock:
+            if not self.rx.lose():
+                return True
+        self.log.drop(f"Simulated drop ({what}) for '{scope or 'all'}'")
+        return False
+
+    def _egress_delay(self, nbytes: int) -> float:
+        d = 0.0
+        if self.rate > 0 and self.sched is not None:
+            now = self.sched.time()
+            start = max(now, self._link_free_at)
+            self._link_free_at = start + nbytes / self.rate
+            d = self._link_free_at - now
+        if self.delay or self.jitter:
+            d += max(0.0, self.delay + self.rng.uniform(-self.jitter, self.jitter))
+        if self.reorder > 0 and self.rng.random() < self.reorder:
+            self.reordered += 1
+            d += self.reorder_hold
+        return d
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "tx_passed": self.tx.passed, "tx_dropped": self.tx.dropped,
+            "rx_passed": self.rx.passed, "rx_dropped": self.rx.dropped,
+            "reordered": self.reordered, "duplicated": self.duplicated,
+        }
+
+    @classmethod
+    def from_args(cls, args, log, sched) -> Optional["NetEm"]:
+        """Build from the main() flags; None when no impairment is configured."""
+        def ge(spec):
+            if not spec:
+                return None
+            parts = [float(x) for x in spec.split(",")]
+            return (parts[0], parts[1], parts[2] if len(parts) > 2 else 1.0)
+        em = cls(log, sched, seed=args.seed, loss=args.loss, rx_loss=args.rx_loss,
+                 burst=ge(args.burst), rx_burst=ge(args.rx_burst),
+                 delay_ms=args.delay, jitter_ms=args.jitter, reorder=args.reorder,
+                 duplicate=args.dup, rate_kbps=args.rate,
+                 scopes={s.strip() for s in args.impair.split(",") if s.strip()})
+        if not (em.tx.active() or em.rx.active() or em.delay or em.jitter
+                or em.reorder or em.duplicate or em.rate):
+            return None
+        return em
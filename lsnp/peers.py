@@ -3,7 +3,7 @@ from .utils import ip_from_user_id
 
 class PeerDirectory:
     def __init__(self):
-        # user_id -> {address, port, display_name, status, avatar_type, avatar_data}
+        # user_id -> {address, port, display_name, status, avatar_type, avatar_data, caps, pmtu, pmtu_at}
         self._peers: Dict[str, Dict] = {}
 
     def upsert_from_profile(self, msg: Dict[str, str], addr_ip: str, addr_port: int):
@@ -14,6 +14,8 @@ class PeerDirectory:
         advertised = int(msg.get("PORT", "0") or "0")
         prev = self._peers.get(uid, {})
         port = advertised if advertised > 0 else (prev.get("port") or addr_port)
+        # a probed path MTU holds while the peer stays at the same endpoint
+        same = prev.get("address") == addr_ip and prev.get("port") == port
 
         self._peers[uid] = {
             "address": addr_ip,
@@ -22,11 +24,24 @@ class PeerDirectory:
             "status": msg.get("STATUS", ""),
             "avatar_type": msg.get("AVATAR_TYPE", ""),
             "avatar_data": msg.get("AVATAR_DATA", ""),
+            # optional features the peer advertised (CAPS: BIN1,...); legacy peers send none
+            "caps": frozenset(c.strip() for c in msg.get("CAPS", "").split(",") if c.strip()),
+            "pmtu": prev.get("pmtu") if same else None,
+            "pmtu_at": prev.get("pmtu_at", 0.0) if same else 0.0,
         }
 
     def get(self, user_id: str) -> Optional[Dict]:
         return self._peers.get(user_id)
 
+    def set_path_mtu(self, user_id: str, size: Optional[int], at: float):
+        p = self._peers.get(user_id)
+        if p:
+            p["pmtu"], p["pmtu_at"] = size, at
+
+    def supports(self, user_id: str, cap: str) -> bool:
+        p = self._peers.get(user_id)
+        return bool(p) and cap in p["caps"]
+
     def endpoint_of(self, user_id: str):
         """Return (ip, port) for a peer."""
         p = self._peers.get(user_id)
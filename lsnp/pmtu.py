@@ -0,0 +1,95 @@
+import threading
+import time
+from typing import Dict, Optional, Set, Tuple
+from .constants import PMTU_PROBE_SIZES, PMTU_TTL_SEC, PMTU_RETRY_SEC
+from .messages import build_message
+
+# PROFILE capability: this peer answers PMTU_PROBE with PMTU_ACK
+CAP_PMTU = "PMTU"
+
+class PathMtu:
+    """
+    Largest UDP payload that reaches each peer in one piece, cached in the peer directory.
+    probe() sends a PMTU_PROBE padded to every size of PMTU_PROBE_SIZES (plus the kernel's
+    own path MTU for the route) with the don't-fragment bit set, see Transport.send_probes;
+    the peer answers each one that arrives with PMTU_ACK, and the largest answered size
+    becomes the peer's "pmtu" for PMTU_TTL_SEC.
+    Only answered sizes count. A black hole that silently eats big DF datagrams leaves
+    the estimate at the largest size that got through, or unknown -- and unknown means
+    callers keep their old default. forget() drops an estimate that stopped working.
+    """
+    def __init__(self, user_id: str, tx, peers, log, clock=None, port: int = 0):
+        self.user_id = user_id
+        self.port = port  # sent in probes so a peer that hasn't seen our PROFILE can answer
+        self.tx = tx
+        self.peers = peers
+        self.log = log
+        self.clock = clock or time
+        self._probing: Dict[str, Tuple[float, Set[int], tuple]] = {}  # uid -> (sent at, sizes sent, endpoint)
+        self._lock = threading.Lock()
+        self.probes = 0
+
+    def get(self, uid: str) -> Optional[int]:
+        p = self.peers.get(uid)
+        if not p or not p.get("pmtu") or self.clock.time() - p["pmtu_at"] > PMTU_TTL_SEC:
+            return None
+        return p["pmtu"]
+
+    def forget(self, uid: str):
+        self.peers.set_path_mtu(uid, None, 0.0)
+
+    def maybe_probe(self, uid: str):
+        """Probe a peer that supports it unless its estimate is fresh or a probe is recent."""
+        if uid == self.user_id or not self.peers.supports(uid, CAP_PMTU) or self.get(uid):
+            return
+        with self._lock:
+            last = self._probing.get(uid)
+            if last and last[2] == self.peers.endpoint_of(uid) and self.clock.time() - last[0] < PMTU_RETRY_SEC:
+                return  # a peer that moved is probed again at once
+        self.probe(uid)
+
+    def probe(self, uid: str):
+        send = getattr(self.tx, "send_probes", None)  # real sockets only
+        ip, port = self.peers.endpoint_of(uid)
+        if send is None or not port:
+            return
+        sizes: Set[int] = set()
+        with self._lock:
+            self._probing[uid] = (self.clock.time(), sizes, (ip, port))  # before sending: acks can beat send() back
+        sent = send(ip, port, PMTU_PROBE_SIZES, lambda size: self._probe_msg(uid, size, sizes))
+        self.probes += len(sent)
+
+    def _probe_msg(self, uid: str, size: int, sizes: Set[int]) -> str:
+        sizes.add(size)
+        fields = {"TYPE": "PMTU_PROBE", "FROM": self.user_id, "TO": uid, "SIZE": str(size),
+                  "PORT": str(self.port), "PAD": ""}
+        fields["PAD"] = "x" * max(0, size - len(build_message(fields).encode("utf-8")))
+        return build_message(fields)
+
+    def on_probe(self, msg, addr_ip: str):
+        sender = msg.get("FROM", "")
+        ip, port = self.peers.endpoint_of(sender)
+        if not port:
+            try:
+                port = int(msg.get("PORT", "0"))
+            except ValueError:
+                return
+            if not port:
+                return
+        reply = {"TYPE": "PMTU_ACK", "FROM": self.user_id, "TO": sender, "SIZE": msg.get("SIZE", "0")}
+        self.tx.send_unicast(ip, port, build_message(reply))
+
+    def on_ack(self, msg, addr_ip: str):
+        sender = msg.get("FROM", "")
+        try:
+            size = int(msg.get("SIZE", "0"))
+        except ValueError:
+            return
+        with self._lock:
+            sent_at, sizes, _ = self._probing.get(sender, (0.0, (), None))
+            if size not in sizes:
+                return  # not a size we asked about (or a stale round)
+            p = self.peers.get(sender)
+            if p and p.get("pmtu_at") == sent_at and p["pmtu"] >= size:
+                return
+            self.peers.set_path_mtu(sender, size, sent_at)
@@ -0,0 +1,237 @@
+import argparse
+import contextlib
+import heapq
+import itertools
+import os
+import random
+import statistics
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Union
+from .constants import DISCOVERY_PORT
+from .timers import TimerHandle
+from .binwire import as_text, wire_bytes
+
+class VirtualClock:
+    """
+    Discrete-event clock with the scheduler interface (time / call_later).
+    run() jumps straight from one event to the next, so DISCOVERY_INTERVAL_SEC and
+    ACK_TIMEOUT_SEC elapse instantly in wall-clock terms.
+    """
+    def __init__(self, start: float = 0.0):
+        self.now = start
+        self._heap: List = []
+        self._seq = itertools.count()
+        self.events = 0
+
+    def time(self) -> float:
+        return self.now
+
+    def call_later(self, delay: float, fn: Callable[[], None]) -> TimerHandle:
+        h = TimerHandle(self.now + max(0.0, delay), fn)
+        heapq.heappush(self._heap, (h.due, next(self._seq), h))
+        return h
+
+    def run(self, until: float, stop: Optional[Callable[[], bool]] = None):
+        while self._heap and self._heap[0][0] <= until:
+            due, _, h = heapq.heappop(self._heap)
+            if h.cancelled:
+                continue
+            self.now = due
+            self.events += 1
+            h.fn()
+            if stop and stop():
+                return
+        self.now = max(self.now, until)
+
+class VirtualNetwork:
+    """
+    In-memory LAN shared by VirtualTransports. Unicast goes to one (ip, port); broadcast
+    and multicast reach every attached transport (including the sender, like a looped-back
+    socket). Every datagram arrives `latency` seconds later, and is dropped with probability
+    `loss` using a seeded RNG.
+    """
+    def __init__(self, clock: VirtualClock, latency: float = 0.0005, loss: float = 0.0, seed: Optional[int] = None):
+        self.clock = clock
+        self.latency = latency
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.endpoints: Dict[Tuple[str,int], "VirtualTransport"] = {}
+        self.sent = {"unicast": 0, "broadcast": 0, "multicast": 0}
+        self.delivered = 0
+        self.lost = 0
+        self.bytes = 0
+
+    def attach(self, t: "VirtualTransport"):
+        self.endpoints[(t.ip, t.uni_port)] = t
+
+    def send(self, src: "VirtualTransport", kind: str, dest: Optional[Tuple[str,int]], payload: bytes):
+        self.sent[kind] += 1
+        src.tx_datagrams += 1
+        src.tx_bytes += len(payload)
+        if dest is None:
+            targets = list(self.endpoints.values())
+        else:
+            t = self.endpoints.get(dest)
+            targets = [t] if t else []
+        for t in targets:
+            if self.loss and self.rng.random() < self.loss:
+                self.lost += 1
+                continue
+            self.clock.call_later(self.latency, lambda t=t: self._deliver(t, payload, (src.ip, src.uni_port)))
+
+    def _deliver(self, t: "VirtualTransport", payload: bytes, addr: Tuple[str,int]):
+        if not t.handler:
+            return
+        self.delivered += 1
+        self.bytes += len(payload)
+        t.rx_datagrams += 1
+        t.rx_bytes += len(payload)
+        try:
+            t.handler(payload, addr)
+        except Exception as e:
+            t.log.error(f"RX error: {e}")
+        if t.on_delivered:
+            t.on_delivered()
+
+class VirtualTransport:
+    """Drop-in for Transport backed by a VirtualNetwork (no sockets, no threads)."""
+    def __init__(self, net: VirtualNetwork, ip: str, log, port: int = DISCOVERY_PORT):
+        self.net = net
+        self.ip = ip
+        self.uni_port = port
+        self.log = log
+        self.netem = None
+        self.handler = None
+        self.on_delivered = None
+        self.running = False
+        self.tx_datagrams = self.rx_datagrams = 0
+        self.tx_bytes = self.rx_bytes = 0
+        self.tx_dropped = 0
+        net.attach(self)
+
+    def listen_port(self) -> int:
+        return self.uni_port
+
+    def send_unicast(self, ip: str, port: int, data: Union[str, bytes], drop_for: str = ""):
+        self.net.send(self, "unicast", (ip, port), wire_bytes(data))
+        if self.log.verbose: self.log.send(as_text(data))
+
+    def send_broadcast(self, bcast_ip: str, data: Union[str, bytes]):
+        self.net.send(self, "broadcast", None, wire_bytes(data))
+        if self.log.verbose: self.log.send(as_text(data))
+
+    def send_multicast(self, data: Union[str, bytes]):
+        self.net.send(self, "multicast", None, wire_bytes(data))
+        if self.log.verbose: self.log.send(as_text(data))
+
+    def loop(self, handler: Callable[[bytes, Tuple[str,int]], None]):
+        self.running = True
+        self.handler = handler
+
+    def stop(self):
+        self.running = False
+        self.handler = None
+
+def simulate(peers: int, duration: float, seed: Optional[int] = None, loss: float = 0.0,
+             latency_ms: float = 0.5, stagger: float = 1.0, dms: int = 0, group_size: int = 0) -> Dict:
+    """
+    Run `peers` App instances on one VirtualNetwork. Peers start uniformly within `stagger`
+    seconds; discovery runs until every directory holds every peer (or `duration` virtual
+    seconds pass). Optional workload afterwards, run for another `duration` seconds: every
+    peer sends `dms` DMs to random peers, and peer 0 creates a group of `group_size`
+    members and messages it.
+    """
+    from .app import App, build_parser  # late import: app imports this package's modules
+
+    clock = VirtualClock()
+    net = VirtualNetwork(clock, latency=latency_ms / 1000.0, loss=loss, seed=seed)
+    rng = random.Random(seed)
+    apps: List[App] = []
+    converged_at: Dict[int, float] = {}
+    sink = open(os.devnull, "w")  # peers print to the terminal; discard it
+
+    def boot(i: int):
+        n = i + 1
+        ip = f"10.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}"
+        args = build_parser().parse_args(["--name", f"p{i}", "--ip", ip, "--workers", "0"])
+        with contextlib.redirect_stdout(sink):
+            tx = VirtualTransport(net, ip, _QuietLog())
+            app = App(args, tx=tx, sched=clock)
+
+        def check(i=i, app=app):
+            if i not in converged_at and len(app.peers._peers) >= peers:
+                converged_at[i] = clock.time()
+        tx.on_delivered = check
+        apps.append(app)
+
+    t0 = time.perf_counter()
+    for i in range(peers):
+        clock.call_later(rng.uniform(0, stagger), lambda i=i: boot(i))
+    with contextlib.redirect_stdout(sink):
+        clock.run(duration, stop=lambda: len(converged_at) == peers)
+        if dms or group_size:
+            for app in apps:
+                for _ in range(dms):
+                    to = rng.choice(apps)
+                    if to is not app:
+                        app.commands["dm"](f"{to.user_id} hi from {app.display_name}")
+            if group_size and apps:
+                members = ",".join(a.user_id for a in rng.sample(apps[1:], min(group_size, len(apps) - 1)))
+                apps[0].commands["group_create"](f"g0 \"sim group\" {members}")
+                apps[0].commands["group_msg"]("g0 hello group")
+            clock.run(clock.time() + duration)
+    wall = time.perf_counter() - t0
+    sink.close()
+
+    tx = sorted(a.tx.tx_datagrams for a in apps)
+    rx = sorted(a.tx.rx_datagrams for a in apps)
+    return {
+        "peers": peers,
+        "virtual_sec": round(clock.time(), 3),
+        "wall_sec": round(wall, 3),
+        "events": clock.events,
+        "datagrams_sent": sum(net.sent.values()),
+        "sent_by_kind": dict(net.sent),
+        "deliveries": net.delivered,
+        "lost": net.lost,
+        "bytes_delivered": net.bytes,
+        "per_peer_tx": {"min": tx[0], "median": statistics.median(tx), "max": tx[-1]} if tx else {},
+        "per_peer_rx": {"min": rx[0], "median": statistics.median(rx), "max": rx[-1]} if rx else {},
+        "converged_peers": len(converged_at),
+        "convergence_sec": round(max(converged_at.values()), 4) if len(converged_at) == peers else None,
+        "ack_retries": sum(a.ack_mgr.retries for a in apps),
+        "ack_failures": sum(a.ack_mgr.failures for a in apps),
+        "ack_pending": sum(len(a.ack_mgr.pending) for a in apps),
+        "dups_suppressed": sum(a.seen.hits for a in apps),
+    }
+
+class _QuietLog:
+    """Per-peer logger stand-in: the simulator reports aggregates, not per-packet logs."""
+    verbose = False
+    def set_verbose(self, v): pass
+    def send(self, msg): pass
+    def recv(self, msg): pass
+    def drop(self, why): pass
+    def info(self, msg): pass
+    def warn(self, msg): pass
+    def error(self, msg): pass
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Simulate many LSNP peers in one process on a virtual clock")
+    p.add_argument("--peers", type=int, default=50)
+    p.add_argument("--duration", type=float, default=30.0, help="virtual seconds to run")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--loss", type=float, default=0.0, help="datagram loss probability on the virtual LAN")
+    p.add_argument("--latency", type=float, default=0.5, help="one-way latency (ms)")
+    p.add_argument("--stagger", type=float, default=1.0, help="peer start times spread over this many seconds")
+    p.add_argument("--dms", type=int, default=0, help="DMs each peer sends after discovery")
+    p.add_argument("--group-size", type=int, default=0, help="members in a group created by peer 0")
+    a = p.parse_args(argv)
+    report = simulate(a.peers, a.duration, seed=a.seed, loss=a.loss, latency_ms=a.latency,
+                      stagger=a.stagger, dms=a.dms, group_size=a.group_size)
+    print("\nSimulation Report")
+    for k, v in report.items():
+        print(f"  {k:<18}{v}")
+
+if __name__ == "__main__":
+    main()
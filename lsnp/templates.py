@@ -0,0 +1,100 @@
+import binascii
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Union
+from . import binwire
+from .messages import build_message
+from .utils import now_ts
+
+_TEXT_KEYS: Dict[str, bytes] = {}
+
+def _text_key(k: str) -> bytes:
+    kb = _TEXT_KEYS.get(k)
+    if kb is None:
+        kb = _TEXT_KEYS[k] = f"{k}: ".encode("utf-8")
+    return kb
+
+class MessageTemplate:
+    """
+    Prebuilt encoder for a message whose header barely changes between sends.
+    The static fields (TYPE first) are encoded once per wire format; render() only
+    encodes the variable fields and appends them to the cached header bytes.
+    `expires` (epoch seconds) marks when a cached TOKEN inside the header must be reissued.
+    """
+    __slots__ = ("static", "expires", "_text", "_bin")
+
+    def __init__(self, static: Dict[str, str], expires: Optional[int] = None):
+        self.static = static
+        self.expires = expires
+        self._text: Optional[bytes] = None
+        self._bin: Optional[bytes] = None
+
+    def stale(self) -> bool:
+        return self.expires is not None and now_ts() >= self.expires
+
+    def text(self, fields: Dict[str, Union[str, bytes]], raw: bool = False) -> bytes:
+        """RFC text; with raw=True a bytes DATA field follows the blank line unencoded (CAP_RAW_DATA)."""
+        if self._text is None:
+            self._text = build_message(self.static)[:-1].encode("utf-8")  # keep the blank line off
+        out = [self._text]
+        payload = None
+        for k, v in fields.items():
+            if v.__class__ is bytes:
+                if raw and k == "DATA":
+                    payload = v
+                    continue
+                out += (_text_key(k), binascii.b2a_base64(v))  # b2a_base64 ends with "\n"
+            else:
+                out += (_text_key(k), str(v).encode("utf-8"), b"\n")
+        out.append(b"\n")
+        if payload is not None:
+            out.append(payload)
+        return b"".join(out)
+
+    def binary(self, fields: Dict[str, Union[str, bytes]]) -> bytes:
+        if self._bin is None:
+            self._bin = binwire.encode(self.static)
+        return bytes(binwire.encode_into(bytearray(self._bin), fields))
+
+    def render(self, fields: Dict[str, Union[str, bytes]], binary: bool = False, raw: bool = False) -> bytes:
+        return self.binary(fields) if binary else self.text(fields, raw)
+
+class TemplateCache:
+    """
+    MessageTemplates keyed by everything their static header depends on, e.g.
+    ("PROFILE", display_name, port, caps). A changed name or port is a different key, so
+    the old template is never served again; least recently used entries fall out past
+    `limit`, and stale ones (expired token) are rebuilt on access.
+    """
+    def __init__(self, limit: int = 128):
+        self.limit = limit
+        self._items: "OrderedDict[Hashable, MessageTemplate]" = OrderedDict()
+        self._lock = threading.Lock()  # shared by the CLI, discovery and handler threads
+        self.hits = 0
+        self.builds = 0
+
+    def get(self, key: Hashable, build: Callable[[], MessageTemplate]) -> MessageTemplate:
+        with self._lock:
+            t = self._items.get(key)
+            if t is not None and not t.stale():
+                self._items.move_to_end(key)
+                self.hits += 1
+                return t
+            t = self._items[key] = build()
+            self._items.move_to_end(key)
+            self.builds += 1
+            while len(self._items) > self.limit:
+                self._items.popitem(last=False)
+            return t
+
+    def drop(self, key: Hashable):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+def encode_text(to_user: str, fields: Dict[str, Union[str, bytes]], template: Optional[MessageTemplate] = None):
+    """Default encode hook: always the RFC text format."""
+    return template.text(fields) if template is not None else build_message(fields)
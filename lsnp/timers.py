@@ -0,0 +1,74 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, List
+
+class TimerHandle:
+    def __init__(self, due: float, fn: Callable[[], None]):
+        self.due = due
+        self.fn = fn
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+def every(sched, interval: float, fn: Callable[[], None], first: float = None, log=None):
+    """Run fn every `interval` seconds on any scheduler with call_later (first run after `first`)."""
+    def tick():
+        try:
+            fn()
+        except Exception as e:
+            if log: log.error(f"Timer error: {e}")
+        sched.call_later(interval, tick)
+    return sched.call_later(interval if first is None else first, tick)
+
+class TimerThread:
+    """
+    One background thread running delayed callbacks from a min-heap (threads engine).
+    Same scheduler interface as AsyncioEngine: time(), call_later(delay, fn) -> handle.cancel().
+    """
+    def __init__(self, log):
+        self.log = log
+        self._heap: List = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.running = True
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def time(self) -> float:
+        return time.monotonic()
+
+    def call_later(self, delay: float, fn: Callable[[], None]) -> TimerHandle:
+        h = TimerHandle(self.time() + max(0.0, delay), fn)
+        with self._cond:
+            heapq.heappush(self._heap, (h.due, next(self._seq), h))
+            if self._heap[0][2] is h:
+                self._cond.notify()
+        return h
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while self.running:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    wait = self._heap[0][0] - self.time()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                if not self.running:
+                    return
+                _, _, h = heapq.heappop(self._heap)
+            if h.cancelled:
+                continue
+            try:
+                h.fn()
+            except Exception as e:
+                self.log.error(f"Timer error: {e}")
+
+    def stop(self):
+        with self._cond:
+            self.running = False
+            self._cond.notify()
@@ -1,10 +1,14 @@
 import socket
-import random
+import sys
 import threading
-from typing import Callable, Tuple
-from .constants import BUFFER_SIZE, DEFAULT_LOSS_PROB, MULTICAST_GRP, DISCOVERY_PORT
+from typing import Callable, Iterable, List, Optional, Tuple, Union
+from .constants import DEFAULT_LOSS_PROB, MULTICAST_GRP, DISCOVERY_PORT, PMTU_SAFE
 from .logger import VerboseLogger
 from .utils import join_multicast
+from .buffers import BufferPool
+from .netem import NetEm, scope_of
+from .dispatch import peek_route
+from .binwire import as_text, wire_bytes
 
 class Transport:
     """
@@ -12,11 +16,26 @@ class Transport:
       - uni_sock: bound to this instance's unicast port (unique per process)
       - disc_sock: bound to fixed DISCOVERY_PORT for multicast/broadcast discovery
     If unicast port == DISCOVERY_PORT, we reuse one socket.
+
+    Sending reuses long-lived sockets instead of opening one per datagram:
+      - unicast goes out of uni_sock, so replies come back to our advertised port
+      - bcast_sock has SO_BROADCAST set
+      - mcast_sock has TTL=1 and loopback enabled
+    Each send socket has its own lock so the ACK, discovery and CLI threads can share them.
+    Under the asyncio engine uni_sock belongs to the event loop, which queues unicast
+    sends (uni_send) until the socket is writable; a send that cannot go out is dropped
+    and counted in tx_dropped rather than blocking the caller.
+
+    Impairments (loss, latency, ...) come from an optional NetEm; a bare loss_prob still
+    works and builds a loss-only emulator for the game/file scopes.
     """
-    def __init__(self, unicast_port: int, logger: VerboseLogger, loss_prob: float = DEFAULT_LOSS_PROB):
+    def __init__(self, unicast_port: int, logger: VerboseLogger, loss_prob: float = DEFAULT_LOSS_PROB, netem: NetEm = None):
         self.uni_port = unicast_port
         self.log = logger
         self.loss_prob = max(0.0, min(1.0, loss_prob))
+        if netem is None and self.loss_prob > 0:
+            netem = NetEm(logger, loss=self.loss_prob)
+        self.netem = netem
 
         # --- unicast socket (unique per process) ---
         self.uni_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
@@ -45,50 +64,128 @@ class Transport:
         except Exception as e:
             self.log.warn(f"Multicast join failed: {e}")
 
+        # --- long-lived send sockets ---
+        self.bcast_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.bcast_sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+
+        self.mcast_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.mcast_sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        # loopback so same-host peers receive it too
+        self.mcast_sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+
+        self._uni_lock = threading.Lock()
+        self._bcast_lock = threading.Lock()
+        self._mcast_lock = threading.Lock()
+
+        # receive buffers reused across datagrams (recvfrom_into)
+        self.pool = BufferPool()
+
+        # set by AsyncioEngine: hands unicast datagrams to its loop instead of uni_sock
+        self.uni_send: Optional[Callable[[bytes, Tuple[str,int]], None]] = None
+        self.tx_dropped = 0
+
         self.running = False
 
     # convenience for discovery sender to know our port
     def listen_port(self) -> int:
         return self.uni_port
 
-    def send_unicast(self, ip: str, port: int, data: str, drop_for: str = ""):
-        if drop_for in ("game", "file") and random.random() < self.loss_prob:
-            self.log.drop(f"Simulated drop (unicast to {ip}:{port}) for '{drop_for}'")
+    # data is a text message (str) or an already-framed binary one (bytes, see binwire)
+    def send_unicast(self, ip: str, port: int, data: Union[str, bytes], drop_for: str = ""):
+        self._emit(self.uni_sock, self._uni_lock, wire_bytes(data), (ip, port), drop_for, f"unicast to {ip}:{port}")
+        if self.log.verbose: self.log.send(as_text(data))
+
+    def send_broadcast(self, bcast_ip: str, data: Union[str, bytes]):
+        self._emit(self.bcast_sock, self._bcast_lock, wire_bytes(data), (bcast_ip, DISCOVERY_PORT), "", "broadcast")
+        if self.log.verbose: self.log.send(as_text(data))
+
+    def send_multicast(self, data: Union[str, bytes]):
+        self._emit(self.mcast_sock, self._mcast_lock, wire_bytes(data), (MULTICAST_GRP, DISCOVERY_PORT), "", "multicast")
+        if self.log.verbose: self.log.send(as_text(data))
+
+    def send_probes(self, ip: str, port: int, sizes: Iterable[int], build: Callable[[int], Union[str, bytes]]) -> List[int]:
+        """
+        Path MTU probes: build(size) for each size, smallest first, from a throwaway socket
+        connected to (ip, port) with the don't-fragment bit set, so nothing goes out in
+        fragments. Where the kernel knows the route's MTU (IP_MTU) that size is probed too
+        and larger ones are not; without a DF option only sizes up to PMTU_SAFE are sent.
+        Returns the sizes that went out.
+        """
+        sent = []
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        try:
+            df = _set_dont_fragment(sock)
+            sock.connect((ip, port))
+            sizes = set(sizes)
+            if not df:
+                sizes = {s for s in sizes if s <= PMTU_SAFE}
+            else:
+                mtu = _route_mtu(sock)
+                if mtu:
+                    top = min(mtu - 28, 65507)  # IPv4 + UDP headers
+                    sizes = {s for s in sizes if s < top} | {top}
+            for size in sorted(sizes):
+                data = wire_bytes(build(size))
+                try:
+                    sock.send(data)
+                except OSError:
+                    break  # EMSGSIZE: bigger than the route allows
+                sent.append(size)
+                if self.log.verbose: self.log.send(f"PMTU probe {size} bytes to {ip}:{port}")
+        except OSError as e:
+            self.log.warn(f"PMTU probe to {ip}:{port} failed: {e}")
+        finally:
+            sock.close()
+        return sent
+
+    def _emit(self, sock, lock, payload: bytes, addr, scope: str, what: str):
+        if self.netem is None:
+            self._sendto(sock, lock, payload, addr)
+        else:
+            self.netem.egress(scope, len(payload), lambda: self._sendto(sock, lock, payload, addr), what)
+
+    def _sendto(self, sock, lock, payload: bytes, addr):
+        if sock is self.uni_sock and self.uni_send is not None:
+            self.uni_send(payload, addr)
             return
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-            s.sendto(data.encode("utf-8"), (ip, port))
-        self.log.send(data.strip())
-
-    def send_broadcast(self, bcast_ip: str, data: str):
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            s.sendto(data.encode("utf-8"), (bcast_ip, DISCOVERY_PORT))
-        self.log.send(data.strip())
-
-    def send_multicast(self, data: str):
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as s:
-            s.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
-            # loopback so same-host peers receive it too
-            s.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
-            s.sendto(data.encode("utf-8"), (MULTICAST_GRP, DISCOVERY_PORT))
-        self.log.send(data.strip())
-
-    def loop(self, handler: Callable[[str, Tuple[str,int]], None]):
+        with lock:
+            try:
+                sock.sendto(payload, addr)
+            except BlockingIOError:
+                self.tx_dropped += 1  # send buffer full: lost, as on a congested link
+
+    def deliver(self, handler: Callable[[memoryview, Tuple[str,int]], None], data, addr: Tuple[str,int]):
+        """
+        Hand one received datagram (bytes or a memoryview into a pooled buffer) to the
+        packet handler. Nothing is decoded here; the view is only valid until handler returns.
+        """
+        if self.netem is not None and self.netem.rx_active():
+            mtype, _ = peek_route(data)
+            if not self.netem.ingress(scope_of(mtype), f"from {addr[0]}:{addr[1]}"):
+                return
+
+        # self.log.recv(txt.strip())
+
+        #fix: include address in verbose log
+        if self.log.verbose:
+            self.log.recv(f"{addr[0]}:{addr[1]}\n{as_text(bytes(data))}")
+
+        handler(data, addr)
+
+    def loop(self, handler: Callable[[memoryview, Tuple[str,int]], None]):
         self.running = True
 
         def recv_loop(sock):
             while self.running:
+                buf = self.pool.acquire()
                 try:
-                    data, addr = sock.recvfrom(BUFFER_SIZE)
-                    txt = data.decode("utf-8", errors="ignore")
-                    # self.log.recv(txt.strip())
-
-                    #fix: include address in verbose log
-                    self.log.recv(f"{addr[0]}:{addr[1]}\n{txt.strip()}")
-                    
-                    handler(txt, addr)
+                    n, addr = sock.recvfrom_into(buf)
+                    with memoryview(buf) as view:
+                        self.deliver(handler, view[:n], addr)
                 except Exception as e:
                     self.log.error(f"RX error: {e}")
+                finally:
+                    self.pool.release(buf)
 
         threading.Thread(target=recv_loop, args=(self.uni_sock,), daemon=True).start()
         if self.disc_sock is not self.uni_sock:
@@ -101,3 +198,33 @@ class Transport:
         if self.disc_sock is not self.uni_sock:
             try: self.disc_sock.close()
             except: pass
+        for s in (self.bcast_sock, self.mcast_sock):
+            try: s.close()
+            except: pass
+
+# don't-fragment socket options: Linux, BSD/macOS, Windows (not all are exported by socket)
+_IP_MTU_DISCOVER = getattr(socket, "IP_MTU_DISCOVER", 10 if sys.platform.startswith("linux") else None)
+_IP_PMTUDISC_DO = getattr(socket, "IP_PMTUDISC_DO", 2)
+_IP_MTU = getattr(socket, "IP_MTU", 14 if sys.platform.startswith("linux") else None)
+_IP_DONTFRAG = getattr(socket, "IP_DONTFRAG", 28 if sys.platform == "darwin" or "bsd" in sys.platform else None)
+_IP_DONTFRAGMENT = getattr(socket, "IP_DONTFRAGMENT", 14 if sys.platform == "win32" else None)
+
+def _set_dont_fragment(sock) -> bool:
+    for opt, val in ((_IP_MTU_DISCOVER, _IP_PMTUDISC_DO), (_IP_DONTFRAG, 1), (_IP_DONTFRAGMENT, 1)):
+        if opt is None:
+            continue
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, opt, val)
+            return True
+        except OSError:
+            continue
+    return False
+
+def _route_mtu(sock) -> int:
+    # the kernel's path MTU for a connected socket (interface MTU, or lower if ICMP said so)
+    if _IP_MTU is None:
+        return 0
+    try:
+        return sock.getsockopt(socket.IPPROTO_IP, _IP_MTU)
+    except OSError:
+        return 0
@@ -43,14 +43,17 @@ def join_multicast(sock: socket.socket, group: str, port: int) -> None:
     # ensure multicast TTL=1
     sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
 
+# spellings seen in the wild -> canonical key (looked up after upper() and space removal)
+KEY_ALIASES = {
+    "MESSAGEID": "MESSAGE_ID",
+    "GAMED": "GAMEID",
+    "USERID": "USER_ID",
+    "GROUPID": "GROUP_ID",
+    "AVATARDATA": "AVATAR_DATA",
+    "AVATARENCODING": "AVATAR_ENCODING",
+    "AVATARTYPE": "AVATAR_TYPE",
+}
+
 def normalize_key(k: str) -> str:
     k = k.strip().upper().replace(" ", "")
-    if k in ("MESSAGEID", "MESSAGE_ID"): return "MESSAGE_ID"
-    if k in ("GAMEID", "GAMED"):         return "GAMEID"
-    if k in ("USERID", "USER_ID"):       return "USER_ID"
-    if k in ("GROUPID", "GROUP_ID"):     return "GROUP_ID"
-    if k in ("AVATARDATA","AVATAR_DATA"):       return "AVATAR_DATA"
-    if k in ("AVATARENCODING","AVATAR_ENCODING"): return "AVATAR_ENCODING"
-    if k in ("AVATARTYPE","AVATAR_TYPE"):         return "AVATAR_TYPE"
-    return k
-
+    return KEY_ALIASES.get(k, k)